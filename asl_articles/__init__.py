@@ -8,10 +8,9 @@ import logging.config
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.exc import SQLAlchemyError
-import yaml
 
 from asl_articles.config.constants import BASE_DIR
-from asl_articles.utils import to_bool
+from asl_articles.utils import to_bool, LazyView
 
 _disable_db_startup = False
 
@@ -75,6 +74,7 @@ _load_config( _cfg, _fname, "Debug" )
 # initialize logging
 _fname = os.path.join( config_dir, "logging.yaml" )
 if os.path.isfile( _fname ):
+    import yaml # nb: we only need this if there's a logging config
     with open( _fname, "r" ) as fp:
         logging.config.dictConfig( yaml.safe_load( fp ) )
 else:
@@ -111,10 +111,25 @@ import asl_articles.authors #pylint: disable=cyclic-import
 import asl_articles.scenarios #pylint: disable=cyclic-import
 import asl_articles.images #pylint: disable=cyclic-import
 import asl_articles.tags #pylint: disable=cyclic-import
-import asl_articles.docs #pylint: disable=cyclic-import
-import asl_articles.db_report #pylint: disable=cyclic-import
+import asl_articles.changes #pylint: disable=cyclic-import
+import asl_articles.batch #pylint: disable=cyclic-import
 import asl_articles.utils #pylint: disable=cyclic-import
 
+# register routes that are rarely used
+# NOTE: The modules that handle these aren't loaded until they are first used, to speed up startup.
+for _rule, _view_name, _methods in [
+    ( "/docs/<path:path>", "asl_articles.docs.get_external_doc", None ),
+    ( "/user-files/<path:path>", "asl_articles.docs.get_user_file", None ),
+    ( "/db-report/row-counts", "asl_articles.db_report.get_db_row_counts", None ),
+    ( "/db-report/links", "asl_articles.db_report.get_db_links", None ),
+    ( "/db-report/check-link", "asl_articles.db_report.check_db_link", ["POST"] ),
+    ( "/db-report/check-links", "asl_articles.db_report.start_check_db_links", ["POST"] ),
+    ( "/db-report/check-links/<job_id>", "asl_articles.db_report.get_check_db_links_status", None ),
+    ( "/db-report/check-links/<job_id>/stop", "asl_articles.db_report.stop_check_db_links", ["POST"] ),
+    ( "/db-report/images", "asl_articles.db_report.get_db_images", None ),
+]:
+    app.add_url_rule( _rule, view_func=LazyView(_view_name), methods=_methods )
+
 # initialize
 asl_articles.utils.load_html_whitelists( app )
 
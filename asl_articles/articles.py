@@ -3,19 +3,23 @@
 import datetime
 import base64
 import logging
+from collections import defaultdict
 
 from flask import request, jsonify, abort
+from sqlalchemy.orm import selectinload, joinedload
 from sqlalchemy.sql.expression import func
 
 from asl_articles import app, db
-from asl_articles.models import Article, Author, ArticleAuthor, Scenario, ArticleScenario, ArticleImage
+from asl_articles.models import Article, Author, ArticleAuthor, Scenario, ArticleScenario
 from asl_articles.authors import get_author_vals
 from asl_articles.scenarios import get_scenario_vals
 import asl_articles.publications
 import asl_articles.publishers
+from asl_articles.images import save_image, remove_images, get_image_version
 from asl_articles import search
+from asl_articles.versions import log_changes
 from asl_articles.utils import get_request_args, clean_request_args, clean_tags, encode_tags, decode_tags, \
-    apply_attrs, make_ok_response
+    apply_attrs, make_ok_response, parse_id_list, get_batches
 
 _logger = logging.getLogger( "db" )
 
@@ -29,33 +33,44 @@ _FIELD_NAMES = [ "*article_title", "article_subtitle", "article_date", "article_
 def get_article( article_id ):
     """Get an article."""
     _logger.debug( "Get article: id=%s", article_id )
-    article = Article.query.get( article_id )
+    deep = request.args.get( "deep" )
+    article = Article.query.options( *get_article_loader_options( None, deep ) ).get( article_id )
     if not article:
         abort( 404 )
     _logger.debug( "- %s", article )
-    deep = request.args.get( "deep" )
     return jsonify( get_article_vals( article, deep ) )
 
+@app.route( "/articles" )
+def get_articles():
+    """Get multiple articles."""
+    article_ids = parse_id_list( request.args.get( "ids" ) )
+    _logger.debug( "Get articles: ids=%s", article_ids )
+    deep = request.args.get( "deep" )
+    # NOTE: Articles that don't exist are not included in the response.
+    articles = {}
+    for batch in get_batches( article_ids ):
+        query = Article.query.filter( Article.article_id.in_( batch ) ) \
+            .options( *get_article_loader_options( None, deep ) )
+        for article in query:
+            articles[ article.article_id ] = get_article_vals( article, deep )
+    _logger.debug( "- Found %d articles.", len(articles) )
+    return jsonify( articles )
+
 def get_article_vals( article, deep ):
     """Extract public fields from an Article record."""
-    authors = sorted( article.article_authors,
-        key = lambda a: a.seq_no
-    )
-    scenarios = sorted( article.article_scenarios,
-        key = lambda a: a.seq_no
-    )
     vals = {
         "_type": "article",
         "article_id": article.article_id,
         "article_title": article.article_title,
         "article_subtitle": article.article_subtitle,
-        "article_image_id": article.article_id if article.article_image else None,
-        "article_authors": [ get_author_vals( a.parent_author ) for a in authors ],
+        "article_image_id": article.article_id if article.article_image_hash else None,
+        "article_image_version": get_image_version( article.article_image_hash ),
+        "article_authors": [ get_author_vals( a.parent_author ) for a in article.article_authors ],
         "article_date": article.article_date,
         "article_snippet": article.article_snippet,
         "article_pageno": article.article_pageno,
         "article_url": article.article_url,
-        "article_scenarios": [ get_scenario_vals( s.parent_scenario ) for s in scenarios ],
+        "article_scenarios": [ get_scenario_vals( s.parent_scenario ) for s in article.article_scenarios ],
         "article_tags": decode_tags( article.article_tags ),
         "article_rating": article.article_rating,
         "pub_id": article.pub_id,
@@ -70,11 +85,21 @@ def get_article_vals( article, deep ):
             ) if article.parent_publ else None
     return vals
 
-def get_article_sort_key( article ):
-    """Get an article's sort key."""
-    # NOTE: This is used to sort articles within their parent publication.
-    # NOTE: Articles should always have a seq# but sometimes they might not (e.g. created via a fixture).
-    return 999 if article.article_seqno is None else article.article_seqno
+def get_article_loader_options( path=None, deep=False ):
+    """Get the loader options needed to extract the public fields from Article records."""
+    # NOTE: get_article_vals() needs each article's authors and scenarios, and these would otherwise
+    # be lazy-loaded one article at a time. If the articles are being loaded via a relationship, the caller
+    # should pass in a loader option for it.
+    def load( attr ):
+        return path.selectinload( attr ) if path else selectinload( attr )
+    opts = [
+        load( Article.article_authors ).joinedload( ArticleAuthor.parent_author ),
+        load( Article.article_scenarios ).joinedload( ArticleScenario.parent_scenario ),
+    ]
+    if deep:
+        opts.append( path.joinedload( Article.parent_pub ) if path else joinedload( Article.parent_pub ) )
+        opts.append( path.joinedload( Article.parent_publ ) if path else joinedload( Article.parent_publ ) )
+    return opts
 
 # ---------------------------------------------------------------------
 
@@ -105,6 +130,7 @@ def create_article():
     _save_authors( article )
     _save_scenarios( article )
     _save_image( article )
+    log_changes( "tags" )
     db.session.commit()
     _logger.debug( "- New ID: %d", new_article_id )
     search.add_or_update_article( None, article, None )
@@ -125,57 +151,66 @@ def _set_seqno( article, pub_id ):
 
 def _save_authors( article ):
     """Save the article's authors."""
-
-    # delete the existing article-author rows
-    db.session.query( ArticleAuthor ) \
-        .filter( ArticleAuthor.article_id == article.article_id ) \
-        .delete()
-
-    # add the article-author rows
     authors = request.json.get( "article_authors", [] )
-    for seq_no,author in enumerate( authors ):
-        if isinstance( author, int ):
-            # this is an existing author
-            author_id = author
-        else:
-            # this is a new author - create it
-            if not isinstance( author, str ):
-                raise RuntimeError( "Expected an author name: {}".format( author ) )
-            author = Author( author_name=author )
-            db.session.add( author )
-            db.session.flush()
-            author_id = author.author_id
-            _logger.debug( "Created new author \"%s\": id=%d", author, author_id )
-        db.session.add(
-            ArticleAuthor( seq_no=seq_no, article_id=article.article_id, author_id=author_id )
-        )
+    _check_authors( authors )
+    # NOTE: New authors are given to us by name.
+    author_ids = _get_author_ids( [ a for a in authors if isinstance( a, str ) ] )
+    _update_links( article, ArticleAuthor, "author_id", [
+        author_ids[a] if isinstance( a, str ) else a
+        for a in authors
+    ] )
 
 def _save_scenarios( article ):
     """Save the article's scenarios."""
-
-    # delete the existing article-scenario rows
-    db.session.query( ArticleScenario ) \
-        .filter( ArticleScenario.article_id == article.article_id ) \
-        .delete()
-
-    # add the article-scenario rows
     scenarios = request.json.get( "article_scenarios", [] )
-    for seq_no,scenario in enumerate( scenarios ):
+    _check_scenarios( scenarios )
+    # NOTE: New scenarios are given to us as a display ID and name.
+    scenario_ids = _get_scenario_ids( [ tuple(s) for s in scenarios if isinstance( s, list ) ] )
+    _update_links( article, ArticleScenario, "scenario_id", [
+        scenario_ids[tuple(s)] if isinstance( s, list ) else s
+        for s in scenarios
+    ] )
+
+def _check_authors( authors ):
+    """Check the authors provided for an article."""
+    if not isinstance( authors, list ):
+        abort( 400, "Expected a list of authors: {}".format( authors ) )
+    for author in authors:
+        if not isinstance( author, (int,str) ):
+            abort( 400, "Expected an author ID or name: {}".format( author ) )
+
+def _check_scenarios( scenarios ):
+    """Check the scenarios provided for an article."""
+    if not isinstance( scenarios, list ):
+        abort( 400, "Expected a list of scenarios: {}".format( scenarios ) )
+    for scenario in scenarios:
         if isinstance( scenario, int ):
-            # this is an existing scenario
-            scenario_id = scenario
+            continue
+        if not isinstance( scenario, list ) or len(scenario) != 2 or \
+          not all( isinstance( v, str ) or v is None for v in scenario ):
+            abort( 400, "Expected a scenario ID, or ID and name: {}".format( scenario ) )
+
+def _update_links( article, model, key_name, new_keys ):
+    """Update the links between an article and its authors/scenarios."""
+    # NOTE: Rather than deleting all the existing links and re-creating them, we only change what's different.
+    curr_links = defaultdict( list )
+    query = model.query.filter( model.article_id == article.article_id ) \
+        .order_by( model.seq_no )
+    for link in query:
+        curr_links[ getattr( link, key_name ) ].append( link )
+    for seq_no, key in enumerate( new_keys ):
+        if curr_links.get( key ):
+            # the link already exists - make sure it's in the right position
+            link = curr_links[ key ].pop( 0 )
+            if link.seq_no != seq_no:
+                link.seq_no = seq_no
         else:
-            # this is a new scenario - create it
-            if not isinstance( scenario, list ):
-                raise RuntimeError( "Expected a scenario ID and name: {}".format( scenario ) )
-            new_scenario = Scenario( scenario_display_id=scenario[0], scenario_name=scenario[1] )
-            db.session.add( new_scenario )
-            db.session.flush()
-            scenario_id = new_scenario.scenario_id
-            _logger.debug( "Created new scenario \"%s [%s]\": id=%d", scenario[1], scenario[0], scenario_id )
-        db.session.add(
-            ArticleScenario( seq_no=seq_no, article_id=article.article_id, scenario_id=scenario_id )
-        )
+            # this is a new link - create it
+            db.session.add( model( seq_no=seq_no, article_id=article.article_id, **{ key_name: key } ) )
+    # delete any links that are no longer needed
+    for links in curr_links.values():
+        for link in links:
+            db.session.delete( link )
 
 def _save_image( article ):
     """Save the article's image."""
@@ -185,20 +220,145 @@ def _save_image( article ):
     if not image_data:
         return
 
-    # yup - delete the old one from the database
-    ArticleImage.query.filter( ArticleImage.article_id == article.article_id ).delete()
+    # yup - check if we should remove the current image
     if image_data == "{remove}":
         # NOTE: The front-end sends this if it wants the article to have no image.
+        remove_images( "article", [ article.article_id ] )
         article.article_image_id = None
         return
 
     # add the new image to the database
     image_data = base64.b64decode( image_data )
     fname = request.json.get( "imageFilename" )
-    img = ArticleImage( article_id=article.article_id, image_filename=fname, image_data=image_data )
-    db.session.add( img )
+    save_image( "article", article.article_id, fname, image_data )
+
+# ---------------------------------------------------------------------
+
+@app.route( "/articles/import", methods=["POST"] )
+def import_articles(): #pylint: disable=too-many-locals
+    """Import multiple articles."""
+
+    # parse and clean the input
+    # NOTE: We do this for all the articles before changing anything, so if any of them are invalid,
+    # nothing gets imported.
+    articles = request.json.get( "articles" ) if isinstance( request.json, dict ) else None
+    if not isinstance( articles, list ) or not all( isinstance( a, dict ) for a in articles ):
+        abort( 400, "Expected a list of articles." )
+    _logger.debug( "Import articles: #articles=%d", len(articles) )
+    warnings = []
+    all_vals = []
+    for article in articles:
+        vals = get_request_args( article, _FIELD_NAMES )
+        clean_request_args( vals, _FIELD_NAMES, warnings, _logger )
+        cleaned_tags = clean_tags( vals.get("article_tags") or [], warnings )
+        vals[ "article_tags" ] = encode_tags( cleaned_tags )
+        if not vals.get( "publ_id" ):
+            vals.pop( "article_date", None )
+        all_vals.append( vals )
+    for article in articles:
+        _check_authors( article.get( "article_authors", [] ) )
+        _check_scenarios( article.get( "article_scenarios", [] ) )
+
+    # figure out the ID's of the authors and scenarios (creating any new ones)
+    author_ids = _get_author_ids( [
+        author for article in articles for author in article.get( "article_authors", [] )
+        if isinstance( author, str )
+    ] )
+    scenario_ids = _get_scenario_ids( [
+        tuple( scenario ) for article in articles for scenario in article.get( "article_scenarios", [] )
+        if isinstance( scenario, list )
+    ] )
+
+    # allocate seq#'s for the articles
+    pub_ids = list( dict.fromkeys( vals["pub_id"] for vals in all_vals if vals.get( "pub_id" ) ) )
+    max_seqnos = {}
+    for batch in get_batches( pub_ids ):
+        query = db.session.query( Article.pub_id, func.max( Article.article_seqno ) ) \
+            .filter( Article.pub_id.in_( batch ) ) \
+            .group_by( Article.pub_id )
+        max_seqnos.update( query )
+    for vals in all_vals:
+        pub_id = vals.get( "pub_id" )
+        if pub_id:
+            max_seqno = max_seqnos.get( pub_id )
+            vals[ "article_seqno" ] = max_seqnos[ pub_id ] = 1 if max_seqno is None else max_seqno+1
+        else:
+            vals[ "article_seqno" ] = None
+
+    # create the new articles
+    now = datetime.datetime.now()
+    new_articles = [ Article( time_created=now, **vals ) for vals in all_vals ]
+    db.session.add_all( new_articles )
     db.session.flush()
-    _logger.debug( "Created new image: %s, #bytes=%d", fname, len(image_data) )
+    article_authors, article_scenarios = [], []
+    for new_article, article in zip( new_articles, articles ):
+        for seq_no, author in enumerate( article.get( "article_authors", [] ) ):
+            article_authors.append( { "seq_no": seq_no, "article_id": new_article.article_id,
+                "author_id": author_ids[author] if isinstance( author, str ) else author
+            } )
+        for seq_no, scenario in enumerate( article.get( "article_scenarios", [] ) ):
+            article_scenarios.append( { "seq_no": seq_no, "article_id": new_article.article_id,
+                "scenario_id": scenario_ids[tuple(scenario)] if isinstance( scenario, list ) else scenario
+            } )
+    db.session.bulk_insert_mappings( ArticleAuthor, article_authors )
+    db.session.bulk_insert_mappings( ArticleScenario, article_scenarios )
+    log_changes( "tags" )
+    db.session.commit()
+    new_article_ids = [ a.article_id for a in new_articles ]
+    _logger.debug( "- New ID's: %s", new_article_ids )
+
+    # update the search index
+    # NOTE: We re-load the new articles in one go (they were expired by the commit).
+    query = Article.query.filter( Article.article_id.in_( new_article_ids ) )
+    search.add_articles( query.all() )
+
+    return make_ok_response( extras={ "newArticleIds": new_article_ids }, warnings=warnings )
+
+def _get_author_ids( author_names ):
+    """Get the ID's for the specified authors, creating any that don't already exist."""
+    author_names = list( dict.fromkeys( author_names ) )
+    author_ids = {}
+    for batch in get_batches( author_names ):
+        query = db.session.query( Author.author_name, Author.author_id ) \
+            .filter( Author.author_name.in_( batch ) )
+        author_ids.update( query )
+    new_authors = [ Author( author_name=name ) for name in author_names if name not in author_ids ]
+    if new_authors:
+        db.session.add_all( new_authors )
+        db.session.flush()
+        for author in new_authors:
+            _logger.debug( "Created new author \"%s\": id=%d", author.author_name, author.author_id )
+            author_ids[ author.author_name ] = author.author_id
+        log_changes( "authors", [ a.author_id for a in new_authors ] )
+    return author_ids
+
+def _get_scenario_ids( scenarios ):
+    """Get the ID's for the specified scenarios, creating any that don't already exist."""
+    # NOTE: Scenarios are identified by their display ID and name. There may be more than one scenario
+    # that matches (e.g. if it was released in multiple publications), in which case we use the first one.
+    scenarios = list( dict.fromkeys( scenarios ) )
+    scenario_ids = {}
+    scenario_names = list( dict.fromkeys( s[1] for s in scenarios ) )
+    for batch in get_batches( scenario_names ):
+        query = db.session.query( Scenario.scenario_display_id, Scenario.scenario_name, Scenario.scenario_id ) \
+            .filter( Scenario.scenario_name.in_( batch ) ) \
+            .order_by( Scenario.scenario_id )
+        for row in query:
+            scenario_ids.setdefault( ( row[0], row[1] ), row[2] )
+    new_scenarios = [
+        Scenario( scenario_display_id=s[0], scenario_name=s[1] )
+        for s in scenarios if s not in scenario_ids
+    ]
+    if new_scenarios:
+        db.session.add_all( new_scenarios )
+        db.session.flush()
+        for scenario in new_scenarios:
+            _logger.debug( "Created new scenario \"%s [%s]\": id=%d",
+                scenario.scenario_name, scenario.scenario_display_id, scenario.scenario_id
+            )
+            scenario_ids[ ( scenario.scenario_display_id, scenario.scenario_name ) ] = scenario.scenario_id
+        log_changes( "scenarios", [ s.scenario_id for s in new_scenarios ] )
+    return scenario_ids
 
 # ---------------------------------------------------------------------
 
@@ -231,6 +391,7 @@ def update_article():
     _save_authors( article )
     _save_scenarios( article )
     _save_image( article )
+    log_changes( "tags" )
     db.session.commit()
     search.add_or_update_article( None, article, None )
 
@@ -274,9 +435,11 @@ def delete_article( article_id ):
     _logger.debug( "- %s", article )
 
     # delete the article
+    remove_images( "article", [ article.article_id ] )
     db.session.delete( article )
+    log_changes( "tags" )
     db.session.commit()
-    search.delete_articles( [ article ] )
+    search.delete_searchables( articles=[ article ] )
 
     # generate the response
     return make_ok_response()
@@ -6,6 +6,7 @@ from flask import jsonify, abort
 
 from asl_articles import app
 from asl_articles.models import Author
+from asl_articles.versions import make_conditional_response
 
 _logger = logging.getLogger( "db" )
 
@@ -14,7 +15,7 @@ _logger = logging.getLogger( "db" )
 @app.route( "/authors" )
 def get_authors():
     """Get all authors."""
-    return jsonify( {
+    return make_conditional_response( "authors", lambda: {
         author.author_id: get_author_vals( author )
         for author in Author.query.all()
     } )
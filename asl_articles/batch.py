@@ -0,0 +1,58 @@
+""" Handle batched requests. """
+
+import logging
+
+from flask import request, jsonify, abort
+from werkzeug.exceptions import HTTPException
+
+from asl_articles import app, db
+
+_logger = logging.getLogger( "db" )
+
+# NOTE: Only these endpoints can be run in a batch, since they just read data (some of the other GET endpoints
+# change things e.g. /publisher/delete/<id>).
+_BATCH_ENDPOINTS = set( [
+    "ping",
+    "get_publishers", "get_publisher", "get_publications", "get_publication", "get_articles", "get_article",
+    "get_authors", "get_author", "get_scenarios", "get_tags", "get_changes",
+] )
+
+# ---------------------------------------------------------------------
+
+@app.route( "/batch", methods=["POST"] )
+def run_batch():
+    """Run multiple GET requests, and return the combined results."""
+
+    # NOTE: The front-end often needs several things at once (e.g. when opening a dialog), so rather than
+    # sending each request separately (each of which gets its own worker thread and database session),
+    # it can send a list of URL's to us, and we run them here, one after the other.
+    # Since the requests all run in the same thread and app context, they share the same database session.
+    paths = request.json.get( "paths" ) if isinstance( request.json, dict ) else None
+    if not isinstance( paths, list ) or not all( isinstance( p, str ) for p in paths ):
+        abort( 400, "Missing or invalid list of paths." )
+    url_adapter = app.url_map.bind_to_environ( request.environ )
+    results = {}
+    for path in paths:
+        results[ path ] = _run_request( url_adapter, path )
+    return jsonify( results )
+
+def _run_request( url_adapter, path ):
+    """Run a single GET request."""
+    with app.test_request_context( path, method="GET" ):
+        try:
+            endpoint, view_args = url_adapter.match( request.path, method="GET" )
+            if endpoint not in _BATCH_ENDPOINTS:
+                abort( 403 )
+            resp = app.make_response(
+                app.view_functions[ endpoint ]( **view_args )
+            )
+        except HTTPException as ex:
+            return { "status": ex.code }
+        except Exception as ex: #pylint: disable=broad-except
+            # NOTE: The requests share the same database session, so we need to clean up after a failed request,
+            # otherwise it will break the ones that come after it.
+            _logger.error( "Batched request failed: %s (%s)", path, ex )
+            db.session.rollback()
+            return { "status": 500 }
+        data = resp.get_json() if resp.is_json else resp.get_data( as_text=True )
+        return { "status": resp.status_code, "data": data }
@@ -0,0 +1,71 @@
+""" Let the front-end find out what data has changed. """
+
+from collections import defaultdict
+
+from flask import request, jsonify
+
+from asl_articles import app, db
+from asl_articles.models import Publisher, Publication, Author, Scenario, ChangeLog
+from asl_articles.publishers import get_publisher_vals
+from asl_articles.publications import get_publication_vals
+from asl_articles.authors import get_author_vals
+from asl_articles.scenarios import get_scenario_vals
+from asl_articles.tags import get_all_tags
+from asl_articles.versions import get_version, make_version_string, parse_version_string
+from asl_articles.utils import get_batches
+
+# NOTE: These must return the same data as the corresponding routes that return everything (e.g. "/publishers").
+_DATA_GETTERS = {
+    "publishers": ( Publisher.publ_id, lambda publ: get_publisher_vals( publ, False, False ) ),
+    "publications": ( Publication.pub_id, lambda pub: get_publication_vals( pub, False, False ) ),
+    "authors": ( Author.author_id, get_author_vals ),
+    "scenarios": ( Scenario.scenario_id, get_scenario_vals ),
+}
+
+# ---------------------------------------------------------------------
+
+@app.route( "/changes" )
+def get_changes():
+    """Get the data that has changed since the specified version."""
+
+    # NOTE: We get the current version before looking for changes, so if something changes while we're doing this,
+    # the client might get some changes twice, but will never miss any (since change ID's become visible
+    # in the order they were allocated, see _prepare_change_log()).
+    vals = { "version": make_version_string( get_version() ) }
+
+    # check if we know what data the client has
+    since = parse_version_string( request.args.get( "since" ) )
+    if since is None:
+        # nope - they need to re-load everything
+        vals[ "reset" ] = True
+        return jsonify( vals )
+
+    # figure out what's changed
+    # NOTE: If a record has changed more than once, the most recent change is the one that matters.
+    changes = defaultdict( dict )
+    query = db.session.query( ChangeLog.data_type, ChangeLog.record_id, ChangeLog.deleted ) \
+        .filter( ChangeLog.change_id > since ) \
+        .order_by( ChangeLog.change_id )
+    for row in query:
+        changes[ row[0] ][ row[1] ] = row[2]
+
+    # get the changed data
+    for data_type, record_changes in changes.items():
+        if data_type == "tags":
+            # NOTE: Tags aren't stored as separate records, so we just return all of them.
+            vals[ "tags" ] = get_all_tags()
+            continue
+        key_col, get_vals = _DATA_GETTERS[ data_type ]
+        updated_ids = [ record_id for record_id, deleted in record_changes.items() if not deleted ]
+        updated = {}
+        for batch in get_batches( updated_ids ):
+            query = key_col.class_.query.filter( key_col.in_( batch ) )
+            for record in query:
+                updated[ getattr( record, key_col.key ) ] = get_vals( record )
+        vals[ data_type ] = {
+            "updated": updated,
+            # NOTE: Records that have gone missing are reported as deleted.
+            "deleted": [ record_id for record_id in record_changes if record_id not in updated ],
+        }
+
+    return jsonify( vals )
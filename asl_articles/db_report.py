@@ -1,85 +1,208 @@
 """ Generate the database report. """
 
-import urllib.request
-import urllib.error
-import hashlib
+import threading
+import time
+import weakref
+import json
 from collections import defaultdict
 
-from flask import request, jsonify, abort
+from flask import request, jsonify, abort, Response, stream_with_context
+from sqlalchemy import event, text, bindparam
+from sqlalchemy.engine import Engine
 
 from asl_articles import app, db
+from asl_articles.link_checker import LinkChecker, check_link
+
+# NOTE: The routes for this module are registered in __init__.py, so that it doesn't get loaded until it's needed.
+
+_ROW_COUNT_TABLES = [
+    "publisher", "publication", "article", "author",
+    "publisher_image", "publication_image", "article_image",
+    "scenario"
+]
+
+# NOTE: Counting rows means scanning each table (at least on Postgres), so we cache the row counts, and
+# re-count them after something has been written to the database. We can't use the change log for this,
+# since it doesn't track everything (e.g. articles, or rows removed by cascading deletes), so we note every
+# write made through each database engine. We can't see writes made by other processes (e.g. if there are
+# multiple server processes), so the cached counts also expire after a while.
+_DEFAULT_ROW_COUNT_CACHE_TTL = 60
+_db_write_generations = weakref.WeakKeyDictionary()
+_row_counts_cache = None
+_row_counts_lock = threading.Lock()
+
+_link_checker = None
+_link_checker_lock = threading.Lock()
 
 # ---------------------------------------------------------------------
 
-@app.route( "/db-report/row-counts" )
 def get_db_row_counts():
     """Get the database row counts."""
-    results = {}
-    for table_name in [
-      "publisher", "publication", "article", "author",
-      "publisher_image", "publication_image", "article_image",
-      "scenario"
-    ]:
-        query = db.engine.execute( "SELECT count(*) FROM {}".format( table_name ) )
-        results[ table_name ] = query.scalar()
+    global _row_counts_cache
+    with _row_counts_lock:
+        # NOTE: We get the write generation before counting, so that if something is written while we're
+        # doing this, the counts we cache will be treated as out-of-date. The cached counts are also only
+        # valid for the database engine they came from (e.g. the test suite installs a new one for each test).
+        cache_key = (
+            db.engine, _db_write_generations.get( db.engine, 0 ), app.config.get( "APPROX_ROW_COUNT_THRESHOLD" )
+        )
+        cache_ttl = float( app.config.get( "ROW_COUNT_CACHE_TTL", _DEFAULT_ROW_COUNT_CACHE_TTL ) )
+        if _row_counts_cache and _row_counts_cache[0] == cache_key and \
+          time.monotonic() - _row_counts_cache[1] < cache_ttl:
+            return jsonify( _row_counts_cache[2] )
+        results = _count_rows( _ROW_COUNT_TABLES, cache_key[2] )
+        _row_counts_cache = ( cache_key, time.monotonic(), results )
     return jsonify( results )
 
+def _count_rows( table_names, approx_threshold ):
+    """Count the rows in the specified tables."""
+
+    # check if we should use approximate row counts for large tables
+    # NOTE: These come from the database's statistics (which are only as up-to-date as the last time
+    # the database was analyzed), so we only use them for tables that are bigger than the configured threshold.
+    results = {}
+    if approx_threshold:
+        for table_name, row_count in _get_approx_row_counts( table_names ).items():
+            if row_count >= int( approx_threshold ):
+                results[ table_name ] = row_count
+
+    # count the rows in the remaining tables
+    # NOTE: We do this in a single query, to avoid a round-trip to the database for each table.
+    table_names = [ t for t in table_names if t not in results ]
+    if table_names:
+        row = db.engine.execute( "SELECT {}".format( ", ".join(
+            "( SELECT count(*) FROM {table} ) AS {table}".format( table=table_name )
+            for table_name in table_names
+        ) ) ).first()
+        results.update( zip( table_names, row ) )
+
+    return results
+
+def _get_approx_row_counts( table_names ):
+    """Get the approximate row counts for the specified tables, from the database's statistics."""
+    results = {}
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        # NOTE: reltuples is -1 if the table has never been analyzed.
+        query = db.engine.execute(
+            text( "SELECT relname, reltuples FROM pg_class"
+                  " WHERE relkind = 'r' AND relname IN :table_names AND pg_table_is_visible( oid )" )
+                .bindparams( bindparam( "table_names", expanding=True ) ),
+            table_names=table_names
+        )
+        for table_name, row_count in query:
+            if row_count >= 0:
+                results[ table_name ] = int( row_count )
+    elif dialect == "sqlite":
+        # NOTE: sqlite_stat1 only exists if the database has been analyzed. The first number in each row
+        # is the number of rows in the table.
+        query = db.engine.execute( "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'" )
+        if query.scalar():
+            for table_name, stat in db.engine.execute( "SELECT tbl, stat FROM sqlite_stat1" ):
+                if table_name in table_names and stat:
+                    row_count = int( stat.split()[0] )
+                    results[ table_name ] = max( results.get( table_name, 0 ), row_count )
+    return results
+
+@event.listens_for( Engine, "after_cursor_execute" )
+def _on_db_execute( conn, cursor, statement, params, context, executemany ): #pylint: disable=unused-argument
+    """Database execute callback."""
+    # NOTE: We listen to all engines, since the database engine can be replaced (e.g. by the test suite),
+    # and err on the side of caution, treating anything that's not a query as a write.
+    if statement.lstrip()[:6].upper() not in ( "SELECT", "PRAGMA" ):
+        _db_write_generations[ conn.engine ] = _db_write_generations.get( conn.engine, 0 ) + 1
+
 # ---------------------------------------------------------------------
 
-@app.route( "/db-report/links" )
 def get_db_links():
     """Get all links in the database."""
 
-    # initialize
-    results = {}
-
-    def find_db_links( table_name, col_names ):
-        links = []
-        query = db.engine.execute( "SELECT * FROM {}".format( table_name ) )
+    # NOTE: There could be a lot of links, so we only fetch the columns we need, and stream the results back
+    # as newline-delimited JSON (one [table,id,name,url] row per line), rather than building the whole thing
+    # in memory first.
+    def find_db_links( table_name, col_names, get_name ):
+        sql = "SELECT {cols} FROM {table} WHERE {url_col} IS NOT NULL AND {url_col} != ''".format(
+            cols = ", ".join( col_names ),
+            table = table_name,
+            url_col = col_names[-1]
+        )
+        query = db.engine.execution_options( stream_results=True ).execute( sql )
         for row in query:
-            url = row[ col_names[1] ]
-            if not url:
-                continue
-            obj_id = row[ col_names[0] ]
-            name = col_names[2]( row ) if callable( col_names[2] ) else row[ col_names[2] ]
-            links.append( [ obj_id, name, url ] )
-        results[ table_name ] = links
-
-    # find all links
-    find_db_links( "publisher", [
-        "publ_id", "publ_url", "publ_name"
-    ] )
-    find_db_links( "publication", [
-        "pub_id", "pub_url", _get_pub_name
-    ] )
-    find_db_links( "article", [
-        "article_id", "article_url", "article_title"
-    ] )
+            yield json.dumps( [ table_name, row[0], get_name(row), row[-1] ] ) + "\n"
 
-    return jsonify( results )
+    def find_all_links():
+        yield from find_db_links( "publisher",
+            [ "publ_id", "publ_name", "publ_url" ],
+            lambda row: row["publ_name"]
+        )
+        yield from find_db_links( "publication",
+            [ "pub_id", "pub_name", "pub_edition", "pub_url" ],
+            _get_pub_name
+        )
+        yield from find_db_links( "article",
+            [ "article_id", "article_title", "article_url" ],
+            lambda row: row["article_title"]
+        )
+
+    return Response( stream_with_context( find_all_links() ), mimetype="application/x-ndjson" )
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-@app.route( "/db-report/check-link", methods=["POST"] )
 def check_db_link():
     """Check if a link appears to be working."""
     url = request.args.get( "url" )
-    try:
-        resp = urllib.request.urlopen(
-            urllib.request.Request( url, method="HEAD" )
-        )
-    except urllib.error.URLError as ex:
-        code = getattr( ex, "code", None )
-        if code:
-            abort( code )
-        abort( 400 )
-    if resp.code != 200:
-        abort( resp.code )
+    result = check_link( url, _get_link_checker().timeout )
+    if not result[ "ok" ]:
+        abort( result[ "status" ] or 400 )
     return "ok"
 
+def start_check_db_links():
+    """Start checking a list of links in the background."""
+    urls = request.json.get( "urls" ) if request.json else None
+    if not isinstance( urls, list ) or not all( isinstance( u, str ) for u in urls ):
+        abort( 400, "Missing or invalid list of URL's." )
+    job = _get_link_checker().start_job( urls )
+    return jsonify( job.get_status() )
+
+def get_check_db_links_status( job_id ):
+    """Get the progress of a link-check job."""
+    job = _get_link_checker().get_job( job_id )
+    if not job:
+        abort( 404 )
+    start = request.args.get( "start", 0, type=int ) # nb: so the caller can get only the new results
+    return jsonify( job.get_status( start ) )
+
+def stop_check_db_links( job_id ):
+    """Stop a link-check job."""
+    job = _get_link_checker().get_job( job_id )
+    if not job:
+        abort( 404 )
+    job.stop()
+    return jsonify( job.get_status() )
+
+def _get_link_checker():
+    """Get the link checker."""
+    global _link_checker
+    args = (
+        int( app.config.get( "LINK_CHECK_THREADS", 10 ) ),
+        int( app.config.get( "LINK_CHECK_MAX_PER_HOST", 2 ) ),
+        float( app.config.get( "LINK_CHECK_TIMEOUT", 10 ) ),
+        float( app.config.get( "LINK_CHECK_CACHE_TTL", 60*60 ) )
+    )
+    with _link_checker_lock:
+        if not _link_checker or \
+          ( _link_checker.max_workers, _link_checker.max_per_host, _link_checker.timeout, _link_checker.cache_ttl ) \
+            != args:
+            # NOTE: The front-end may still be polling for jobs that are running in the old link checker,
+            # so we hand them over to the new one (they will finish running in the old one's threads).
+            prev_link_checker = _link_checker
+            _link_checker = LinkChecker( *args )
+            if prev_link_checker:
+                _link_checker.take_over( prev_link_checker )
+    return _link_checker
+
 # ---------------------------------------------------------------------
 
-@app.route( "/db-report/images" )
 def get_db_images():
     """Analyze the images stored in the database."""
 
@@ -90,30 +213,23 @@ def get_db_images():
     def find_images( table_name, col_names, get_name ):
 
         # find rows in the specified table that have images
-        sql = "SELECT {cols}, image_data" \
+        # NOTE: The image hashes and sizes are stored when the images are saved, so we never need to load
+        # the images themselves.
+        sql = "SELECT {cols}, image_blob.image_hash, image_blob.image_size" \
             " FROM {table}_image LEFT JOIN {table}" \
-            " ON {table}_image.{id_col} = {table}.{id_col}".format(
+            " ON {table}_image.{id_col} = {table}.{id_col}" \
+            " JOIN image_blob ON image_blob.image_hash = {table}_image.image_hash".format(
             cols = ",".join( "{}.{}".format( table_name, c ) for c in col_names ),
             table = table_name,
             id_col = col_names[0]
         )
-        rows = [
-            dict( row )
-            for row in db.engine.execute( sql )
-        ]
-
-        # save the image hashes
-        for row in rows:
-            image_hash = hashlib.md5( row["image_data"] ).hexdigest()
-            image_hashes[ image_hash ].append( [
+        image_sizes = []
+        for row in db.engine.execute( sql ):
+            # save the image hash and size
+            image_hashes[ row["image_hash"] ].append( [
                 table_name, row[col_names[0]], get_name(row)
             ] )
-
-        # save the image sizes
-        image_sizes = [
-            [ len(row["image_data"]), row[col_names[0]], get_name(row) ]
-            for row in rows
-        ]
+            image_sizes.append( [ row["image_size"], row[col_names[0]], get_name(row) ] )
         image_sizes.sort( key = lambda r: r[0], reverse=True )
         results[ table_name ] = image_sizes
 
@@ -6,9 +6,10 @@ from flask import abort, send_from_directory
 
 from asl_articles import app
 
+# NOTE: The routes for this module are registered in __init__.py, so that it doesn't get loaded until it's needed.
+
 # ---------------------------------------------------------------------
 
-@app.route( "/docs/<path:path>" )
 def get_external_doc( path ):
     """Return an external document."""
     base_dir = app.config.get( "EXTERNAL_DOCS_BASEDIR" )
@@ -23,7 +24,6 @@ def get_external_doc( path ):
 
 # ---------------------------------------------------------------------
 
-@app.route( "/user-files/<path:path>" )
 def get_user_file( path ):
     """Return a user-defined file."""
     base_dir = app.config.get( "USER_FILES_BASEDIR" )
@@ -0,0 +1,93 @@
+""" Cache files on disk. """
+
+import os
+import threading
+import tempfile
+import logging
+
+_logger = logging.getLogger( "db" )
+
+# ---------------------------------------------------------------------
+
+class FileCache:
+    """Cache files on disk, with a limit on the total size."""
+
+    # NOTE: Files are evicted on an LRU basis, using their modification times (which we update every time
+    # a file is used). Other processes may be using the same directory, so we don't assume we know about
+    # every file in it, but just re-scan the directory when we think it has grown too large.
+
+    def __init__( self, dname, max_size ):
+        self.dname = dname
+        self.max_size = max_size
+        os.makedirs( self.dname, exist_ok=True )
+        self._lock = threading.Lock()
+        self._curr_size = sum( size for _, _, size in self._get_files() )
+
+    def open( self, key ):
+        """Open a file in the cache (or return None if it's not there)."""
+        # NOTE: Files can be removed at any time (e.g. evicted by another process), so callers should use
+        # the open file, rather than the file name (once it's open, it doesn't matter if it gets removed).
+        try:
+            fp = open( os.path.join( self.dname, key ), "rb" )
+        except FileNotFoundError:
+            return None
+        os.utime( fp.fileno() )
+        return fp
+
+    def add( self, key, data ):
+        """Add a file to the cache."""
+        # NOTE: We write to a temp file, then rename it, so that nobody ever sees a partially-written file.
+        with tempfile.NamedTemporaryFile( dir=self.dname, prefix=".tmp-", delete=False ) as temp_file:
+            temp_file.write( data )
+        fname = os.path.join( self.dname, key )
+        os.replace( temp_file.name, fname )
+        with self._lock:
+            self._curr_size += len( data )
+            if self._curr_size > self.max_size:
+                self._evict_files()
+        return fname
+
+    def remove( self, key_prefix ):
+        """Remove files from the cache."""
+        for fname, _, size in self._get_files():
+            if os.path.basename( fname ).startswith( key_prefix ):
+                _logger.debug( "Removing cached file: %s", fname )
+                if self._remove_file( fname ):
+                    with self._lock:
+                        self._curr_size -= size
+
+    def _evict_files( self ):
+        """Remove the least-recently-used files, until the cache is back under its size limit."""
+        files = sorted( self._get_files(), key=lambda f: f[1] )
+        self._curr_size = sum( size for _, _, size in files )
+        # NOTE: We leave some headroom, so that we don't have to do this again as soon as the next file is added.
+        target_size = int( self.max_size * 0.9 )
+        for fname, _, size in files:
+            if self._curr_size <= target_size:
+                break
+            _logger.debug( "Evicting cached file: %s", fname )
+            if self._remove_file( fname ):
+                self._curr_size -= size
+
+    def _get_files( self ):
+        """Get the files in the cache."""
+        files = []
+        with os.scandir( self.dname ) as entries:
+            for entry in entries:
+                if entry.name.startswith( ".tmp-" ):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue # nb: someone else removed it
+                files.append( ( entry.path, stat.st_mtime, stat.st_size ) )
+        return files
+
+    @staticmethod
+    def _remove_file( fname ):
+        """Remove a file from the cache."""
+        try:
+            os.unlink( fname )
+            return True
+        except FileNotFoundError:
+            return False
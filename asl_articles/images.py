@@ -1,25 +1,344 @@
 """ Handle image requests. """
 
+import os
 import io
+import hashlib
+import tempfile
+import mimetypes
+import datetime
+import logging
+from collections import Counter
 
-from flask import send_file, abort
+from flask import request, make_response, abort
+from werkzeug.wsgi import wrap_file
+from sqlalchemy.sql.expression import func
+from sqlalchemy.exc import IntegrityError
 
-from asl_articles import app
-#from asl_articles.models import PublisherImage, PublicationImage, ArticleImage
-import asl_articles.models
+from asl_articles import app, db
+from asl_articles.models import Publisher, PublisherImage, Publication, PublicationImage, Article, ArticleImage, \
+    ImageBlob
+from asl_articles.versions import log_changes
+from asl_articles.file_cache import FileCache
+from asl_articles.utils import make_ok_response, get_batches
+
+_UPLOAD_CHUNK_SIZE = 64 * 1024
+_DEFAULT_MAX_IMAGE_UPLOAD_SIZE = 1 * 1024*1024 # nb: this matches the front-end's limit
+_MAX_MULTIPART_OVERHEAD = 4 * 1024 # nb: allowance for the boundaries and part headers in a multipart upload
+
+_MAX_THUMBNAIL_WIDTH = 1024
+_THUMBNAIL_WIDTH_STEP = 16
+
+# NOTE: These are the caches we keep on disk (default directory, default size). The image cache is disabled
+# unless a directory is configured for it, since it duplicates what's in the database.
+_FILE_CACHES = {
+    "thumbnail": ( os.path.join( tempfile.gettempdir(), "asl-articles-thumbnails" ), 50 * 1024*1024 ),
+    "image": ( None, 200 * 1024*1024 ),
+}
+_file_caches = {}
+
+# NOTE: These are the records that can have an image (model, image model, key column, and the data type
+# of the record in the change log, if it's one that the front-end caches).
+_IMAGE_OWNERS = {
+    "publisher": ( Publisher, PublisherImage, "publ_id", "publishers" ),
+    "publication": ( Publication, PublicationImage, "pub_id", "publications" ),
+    "article": ( Article, ArticleImage, "article_id", None ),
+}
+
+_logger = logging.getLogger( "db" )
 
 # ---------------------------------------------------------------------
 
 @app.route( "/images/<image_type>/<image_id>" )
 def get_image( image_type, image_id ):
     """Return an image."""
-    model = getattr( asl_articles.models, image_type.capitalize()+"Image" )
-    if not model:
+
+    # get the image details
+    # NOTE: We don't load the image data yet, since we may not need it.
+    if image_type not in _IMAGE_OWNERS:
         abort( 404 )
-    img = model.query.get( image_id )
+    model, image_model, key_name, _ = _IMAGE_OWNERS[ image_type ]
+    key_col = getattr( image_model, key_name )
+    img = db.session.query(
+        image_model.image_filename, image_model.image_hash,
+        func.coalesce( model.time_updated, model.time_created ).label( "time_updated" )
+    ).join( model, getattr( model, key_name ) == key_col ) \
+        .filter( key_col == image_id ) \
+        .first()
     if not img:
         abort( 404 )
-    return send_file(
-        io.BytesIO( img.image_data ),
-        attachment_filename = img.image_filename # nb: so that Flask can set the MIME type
+    last_modified = _to_http_time( img.time_updated, False )
+
+    # check if a thumbnail was requested
+    width = _get_thumbnail_width()
+    etag = "{}-w{}".format( img.image_hash, width ) if width else img.image_hash
+
+    # check if the client already has the image
+    if request.if_none_match:
+        is_cached = request.if_none_match.contains( etag )
+    else:
+        is_cached = last_modified and request.if_modified_since \
+            and last_modified <= _to_http_time( request.if_modified_since, True )
+    if is_cached:
+        resp = make_response( "", 304 )
+    elif width:
+        resp = _send_thumbnail( img, width )
+    else:
+        resp = _send_image( img )
+
+    # NOTE: If the URL contains the image's version (see get_image_version()), it will change if the image
+    # is ever changed, so browsers can cache it forever. Otherwise, they must check with us before using it.
+    resp.set_etag( etag )
+    if last_modified:
+        resp.last_modified = last_modified
+    if request.args.get( "v" ) == get_image_version( img.image_hash ):
+        resp.headers[ "Cache-Control" ] = "public, max-age=31536000, immutable"
+    else:
+        resp.headers[ "Cache-Control" ] = "no-cache"
+    if resp.status_code == 200:
+        # NOTE: This handles Range requests (the ETag must be set first, so that If-Range works).
+        resp.make_conditional( request.environ, accept_ranges=True, complete_length=resp.content_length )
+    return resp
+
+def _get_thumbnail_width():
+    """Get the requested thumbnail width."""
+    width = request.args.get( "w" )
+    if width is None:
+        return None
+    if not width.isdigit() or int( width ) <= 0:
+        abort( 400 )
+    # NOTE: We round the width up, so that we don't end up generating (and caching) lots of different sizes.
+    width = -( -int(width) // _THUMBNAIL_WIDTH_STEP ) * _THUMBNAIL_WIDTH_STEP
+    return min( width, _MAX_THUMBNAIL_WIDTH )
+
+def _send_image( img ):
+    """Send an image."""
+
+    # NOTE: If the image cache is enabled, we write the image data out to disk once, and serve it from there,
+    # which means the WSGI server can send it using wsgi.file_wrapper (which typically uses sendfile()),
+    # and we don't have to load it from the database, or hold it in memory. Since images are cached by their
+    # hash, a cached file is never out-of-date, and is removed when the image is no longer being used.
+    mime_type = mimetypes.guess_type( img.image_filename )[0] or "application/octet-stream"
+    image_cache = _get_file_cache( "image" )
+    if not image_cache:
+        resp = make_response( _get_image_data( img.image_hash ) )
+        resp.mimetype = mime_type
+        return resp
+    return _send_cached_file( image_cache, img.image_hash, mime_type,
+        lambda: _get_image_data( img.image_hash )
     )
+
+def _send_thumbnail( img, width ):
+    """Send a thumbnail of an image."""
+
+    # NOTE: Thumbnails are cached on disk, keyed by the image's hash, so they can be shared by all the records
+    # that use the same image, and are never out-of-date (if an image is changed, its hash will change).
+    # We convert everything to PNG, except for JPEG's, which would get much larger.
+    is_jpeg = os.path.splitext( img.image_filename )[1].lower() in ( ".jpg", ".jpeg" )
+    thumbnail_cache = _get_file_cache( "thumbnail" )
+    key = "{}-w{}.{}".format( img.image_hash, width, "jpg" if is_jpeg else "png" )
+    def make_thumbnail():
+        _logger.debug( "Generating thumbnail: %s", key )
+        return _make_thumbnail( _get_image_data( img.image_hash ), width, "JPEG" if is_jpeg else "PNG" )
+    resp = _send_cached_file( thumbnail_cache, key, "image/jpeg" if is_jpeg else "image/png", make_thumbnail )
+    if resp is None:
+        # NOTE: We couldn't generate a thumbnail (e.g. the image is an SVG), so we just send the image itself.
+        return _send_image( img )
+    return resp
+
+def _send_cached_file( file_cache, key, mime_type, get_data ):
+    """Send a file from a file cache (adding it to the cache first, if necessary)."""
+    # NOTE: We send the file we opened, not the file name, since the file could be removed at any time
+    # (e.g. evicted by another process). If it's not there, we just send the data we add to the cache.
+    fp = file_cache.open( key )
+    if not fp:
+        data = get_data()
+        if data is None:
+            return None # nb: there's nothing to send
+        _logger.debug( "Adding file to cache: %s", key )
+        file_cache.add( key, data )
+        resp = make_response( data )
+        resp.mimetype = mime_type
+        return resp
+    resp = app.response_class( wrap_file( request.environ, fp ), mimetype=mime_type, direct_passthrough=True )
+    resp.content_length = os.fstat( fp.fileno() ).st_size
+    return resp
+
+def _make_thumbnail( image_data, width, image_format ):
+    """Generate a thumbnail of an image (or None, if we can't read it)."""
+    # NOTE: Pillow is slow to load, and thumbnails are cached, so we often don't need it at all.
+    from PIL import Image #pylint: disable=import-outside-toplevel
+    try:
+        img = Image.open( io.BytesIO( image_data ) )
+        # NOTE: Palette-based images can only be resized using nearest-neighbour, which looks terrible.
+        img = img.convert( "RGB" if image_format == "JPEG" else "RGBA" )
+        img.thumbnail( ( width, img.height ), Image.LANCZOS ) # nb: this never makes an image bigger
+    except OSError as ex: # nb: this includes images that Pillow doesn't recognize
+        _logger.debug( "Can't generate thumbnail: %s", ex )
+        return None
+    buf = io.BytesIO()
+    img.save( buf, format=image_format )
+    return buf.getvalue()
+
+def _get_file_cache( cache_type ):
+    """Get one of the file caches (or None, if it has been disabled)."""
+    default_dname, default_size = _FILE_CACHES[ cache_type ]
+    dname = app.config.get( cache_type.upper() + "_CACHE_DIR" ) or default_dname
+    if not dname:
+        return None
+    max_size = int( app.config.get( cache_type.upper() + "_CACHE_SIZE", default_size ) )
+    cache = _file_caches.get( cache_type )
+    if not cache or ( cache.dname, cache.max_size ) != ( dname, max_size ):
+        cache = _file_caches[ cache_type ] = FileCache( dname, max_size )
+    return cache
+
+def _get_image_data( image_hash ):
+    """Load an image's data."""
+    return db.session.query( ImageBlob.image_data ) \
+        .filter( ImageBlob.image_hash == image_hash ) \
+        .scalar()
+
+def get_image_version( image_hash ):
+    """Generate a version string for an image, that can be used to make its URL unique."""
+    return image_hash[:16] if image_hash else None
+
+def _to_http_time( val, is_utc ):
+    """Convert a timestamp to the form used in HTTP headers (UTC, to the second)."""
+    if not val:
+        return None
+    # NOTE: Timestamps in the database are naive local times. Older versions of Werkzeug return naive UTC times.
+    if not val.tzinfo:
+        val = val.replace( tzinfo=datetime.timezone.utc ) if is_utc else val.astimezone()
+    return val.astimezone( datetime.timezone.utc ).replace( microsecond=0 )
+
+# ---------------------------------------------------------------------
+
+@app.route( "/images/<image_type>/<int:image_id>", methods=["POST"] )
+def upload_image( image_type, image_id ):
+    """Upload an image for a publisher, publication or article."""
+
+    # NOTE: The record dialogs send new images as base64 inside the JSON they send when saving a record,
+    # which means the whole thing gets parsed into memory, then decoded into yet another copy. Here, we accept
+    # the raw image data, either as a multipart/form-data upload (in a field called "image"), or as the request
+    # body itself (with the filename in the query string). In both cases, we read it in chunks, and give up
+    # as soon as it goes over the size limit.
+    if image_type not in _IMAGE_OWNERS:
+        abort( 404 )
+    model, _, _, data_type = _IMAGE_OWNERS[ image_type ]
+    max_size = int( app.config.get( "MAX_IMAGE_UPLOAD_SIZE", _DEFAULT_MAX_IMAGE_UPLOAD_SIZE ) )
+    if request.mimetype == "multipart/form-data":
+        # NOTE: Werkzeug streams uploaded files to a temp file (if they're not small), so parsing the form
+        # doesn't pull the whole image into memory, but it does read the whole request, so we check its size
+        # before we start.
+        if not request.content_length:
+            abort( 411 )
+        if request.content_length > max_size + _MAX_MULTIPART_OVERHEAD:
+            abort( 413 )
+        upload = request.files.get( "image" )
+        if not upload:
+            abort( 400 )
+        fname, stream = upload.filename, upload.stream
+    else:
+        if request.content_length and request.content_length > max_size:
+            abort( 413 )
+        fname, stream = request.args.get( "filename" ), request.stream
+    _logger.debug( "Upload image: %s #%d (%s)", image_type, image_id, fname )
+    if not fname:
+        abort( 400 ) # nb: we need the filename to figure out the image's MIME type
+    image_data = _read_upload( stream, max_size )
+    if not image_data:
+        abort( 400 )
+
+    # replace the record's image
+    # NOTE: SQLAlchemy needs the image data as a single value, so we can't stream it into the database,
+    # but at least we're now only holding a single copy of it.
+    owner = model.query.get( image_id )
+    if not owner:
+        abort( 404 )
+    save_image( image_type, image_id, fname, image_data )
+    owner.time_updated = datetime.datetime.now()
+    if data_type:
+        log_changes( data_type, [ image_id ] )
+    db.session.commit()
+
+    return make_ok_response( extras={ "imageSize": len(image_data) } )
+
+def _read_upload( stream, max_size ):
+    """Read uploaded data, up to the specified size limit."""
+    buf = io.BytesIO()
+    while True:
+        chunk = stream.read( _UPLOAD_CHUNK_SIZE )
+        if not chunk:
+            break
+        if buf.tell() + len(chunk) > max_size:
+            abort( 413 )
+        buf.write( chunk )
+    return buf.getvalue()
+
+# ---------------------------------------------------------------------
+
+def save_image( image_type, owner_id, fname, image_data ):
+    """Save the image for a publisher, publication or article (replacing any existing one)."""
+
+    # add the new image data (or another reference to it, if we already have it)
+    # NOTE: Someone else might be saving the same image at the same time, so we update the reference count
+    # in the database (rather than reading it, then writing it back), and if we both try to add the image data,
+    # whoever loses adds another reference to the other's instead.
+    image_hash = hashlib.sha256( image_data ).hexdigest()
+    while not _update_ref_count( image_hash, +1 ):
+        try:
+            with db.session.begin_nested(): #pylint: disable=not-context-manager
+                db.session.add( ImageBlob(
+                    image_hash=image_hash, image_data=image_data, image_size=len(image_data), ref_count=1
+                ) )
+            break
+        except IntegrityError:
+            _logger.debug( "Image blob was added by someone else: %s", image_hash )
+
+    # NOTE: We add the new reference before releasing the old one, so that if a record's image is replaced
+    # with the same image, we don't delete the blob, only to add it back again.
+    remove_images( image_type, [ owner_id ] )
+    _, image_model, key_name, _ = _IMAGE_OWNERS[ image_type ]
+    db.session.add( image_model( **{
+        key_name: owner_id, "image_filename": fname, "image_hash": image_hash
+    } ) )
+    db.session.flush()
+    _logger.debug( "Created new image: %s, #bytes=%d, hash=%s", fname, len(image_data), image_hash )
+
+def remove_images( image_type, owner_ids ):
+    """Remove the images for the specified publishers, publications or articles."""
+
+    # NOTE: Deleting a record will also delete its image (via a cascading delete), but the caller
+    # needs to call this first, so that the image data gets cleaned up if nothing else is using it.
+    _, image_model, key_name, _ = _IMAGE_OWNERS[ image_type ]
+    key_col = getattr( image_model, key_name )
+    ref_counts = Counter()
+    for batch in get_batches( owner_ids ):
+        query = image_model.query.filter( key_col.in_( batch ) )
+        ref_counts.update( img.image_hash for img in query )
+        query.delete( synchronize_session=False )
+    if not ref_counts:
+        return
+    db.session.flush()
+
+    # release the image data
+    for image_hash, ref_count in ref_counts.items():
+        _update_ref_count( image_hash, -ref_count )
+    for batch in get_batches( list( ref_counts.keys() ) ):
+        query = ImageBlob.query.filter( ImageBlob.image_hash.in_( batch ), ImageBlob.ref_count <= 0 )
+        image_hashes = [ row[0] for row in query.with_entities( ImageBlob.image_hash ) ]
+        if not image_hashes:
+            continue
+        _logger.debug( "Deleting image blobs: %s", image_hashes )
+        query.delete( synchronize_session=False )
+        for cache_type in _FILE_CACHES:
+            cache = _get_file_cache( cache_type )
+            if cache:
+                for image_hash in image_hashes:
+                    cache.remove( image_hash )
+
+def _update_ref_count( image_hash, delta ):
+    """Update the reference count for some image data (returns False if we don't have it)."""
+    # NOTE: This is done as a single UPDATE, so that concurrent updates don't get lost.
+    nrows = ImageBlob.query.filter( ImageBlob.image_hash == image_hash ) \
+        .update( { ImageBlob.ref_count: ImageBlob.ref_count + delta }, synchronize_session=False )
+    return nrows > 0
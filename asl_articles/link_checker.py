@@ -0,0 +1,192 @@
+""" Check links in the background. """
+
+import threading
+import time
+import uuid
+import urllib.request
+import urllib.error
+import urllib.parse
+import http.client
+import itertools
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+_JOB_EXPIRY = 60 * 60
+
+_logger = logging.getLogger( "links" )
+
+# ---------------------------------------------------------------------
+
+class LinkChecker: #pylint: disable=too-many-instance-attributes
+    """Check links in the background."""
+
+    # NOTE: Checking thousands of links one request at a time is slow, and ties up the web server's threads,
+    # so the front-end gives us all the links it wants checked, we check them concurrently (limiting how many
+    # requests we make to any one host at a time), and it polls us for the results. We also cache the results
+    # for a while, since a user who is fixing broken links will probably want to check them all again.
+
+    def __init__( self, max_workers, max_per_host, timeout, cache_ttl ):
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self._executor = ThreadPoolExecutor( max_workers=max_workers, thread_name_prefix="link-checker" )
+        self._lock = threading.Lock()
+        self._host_semaphores = defaultdict( lambda: threading.BoundedSemaphore( self.max_per_host ) )
+        self._cached_results = {}
+        self._jobs = {}
+
+    def start_job( self, urls ):
+        """Start checking a list of links."""
+        self._purge()
+        job = LinkCheckJob( urls )
+        _logger.debug( "Starting link-check job %s: #urls=%d", job.job_id, len(job.urls) )
+        with self._lock:
+            self._jobs[ job.job_id ] = job
+            cached_results = [ self._cached_results.get( url ) for url in job.urls ]
+        # NOTE: We interleave the links by host, so that the worker threads don't all end up waiting
+        # for the same host, while links to other hosts sit in the queue.
+        to_check = defaultdict( list )
+        for url, cached_result in zip( job.urls, cached_results ):
+            if cached_result and time.time() - cached_result[0] < self.cache_ttl:
+                job.add_result( cached_result[1] )
+            else:
+                to_check[ _get_host( url ) ].append( url )
+        for url in itertools.chain.from_iterable( itertools.zip_longest( *to_check.values() ) ):
+            if url:
+                job.futures.append( self._executor.submit( self._check_job_link, job, url ) )
+        return job
+
+    def get_job( self, job_id ):
+        """Get a link-check job."""
+        with self._lock:
+            job = self._jobs.get( job_id )
+        if job:
+            job.last_access = time.time()
+        return job
+
+    def take_over( self, link_checker ):
+        """Take over the jobs and cached results from another link checker, and shut it down."""
+        jobs, cached_results = link_checker.shutdown()
+        with self._lock:
+            self._jobs.update( jobs )
+            self._cached_results.update( cached_results )
+
+    def shutdown( self ):
+        """Shut down the link checker (jobs that have already been started will still finish)."""
+        self._executor.shutdown( wait=False )
+        with self._lock:
+            return dict( self._jobs ), dict( self._cached_results )
+
+    def _check_job_link( self, job, url ):
+        """Check a link for a job."""
+        if job.is_stopped:
+            return
+        with self._lock:
+            host_semaphore = self._host_semaphores[ _get_host( url ) ]
+        with host_semaphore:
+            if job.is_stopped:
+                return
+            # NOTE: We must always add a result, otherwise the job will never finish.
+            try:
+                result = check_link( url, self.timeout )
+            except Exception as ex: #pylint: disable=broad-except
+                _logger.error( "Unexpected error checking link: %s (%s)", url, ex )
+                result = _make_result( url, None, ex )
+        with self._lock:
+            self._cached_results[ url ] = ( time.time(), result )
+        job.add_result( result )
+
+    def _purge( self ):
+        """Remove expired jobs and results."""
+        now = time.time()
+        with self._lock:
+            for job_id, job in list( self._jobs.items() ):
+                if now - job.last_access > _JOB_EXPIRY:
+                    job.stop()
+                    del self._jobs[ job_id ]
+            for url, cached_result in list( self._cached_results.items() ):
+                if now - cached_result[0] >= self.cache_ttl:
+                    del self._cached_results[ url ]
+
+# ---------------------------------------------------------------------
+
+class LinkCheckJob:
+    """Check a list of links."""
+
+    def __init__( self, urls ):
+        self.job_id = uuid.uuid4().hex
+        self.urls = list( dict.fromkeys( urls ) ) # nb: remove duplicates, but keep the order
+        self.results = []
+        self.futures = []
+        self.is_stopped = False
+        self.last_access = time.time()
+        self._lock = threading.Lock()
+
+    def add_result( self, result ):
+        """Add the result of checking a link."""
+        with self._lock:
+            self.results.append( result )
+
+    def stop( self ):
+        """Stop the job."""
+        _logger.debug( "Stopping link-check job %s.", self.job_id )
+        self.is_stopped = True
+        for future in self.futures:
+            future.cancel()
+
+    def get_status( self, start=0 ):
+        """Get the job's status (and any results after the specified position)."""
+        with self._lock:
+            results = self.results[ start: ]
+            n_done = len( self.results )
+        return {
+            "jobId": self.job_id,
+            "total": len( self.urls ),
+            "done": n_done,
+            "finished": n_done >= len( self.urls ) or self.is_stopped,
+            "results": results,
+        }
+
+# ---------------------------------------------------------------------
+
+def check_link( url, timeout ):
+    """Check if a link appears to be working."""
+    try:
+        status = _get_status( url, "HEAD", timeout )
+    except urllib.error.HTTPError:
+        # NOTE: Some servers don't support HEAD requests (or don't handle them properly), so we try again with a GET.
+        try:
+            status = _get_status( url, "GET", timeout )
+        except urllib.error.HTTPError as ex:
+            status = ex.code
+        except ( urllib.error.URLError, OSError, ValueError, http.client.HTTPException ) as ex:
+            return _make_result( url, None, ex )
+    except ( urllib.error.URLError, OSError, ValueError, http.client.HTTPException ) as ex:
+        return _make_result( url, None, ex )
+    return _make_result( url, status, None )
+
+def _get_status( url, method, timeout ):
+    """Send a request to a URL, and return the HTTP status code."""
+    # NOTE: We don't read the response, so a GET won't download the whole page.
+    with urllib.request.urlopen( urllib.request.Request( url, method=method ), timeout=timeout ) as resp:
+        return resp.code
+
+def _make_result( url, status, exc ):
+    """Generate the result of checking a link."""
+    if exc:
+        _logger.debug( "Link check failed: %s (%s)", url, exc )
+    return {
+        "url": url,
+        "ok": status is not None and 200 <= status < 300,
+        "status": status,
+        "error": str( getattr( exc, "reason", exc ) ) if exc else None,
+    }
+
+def _get_host( url ):
+    """Get the host for a URL."""
+    try:
+        return urllib.parse.urlsplit( url ).netloc.lower()
+    except ValueError:
+        return ""
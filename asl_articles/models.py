@@ -2,8 +2,9 @@
 
 # NOTE: Don't forget to keep the list of tables in init_tests() in sync with the models defined here.
 
-from sqlalchemy.orm import deferred
+from sqlalchemy.orm import deferred, column_property
 from sqlalchemy.schema import UniqueConstraint
+from sqlalchemy.sql.expression import case, func, select
 
 from asl_articles import db
 
@@ -22,8 +23,13 @@ class Publisher( db.Model ):
     time_updated = db.Column( db.TIMESTAMP(timezone=True) )
     #
     publ_image = db.relationship( "PublisherImage", backref="parent_publ", passive_deletes=True )
-    publications = db.relationship( "Publication", backref="parent_publ", passive_deletes=True )
-    articles = db.relationship( "Article", backref="parent_publ", passive_deletes=True )
+    # NOTE: The sort order functions are defined at the end of this file, so we need to use lambda's here.
+    publications = db.relationship( "Publication", backref="parent_publ", passive_deletes=True,
+        order_by = lambda: get_publication_sort_order() #pylint: disable=unnecessary-lambda
+    )
+    articles = db.relationship( "Article", backref="parent_publ", passive_deletes=True,
+        order_by = lambda: get_article_sort_order() #pylint: disable=unnecessary-lambda
+    )
 
     def __repr__( self ):
         return "<Publisher:{}|{}>".format( self.publ_id, self.publ_name )
@@ -50,7 +56,14 @@ class Publication( db.Model ):
     time_updated = db.Column( db.TIMESTAMP(timezone=True) )
     #
     pub_image = db.relationship( "PublicationImage", backref="parent_pub", passive_deletes=True )
-    articles = db.relationship( "Article", backref="parent_pub", passive_deletes=True )
+    articles = db.relationship( "Article", backref="parent_pub", passive_deletes=True,
+        order_by = lambda: get_article_sort_order() #pylint: disable=unnecessary-lambda
+    )
+    #
+    # NOTE: This index is used to find a publisher's publications, and sort them.
+    __table_args__ = (
+        db.Index( "ix_publication_publ_id_seqno", "publ_id", "pub_seqno" ),
+    )
 
     def __repr__( self ):
         return "<Publication:{}|{}>".format( self.pub_id, self.pub_name )
@@ -74,7 +87,8 @@ class Article( db.Model ):
         db.ForeignKey( Publication.__table__.c.pub_id, ondelete="CASCADE" )
     )
     publ_id = db.Column( db.Integer,
-        db.ForeignKey( Publisher.__table__.c.publ_id, ondelete="CASCADE" )
+        db.ForeignKey( Publisher.__table__.c.publ_id, ondelete="CASCADE" ),
+        index = True
     )
     # NOTE: time_created should be non-nullable, but getting this to work on both SQLite and Postgres
     # is more trouble than it's worth :-/
@@ -82,8 +96,17 @@ class Article( db.Model ):
     time_updated = db.Column( db.TIMESTAMP(timezone=True) )
     #
     article_image = db.relationship( "ArticleImage", backref="parent_article", passive_deletes=True )
-    article_authors = db.relationship( "ArticleAuthor", backref="parent_article", passive_deletes=True )
-    article_scenarios = db.relationship( "ArticleScenario", backref="parent_article", passive_deletes=True )
+    article_authors = db.relationship( "ArticleAuthor", backref="parent_article", passive_deletes=True,
+        order_by = lambda: ArticleAuthor.seq_no
+    )
+    article_scenarios = db.relationship( "ArticleScenario", backref="parent_article", passive_deletes=True,
+        order_by = lambda: ArticleScenario.seq_no
+    )
+    #
+    # NOTE: This index is used to find a publication's articles, and sort them.
+    __table_args__ = (
+        db.Index( "ix_article_pub_id_seqno", "pub_id", "article_seqno" ),
+    )
 
     def __repr__( self ):
         return "<Article:{}|{}>".format( self.article_id, self.article_title )
@@ -108,11 +131,11 @@ class ArticleAuthor( db.Model ):
     seq_no = db.Column( db.Integer, nullable=False )
     article_id = db.Column( db.Integer,
         db.ForeignKey( Article.__table__.c.article_id, ondelete="CASCADE" ),
-        nullable = False
+        nullable = False, index = True
     )
     author_id = db.Column( db.Integer,
         db.ForeignKey( Author.__table__.c.author_id, ondelete="CASCADE" ),
-        nullable = False
+        nullable = False, index = True
     )
 
     def __repr__( self ):
@@ -126,6 +149,20 @@ class ArticleAuthor( db.Model ):
 # since we can't set up a foreign key relationship between these rows and their parent.
 # While it probably won't matter for a database this size, keeping large blobs in the main tables
 # is a bit icky, so we create separate tables for each type of image.
+# NOTE: The image data itself is stored in the image_blob table, keyed by its hash, so that if the same image
+# is used by multiple records, we only store one copy of it. We keep a count of how many image rows refer to
+# each blob, so that we know when it can be deleted (see images.py).
+
+class ImageBlob( db.Model ):
+    """Define the ImageBlob model."""
+
+    image_hash = db.Column( db.String(64), primary_key=True ) # nb: SHA-256 of the image data
+    image_data = deferred( db.Column( db.LargeBinary, nullable=False ) )
+    image_size = db.Column( db.Integer, nullable=False ) # nb: so that we can report on images without loading them
+    ref_count = db.Column( db.Integer, nullable=False )
+
+    def __repr__( self ):
+        return "<ImageBlob:{}|{}>".format( self.image_hash, self.ref_count )
 
 class PublisherImage( db.Model ):
     """Define the PublisherImage model."""
@@ -135,10 +172,13 @@ class PublisherImage( db.Model ):
         primary_key = True
     )
     image_filename = db.Column( db.String(500), nullable=False )
-    image_data = deferred( db.Column( db.LargeBinary, nullable=False ) )
+    image_hash = db.Column( db.String(64),
+        db.ForeignKey( ImageBlob.__table__.c.image_hash ),
+        nullable = False, index = True
+    )
 
     def __repr__( self ):
-        return "<PublisherImage:{}|{}>".format( self.publ_id, len(self.image_data) )
+        return "<PublisherImage:{}|{}>".format( self.publ_id, self.image_hash )
 
 class PublicationImage( db.Model ):
     """Define the PublicationImage model."""
@@ -148,10 +188,13 @@ class PublicationImage( db.Model ):
         primary_key = True
     )
     image_filename = db.Column( db.String(500), nullable=False )
-    image_data = deferred( db.Column( db.LargeBinary, nullable=False ) )
+    image_hash = db.Column( db.String(64),
+        db.ForeignKey( ImageBlob.__table__.c.image_hash ),
+        nullable = False, index = True
+    )
 
     def __repr__( self ):
-        return "<PublicationImage:{}|{}>".format( self.pub_id, len(self.image_data) )
+        return "<PublicationImage:{}|{}>".format( self.pub_id, self.image_hash )
 
 class ArticleImage( db.Model ):
     """Define the ArticleImage model."""
@@ -161,10 +204,65 @@ class ArticleImage( db.Model ):
         primary_key = True
     )
     image_filename = db.Column( db.String(500), nullable=False )
-    image_data = deferred( db.Column( db.LargeBinary, nullable=False ) )
+    image_hash = db.Column( db.String(64),
+        db.ForeignKey( ImageBlob.__table__.c.image_hash ),
+        nullable = False, index = True
+    )
 
     def __repr__( self ):
-        return "<ArticleImage:{}|{}>".format( self.article_id, len(self.image_data) )
+        return "<ArticleImage:{}|{}>".format( self.article_id, self.image_hash )
+
+# NOTE: We often need to know if a record has an image, but checking the image relationship loads the image row
+# (one query per record). These columns get the image's hash (or NULL, if there is no image) using a sub-query
+# in the main query instead. The hash also lets the front-end generate image URL's that can be cached forever.
+Publisher.publ_image_hash = column_property(
+    select( [ PublisherImage.image_hash ] )
+        .where( PublisherImage.publ_id == Publisher.publ_id )
+        .correlate_except( PublisherImage )
+        .as_scalar()
+)
+Publication.pub_image_hash = column_property(
+    select( [ PublicationImage.image_hash ] )
+        .where( PublicationImage.pub_id == Publication.pub_id )
+        .correlate_except( PublicationImage )
+        .as_scalar()
+)
+Article.article_image_hash = column_property(
+    select( [ ArticleImage.image_hash ] )
+        .where( ArticleImage.article_id == Article.article_id )
+        .correlate_except( ArticleImage )
+        .as_scalar()
+)
+
+# NOTE: These count the publications/articles associated with a record, using sub-queries in the main query.
+# They are deferred, since they are only needed when returning individual records (see get_publisher()).
+Publication.pub_article_count = column_property(
+    select( [ func.count( Article.article_id ) ] )
+        .where( Article.pub_id == Publication.pub_id )
+        .correlate_except( Article )
+        .as_scalar(),
+    deferred = True
+)
+Publisher.publ_pub_count = column_property(
+    select( [ func.count( Publication.pub_id ) ] )
+        .where( Publication.publ_id == Publisher.publ_id )
+        .correlate_except( Publication )
+        .as_scalar(),
+    deferred = True
+)
+# NOTE: A publisher's articles are those in its publications, plus those associated directly with it.
+Publisher.publ_article_count = column_property(
+    select( [ func.count( Article.article_id ) ] )
+        .where( Article.pub_id == Publication.pub_id )
+        .where( Publication.publ_id == Publisher.publ_id )
+        .correlate_except( Article, Publication )
+        .as_scalar()
+    + select( [ func.count( Article.article_id ) ] )
+        .where( Article.publ_id == Publisher.publ_id )
+        .correlate_except( Article )
+        .as_scalar(),
+    deferred = True
+)
 
 # ---------------------------------------------------------------------
 
@@ -194,11 +292,11 @@ class ArticleScenario( db.Model ):
     seq_no = db.Column( db.Integer, nullable=False )
     article_id = db.Column( db.Integer,
         db.ForeignKey( Article.__table__.c.article_id, ondelete="CASCADE" ),
-        nullable = False
+        nullable = False, index = True
     )
     scenario_id = db.Column( db.Integer,
         db.ForeignKey( Scenario.__table__.c.scenario_id, ondelete="CASCADE" ),
-        nullable = False
+        nullable = False, index = True
     )
 
     def __repr__( self ):
@@ -208,6 +306,51 @@ class ArticleScenario( db.Model ):
 
 # ---------------------------------------------------------------------
 
+class ChangeLog( db.Model ):
+    """Define the ChangeLog model."""
+
+    # NOTE: This records what data has changed, so that the front-end can update the data it caches
+    # without having to re-fetch everything. The change ID is used as a version number for the data.
+    change_id = db.Column( db.Integer, primary_key=True )
+    data_type = db.Column( db.String(20), nullable=False )
+    record_id = db.Column( db.Integer ) # nb: this is NULL if the data type isn't stored per-record (e.g. tags)
+    deleted = db.Column( db.Boolean, nullable=False, default=False )
+    time_changed = db.Column( db.TIMESTAMP(timezone=True) )
+    #
+    __table_args__ = (
+        db.Index( "ix_change_log_type", "data_type", "change_id" ),
+    )
+
+    def __repr__( self ):
+        return "<ChangeLog:{}|{}:{}{}>".format( self.change_id, self.data_type, self.record_id,
+            " (deleted)" if self.deleted else ""
+        )
+
+# ---------------------------------------------------------------------
+
+def get_publication_sort_order( reverse=False ):
+    """Get the sort order for publications within their parent publisher."""
+    # FUDGE! We used to sort by time_created, but later added a seq#, so we now want to
+    # sort by seq# first, then fallback to time_created. Publications that have neither
+    # appear before everything else.
+    order = [
+        case( [
+            ( Publication.pub_seqno.isnot( None ), 1 ),
+            ( Publication.time_created.isnot( None ), 2 )
+        ], else_=0 ),
+        Publication.pub_seqno, Publication.time_created
+    ]
+    if reverse:
+        order = [ o.desc() for o in order ]
+    return order + [ Publication.pub_id ]
+
+def get_article_sort_order():
+    """Get the sort order for articles within their parent publication."""
+    # NOTE: Articles should always have a seq# but sometimes they might not (e.g. created via a fixture).
+    return [ func.coalesce( Article.article_seqno, 999 ), Article.article_id ]
+
+# ---------------------------------------------------------------------
+
 def get_model_from_table_name( table_name ):
     """Return the model class for the specified table."""
     pos = table_name.find( "_" )
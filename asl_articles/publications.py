@@ -5,15 +5,18 @@ import base64
 import logging
 
 from flask import request, jsonify, abort
+from sqlalchemy.orm import selectinload, joinedload, undefer
 from sqlalchemy.sql.expression import func
 
 from asl_articles import app, db
-from asl_articles.models import Publication, PublicationImage, Article
-from asl_articles.articles import get_article_vals, get_article_sort_key
+from asl_articles.models import Publication, Article
+from asl_articles.articles import get_article_vals, get_article_loader_options
 import asl_articles.publishers
+from asl_articles.images import save_image, remove_images, get_image_version
 from asl_articles import search
+from asl_articles.versions import log_changes, make_conditional_response
 from asl_articles.utils import get_request_args, clean_request_args, clean_tags, encode_tags, decode_tags, \
-    apply_attrs, make_ok_response
+    apply_attrs, make_ok_response, parse_id_list, get_batches
 
 _logger = logging.getLogger( "db" )
 
@@ -23,28 +26,49 @@ _FIELD_NAMES = [ "*pub_name", "pub_edition", "pub_description", "pub_date", "pub
 
 @app.route( "/publications" )
 def get_publications():
-    """Get all publications."""
-    return jsonify( {
+    """Get all publications (or just the specified ones)."""
+    if "ids" in request.args:
+        return _get_publications( parse_id_list( request.args["ids"] ) )
+    return make_conditional_response( "publications", lambda: {
         pub.pub_id: get_publication_vals( pub, False, False )
         for pub in Publication.query.all()
     } )
 
+def _get_publications( pub_ids ):
+    """Get multiple publications."""
+    _logger.debug( "Get publications: ids=%s", pub_ids )
+    include_articles = request.args.get( "include_articles" )
+    deep = request.args.get( "deep" )
+    # NOTE: Publications that don't exist are not included in the response.
+    pubs = {}
+    for batch in get_batches( pub_ids ):
+        query = Publication.query.filter( Publication.pub_id.in_( batch ) ) \
+            .options( *get_publication_loader_options( None, include_articles, deep ) ) \
+            .options( undefer( Publication.pub_article_count ) )
+        for pub in query:
+            vals = get_publication_vals( pub, include_articles, deep )
+            vals[ "nArticles" ] = pub.pub_article_count
+            pubs[ pub.pub_id ] = vals
+    _logger.debug( "- Found %d publications.", len(pubs) )
+    return jsonify( pubs )
+
 # ---------------------------------------------------------------------
 
 @app.route( "/publication/<pub_id>" )
 def get_publication( pub_id ):
     """Get a publication."""
     _logger.debug( "Get publication: id=%s", pub_id )
-    pub = Publication.query.get( pub_id )
+    include_articles = request.args.get( "include_articles" )
+    deep = request.args.get( "deep" )
+    # NOTE: The number of associated articles is counted in the same query that gets the publication.
+    pub = Publication.query.options(
+        *get_publication_loader_options( None, include_articles, deep ),
+        undefer( Publication.pub_article_count )
+    ).get( pub_id )
     if not pub:
         abort( 404 )
-    vals = get_publication_vals( pub,
-        request.args.get( "include_articles" ),
-        request.args.get( "deep" )
-    )
-    # include the number of associated articles
-    query = Article.query.filter_by( pub_id = pub_id )
-    vals[ "nArticles" ] = query.count()
+    vals = get_publication_vals( pub, include_articles, deep )
+    vals[ "nArticles" ] = pub.pub_article_count
     _logger.debug( "- %s ; #articles=%d", pub, vals["nArticles"] )
     return jsonify( vals )
 
@@ -59,33 +83,33 @@ def get_publication_vals( pub, include_articles, deep ):
         "pub_description": pub.pub_description,
         "pub_url": pub.pub_url,
         "pub_seqno": pub.pub_seqno,
-        "pub_image_id": pub.pub_id if pub.pub_image else None,
+        "pub_image_id": pub.pub_id if pub.pub_image_hash else None,
+        "pub_image_version": get_image_version( pub.pub_image_hash ),
         "pub_tags": decode_tags( pub.pub_tags ),
         "publ_id": pub.publ_id,
         "time_created": int( pub.time_created.timestamp() ) if pub.time_created else None,
     }
     if include_articles:
-        articles = sorted( pub.articles, key=get_article_sort_key )
-        vals[ "articles" ] = [ get_article_vals( a, False ) for a in articles ]
+        vals[ "articles" ] = [ get_article_vals( a, False ) for a in pub.articles ]
     if deep:
         vals[ "_parent_publ" ] = asl_articles.publishers.get_publisher_vals(
             pub.parent_publ, False, False
         ) if pub.parent_publ else None
     return vals
 
-def get_publication_sort_key( pub ):
-    """Get a publication's sort key."""
-    # NOTE: This is used to sort publications within their parent publisher.
-    # FUDGE! We used to sort by time_created, but later added a seq#, so we now want to
-    # sort by seq# first, then fallback to time_created.
-    # NOTE: We assume that the seq# values are all small, and less than any timestamp.
-    # This means that any seq# value will appear before any timestamp in the sort order.
-    if pub.pub_seqno:
-        return pub.pub_seqno
-    elif pub.time_created:
-        return int( pub.time_created.timestamp() )
-    else:
-        return 0
+def get_publication_loader_options( path, include_articles, deep ):
+    """Get the loader options needed to extract the public fields from Publication records."""
+    # NOTE: If the publications are being loaded via a relationship, the caller should pass in
+    # a loader option for it (see get_article_loader_options()).
+    opts = []
+    if include_articles:
+        articles = path.selectinload( Publication.articles ) if path else selectinload( Publication.articles )
+        opts.extend( get_article_loader_options( articles ) )
+    if deep:
+        opts.append(
+            path.joinedload( Publication.parent_publ ) if path else joinedload( Publication.parent_publ )
+        )
+    return opts
 
 # ---------------------------------------------------------------------
 
@@ -109,7 +133,10 @@ def create_publication():
     pub = Publication( **vals )
     db.session.add( pub )
     _set_seqno( pub, pub.publ_id )
+    db.session.flush() # nb: so that we have the new publication's ID (for saving the image)
     _save_image( pub )
+    log_changes( "publications", [ pub.pub_id ] )
+    log_changes( "tags" )
     db.session.commit()
     _logger.debug( "- New ID: %d", pub.pub_id )
     search.add_or_update_publication( None, pub, None )
@@ -144,20 +171,17 @@ def _save_image( pub ):
     if not image_data:
         return
 
-    # yup - delete the old one from the database
-    PublicationImage.query.filter( PublicationImage.pub_id == pub.pub_id ).delete()
+    # yup - check if we should remove the current image
     if image_data == "{remove}":
         # NOTE: The front-end sends this if it wants the publication to have no image.
+        remove_images( "publication", [ pub.pub_id ] )
         pub.pub_image_id = None
         return
 
     # add the new image to the database
     image_data = base64.b64decode( image_data )
     fname = request.json.get( "imageFilename" )
-    img = PublicationImage( pub_id=pub.pub_id, image_filename=fname, image_data=image_data )
-    db.session.add( img )
-    db.session.flush()
-    _logger.debug( "Created new image: %s, #bytes=%d", fname, len(image_data) )
+    save_image( "publication", pub.pub_id, fname, image_data )
 
 # ---------------------------------------------------------------------
 
@@ -173,6 +197,8 @@ def update_publication():
     warnings = []
     clean_request_args( vals, _FIELD_NAMES, warnings, _logger )
     article_order = request.json.get( "article_order" )
+    if article_order is not None:
+        _check_article_order( article_order )
 
     # NOTE: Tags are stored in the database using \n as a separator, so we need to encode *after* cleaning them.
     cleaned_tags = clean_tags( vals.get("pub_tags"), warnings )
@@ -188,20 +214,9 @@ def update_publication():
     apply_attrs( pub, vals )
     _save_image( pub )
     if article_order:
-        query = Article.query.filter( Article.pub_id == pub_id )
-        articles = { int(a.article_id): a for a in query }
-        for n,article_id in enumerate(article_order):
-            if article_id not in articles:
-                _logger.warning( "Can't set seq# for article %d, not in publication %d: %s",
-                    article_id, pub_id, article_order
-                )
-                continue
-            articles[ article_id ].article_seqno = n
-            del articles[ article_id ]
-        if articles:
-            _logger.warning( "seq# was not set for some articles in publication %d: %s",
-                pub_id, ", ".join(str(k) for k in articles)
-            )
+        _set_article_order( pub.pub_id, article_order )
+    log_changes( "publications", [ pub.pub_id ] )
+    log_changes( "tags" )
     db.session.commit()
     search.add_or_update_publication( None, pub, None )
 
@@ -209,6 +224,60 @@ def update_publication():
     vals = get_publication_vals( pub, False, True )
     return make_ok_response( record=vals, warnings=warnings )
 
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+@app.route( "/publication/<pub_id>/reorder", methods=["POST"] )
+def reorder_publication( pub_id ):
+    """Change the order of the articles in a publication."""
+
+    # parse the input
+    article_order = request.json.get( "article_order" ) if isinstance( request.json, dict ) else None
+    _check_article_order( article_order )
+    _logger.debug( "Reorder publication: id=%s ; articles=%s", pub_id, article_order )
+    pub_id = db.session.query( Publication.pub_id ) \
+        .filter( Publication.pub_id == pub_id ) \
+        .scalar()
+    if not pub_id:
+        abort( 404 )
+
+    # update the article seq#'s
+    # NOTE: The seq#'s aren't stored in the search index, so we don't need to update it.
+    _set_article_order( pub_id, article_order )
+    db.session.commit()
+
+    return make_ok_response()
+
+def _check_article_order( article_order ):
+    """Check the article order provided for a publication."""
+    if not isinstance( article_order, list ):
+        abort( 400, "Expected a list of article ID's: {}".format( article_order ) )
+    for article_id in article_order:
+        if not isinstance( article_id, int ):
+            abort( 400, "Expected an article ID: {}".format( article_id ) )
+
+def _set_article_order( pub_id, article_order ):
+    """Set the seq#'s for the articles in a publication."""
+
+    # NOTE: We only need the article ID's (not full Article objects), and we update the seq#'s
+    # in one go, using an executemany.
+    query = db.session.query( Article.article_id ) \
+        .filter( Article.pub_id == pub_id )
+    article_ids = set( row[0] for row in query )
+    updates = []
+    for n,article_id in enumerate(article_order):
+        if article_id not in article_ids:
+            _logger.warning( "Can't set seq# for article %d, not in publication %d: %s",
+                article_id, pub_id, article_order
+            )
+            continue
+        updates.append( { "article_id": article_id, "article_seqno": n } )
+        article_ids.remove( article_id )
+    if article_ids:
+        _logger.warning( "seq# was not set for some articles in publication %d: %s",
+            pub_id, ", ".join( str(k) for k in sorted(article_ids) )
+        )
+    db.session.bulk_update_mappings( Article, updates )
+
 # ---------------------------------------------------------------------
 
 @app.route( "/publication/delete/<pub_id>" )
@@ -228,10 +297,13 @@ def delete_publication( pub_id ):
     deleted_articles = [ r[0] for r in query ]
 
     # delete the publication
+    remove_images( "publication", [ pub.pub_id ] )
+    remove_images( "article", deleted_articles )
     db.session.delete( pub )
+    log_changes( "publications", [ pub.pub_id ], deleted=True )
+    log_changes( "tags" )
     db.session.commit()
-    search.delete_publications( [ pub ] )
-    search.delete_articles( deleted_articles )
+    search.delete_searchables( publications=[ pub ], articles=deleted_articles )
 
     # generate the response
     extras = { "deletedArticles": deleted_articles }
@@ -5,13 +5,17 @@ import base64
 import logging
 
 from flask import request, jsonify, abort
+from sqlalchemy.orm import selectinload, undefer
 
 from asl_articles import app, db
-from asl_articles.models import Publisher, PublisherImage, Publication, Article
-from asl_articles.publications import get_publication_vals, get_publication_sort_key
-from asl_articles.articles import get_article_vals, get_article_sort_key
+from asl_articles.models import Publisher, Publication, Article
+from asl_articles.publications import get_publication_vals, get_publication_loader_options
+from asl_articles.articles import get_article_vals, get_article_loader_options
+from asl_articles.images import save_image, remove_images, get_image_version
 from asl_articles import search
-from asl_articles.utils import get_request_args, clean_request_args, make_ok_response, apply_attrs
+from asl_articles.versions import log_changes, make_conditional_response
+from asl_articles.utils import get_request_args, clean_request_args, make_ok_response, apply_attrs, \
+    parse_id_list, get_batches
 
 _logger = logging.getLogger( "db" )
 
@@ -21,12 +25,33 @@ _FIELD_NAMES = [ "*publ_name", "publ_description", "publ_url" ]
 
 @app.route( "/publishers" )
 def get_publishers():
-    """Get all publishers."""
-    return jsonify( {
+    """Get all publishers (or just the specified ones)."""
+    if "ids" in request.args:
+        return _get_publishers( parse_id_list( request.args["ids"] ) )
+    return make_conditional_response( "publishers", lambda: {
         publ.publ_id: get_publisher_vals( publ, False, False )
         for publ in Publisher.query.all()
     } )
 
+def _get_publishers( publ_ids ):
+    """Get multiple publishers."""
+    _logger.debug( "Get publishers: ids=%s", publ_ids )
+    include_pubs = request.args.get( "include_pubs" )
+    include_articles = request.args.get( "include_articles" )
+    # NOTE: Publishers that don't exist are not included in the response.
+    publs = {}
+    for batch in get_batches( publ_ids ):
+        query = Publisher.query.filter( Publisher.publ_id.in_( batch ) ) \
+            .options( *get_publisher_loader_options( include_pubs, include_articles ) ) \
+            .options( undefer( Publisher.publ_pub_count ), undefer( Publisher.publ_article_count ) )
+        for publ in query:
+            vals = get_publisher_vals( publ, include_pubs, include_articles )
+            vals[ "nPublications" ] = publ.publ_pub_count
+            vals[ "nArticles" ] = publ.publ_article_count
+            publs[ publ.publ_id ] = vals
+    _logger.debug( "- Found %d publishers.", len(publs) )
+    return jsonify( publs )
+
 # ---------------------------------------------------------------------
 
 @app.route( "/publisher/<publ_id>" )
@@ -34,23 +59,19 @@ def get_publisher( publ_id ):
     """Get a publisher."""
     _logger.debug( "Get publisher: id=%s", publ_id )
     # get the publisher
-    publ = Publisher.query.get( publ_id )
+    include_pubs = request.args.get( "include_pubs" )
+    include_articles = request.args.get( "include_articles" )
+    # NOTE: The number of associated publications and articles are counted in the same query
+    # that gets the publisher.
+    publ = Publisher.query.options(
+        *get_publisher_loader_options( include_pubs, include_articles ),
+        undefer( Publisher.publ_pub_count ), undefer( Publisher.publ_article_count )
+    ).get( publ_id )
     if not publ:
         abort( 404 )
-    vals = get_publisher_vals( publ,
-        request.args.get( "include_pubs" ),
-        request.args.get( "include_articles" )
-    )
-    # include the number of associated publications
-    query = Publication.query.filter_by( publ_id = publ_id )
-    vals[ "nPublications" ] = query.count()
-    # include the number of associated articles
-    query = db.session.query( Article, Publication ) \
-        .filter( Publication.publ_id == publ_id ) \
-        .filter( Article.pub_id == Publication.pub_id )
-    nArticles = query.count()
-    nArticles2 = Article.query.filter_by( publ_id = publ_id ).count()
-    vals[ "nArticles" ] = nArticles + nArticles2
+    vals = get_publisher_vals( publ, include_pubs, include_articles )
+    vals[ "nPublications" ] = publ.publ_pub_count
+    vals[ "nArticles" ] = publ.publ_article_count
     _logger.debug( "- %s ; #publications=%d ; #articles=%d", publ, vals["nPublications"], vals["nArticles"] )
     return jsonify( vals )
 
@@ -62,16 +83,24 @@ def get_publisher_vals( publ, include_pubs, include_articles ):
         "publ_name": publ.publ_name,
         "publ_description": publ.publ_description,
         "publ_url": publ.publ_url,
-        "publ_image_id": publ.publ_id if publ.publ_image else None,
+        "publ_image_id": publ.publ_id if publ.publ_image_hash else None,
+        "publ_image_version": get_image_version( publ.publ_image_hash ),
     }
     if include_pubs:
-        pubs = sorted( publ.publications, key=get_publication_sort_key )
-        vals[ "publications" ] = [ get_publication_vals( p, False, False ) for p in pubs ]
+        vals[ "publications" ] = [ get_publication_vals( p, False, False ) for p in publ.publications ]
     if include_articles:
-        articles = sorted( publ.articles, key=get_article_sort_key )
-        vals[ "articles" ] = [ get_article_vals( a, False ) for a in articles ]
+        vals[ "articles" ] = [ get_article_vals( a, False ) for a in publ.articles ]
     return vals
 
+def get_publisher_loader_options( include_pubs, include_articles ):
+    """Get the loader options needed to extract the public fields from Publisher records."""
+    opts = []
+    if include_pubs:
+        opts.extend( get_publication_loader_options( selectinload( Publisher.publications ), False, False ) )
+    if include_articles:
+        opts.extend( get_article_loader_options( selectinload( Publisher.articles ) ) )
+    return opts
+
 # ---------------------------------------------------------------------
 
 @app.route( "/publisher/create", methods=["POST"] )
@@ -89,7 +118,9 @@ def create_publisher():
     vals[ "time_created" ] = datetime.datetime.now()
     publ = Publisher( **vals )
     db.session.add( publ )
+    db.session.flush() # nb: so that we have the new publisher's ID (for saving the image)
     _save_image( publ )
+    log_changes( "publishers", [ publ.publ_id ] )
     db.session.commit()
     _logger.debug( "- New ID: %d", publ.publ_id )
     search.add_or_update_publisher( None, publ, None )
@@ -106,20 +137,17 @@ def _save_image( publ ):
     if not image_data:
         return
 
-    # yup - delete the old one from the database
-    PublisherImage.query.filter( PublisherImage.publ_id == publ.publ_id ).delete()
+    # yup - check if we should remove the current image
     if image_data == "{remove}":
         # NOTE: The front-end sends this if it wants the publisher to have no image.
+        remove_images( "publisher", [ publ.publ_id ] )
         publ.publ_image_id = None
         return
 
     # add the new image to the database
     image_data = base64.b64decode( image_data )
     fname = request.json.get( "imageFilename" )
-    img = PublisherImage( publ_id=publ.publ_id, image_filename=fname, image_data=image_data )
-    db.session.add( img )
-    db.session.flush()
-    _logger.debug( "Created new image: %s, #bytes=%d", fname, len(image_data) )
+    save_image( "publisher", publ.publ_id, fname, image_data )
 
 # ---------------------------------------------------------------------
 
@@ -142,6 +170,7 @@ def update_publisher():
     _save_image( publ )
     vals[ "time_updated" ] = datetime.datetime.now()
     apply_attrs( publ, vals )
+    log_changes( "publishers", [ publ.publ_id ] )
     db.session.commit()
     search.add_or_update_publisher( None, publ, None )
 
@@ -172,13 +201,21 @@ def delete_publisher( publ_id ):
         .filter( Publication.publ_id == publ_id ) \
         .filter( Article.pub_id == Publication.pub_id )
     deleted_articles = [ r[0] for r in query ]
+    # NOTE: Articles can also belong directly to a publisher (without a publication).
+    query = db.session.query( Article.article_id ) \
+        .filter( Article.publ_id == publ_id )
+    deleted_articles.extend( r[0] for r in query )
 
     # delete the publisher
+    remove_images( "publisher", [ publ.publ_id ] )
+    remove_images( "publication", deleted_pubs )
+    remove_images( "article", deleted_articles )
     db.session.delete( publ )
+    log_changes( "publishers", [ publ.publ_id ], deleted=True )
+    log_changes( "publications", deleted_pubs, deleted=True )
+    log_changes( "tags" )
     db.session.commit()
-    search.delete_publishers( [ publ ] )
-    search.delete_publications( deleted_pubs )
-    search.delete_articles( deleted_articles )
+    search.delete_searchables( publishers=[ publ ], publications=deleted_pubs, articles=deleted_articles )
 
     extras = { "deletedPublications": deleted_pubs, "deletedArticles": deleted_articles }
     return make_ok_response( extras=extras )
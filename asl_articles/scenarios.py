@@ -1,16 +1,15 @@
 """ Handle scenario requests. """
 
-from flask import jsonify
-
 from asl_articles import app
 from asl_articles.models import Scenario
+from asl_articles.versions import make_conditional_response
 
 # ---------------------------------------------------------------------
 
 @app.route( "/scenarios" )
 def get_scenarios():
     """Get all scenarios."""
-    return jsonify( {
+    return make_conditional_response( "scenarios", lambda: {
         scenario.scenario_id: get_scenario_vals( scenario )
         for scenario in Scenario.query.all()
     } )
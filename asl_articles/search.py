@@ -2,24 +2,28 @@
 
 import os
 import sqlite3
+import hashlib
 import itertools
 import random
 import tempfile
 import re
 import logging
 
-from flask import request, jsonify
+from flask import request, jsonify, abort
+from werkzeug.exceptions import HTTPException
 
 import asl_articles
 from asl_articles import app, db
 from asl_articles.models import Publisher, Publication, Article, Author, Scenario, ArticleAuthor, ArticleScenario, \
-    get_model_from_table_name
-from asl_articles.publishers import get_publisher_vals
-from asl_articles.publications import get_publication_vals, get_publication_sort_key
-from asl_articles.articles import get_article_vals, get_article_sort_key
-from asl_articles.utils import AppConfigParser, decode_tags, to_bool, squash_spaces
+    get_model_from_table_name, get_publication_sort_order
+from asl_articles.publishers import get_publisher_vals, get_publisher_loader_options
+from asl_articles.publications import get_publication_vals, get_publication_loader_options
+from asl_articles.articles import get_article_vals
+from asl_articles.versions import invalidate_versions, save_instance_id, load_instance_id
+from asl_articles.utils import AppConfigParser, decode_tags, to_bool, squash_spaces, get_batches
 
 _search_index_path = None
+_search_index_lock = None
 _search_aliases = {}
 _search_weights = {}
 _author_aliases = {}
@@ -54,8 +58,8 @@ END_HILITE = "</span>"
 
 class SearchDbConn:
     """Context manager to handle SQLite transactions."""
-    def __init__( self ):
-        self.conn = sqlite3.connect( _search_index_path )
+    def __init__( self, path=None ):
+        self.conn = sqlite3.connect( path or _search_index_path )
     def __enter__( self ):
         return self
     def __exit__( self, exc_type, exc_value, traceback ):
@@ -128,11 +132,16 @@ def search_publishers():
 @app.route( "/search/publisher/<publ_id>", methods=["POST","GET"] )
 def search_publisher( publ_id ):
     """Search for a publisher."""
-    publ = Publisher.query.get( publ_id )
+    # NOTE: We load everything we need up-front, since lazy-loading it would cost several queries per record.
+    publ = Publisher.query.options(
+        *get_publisher_loader_options( True, True )
+    ).get( publ_id )
     if not publ:
         return jsonify( [] )
     results = [ get_publisher_vals( publ, True, True ) ]
-    pubs = sorted( publ.publications, key=get_publication_sort_key, reverse=True )
+    pubs = Publication.query.filter( Publication.publ_id == publ.publ_id ) \
+        .order_by( *get_publication_sort_order( reverse=True ) ) \
+        .options( *get_publication_loader_options( None, True, False ) )
     for pub in pubs:
         results.append( get_publication_vals( pub, True, True ) )
     return jsonify( results )
@@ -142,12 +151,14 @@ def search_publisher( publ_id ):
 @app.route( "/search/publication/<pub_id>", methods=["POST","GET"] )
 def search_publication( pub_id ):
     """Search for a publication."""
-    pub = Publication.query.get( pub_id )
+    # NOTE: We load everything we need up-front, since lazy-loading it would cost several queries per record.
+    pub = Publication.query.options(
+        *get_publication_loader_options( None, True, True )
+    ).get( pub_id )
     if not pub:
         return jsonify( [] )
     results = [ get_publication_vals( pub, True, True ) ]
-    articles = sorted( pub.articles, key=get_article_sort_key )
-    for article in articles:
+    for article in pub.articles:
         article =  get_article_vals( article, True )
         _create_aslrb_links( article )
         results.append( article )
@@ -203,6 +214,8 @@ def _do_search( query_string, col_names ):
     """Run a search."""
     try:
         return _do_search2( query_string, col_names )
+    except HTTPException:
+        raise # nb: this is a bad request, not a search error
     except Exception as exc: #pylint: disable=broad-except
         msg = str( exc )
         if isinstance( exc, sqlite3.OperationalError ):
@@ -254,13 +267,20 @@ def _do_search2( query_string, col_names ):
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-def _do_fts_search( fts_query_string, col_names, results=None ): #pylint: disable=too-many-locals
+def _do_fts_search( fts_query_string, col_names, results=None ): #pylint: disable=too-many-locals,too-many-branches,too-many-statements
     """Run an FTS search."""
 
     _logger.debug( "FTS query string: %s", fts_query_string )
     if results is None:
         results = []
     no_hilite = request.json and to_bool( request.json.get( "no_hilite" ) )
+    hilite_cols = request.json.get( "hilite_cols" ) if request.json else None
+    if hilite_cols is not None and \
+      ( not isinstance( hilite_cols, list ) or not all( c in _SEARCHABLE_COL_NAMES for c in hilite_cols ) ):
+        abort( 400 )
+    snippet_size = _get_int_param( "snippet_size" )
+    offset = _get_int_param( "offset" )
+    limit = _get_int_param( "limit" )
 
     # NOTE: We would like to cache the connection, but SQLite connections can only be used
     # in the same thread they were created in.
@@ -273,55 +293,67 @@ def _do_fts_search( fts_query_string, col_names, results=None ): #pylint: disabl
             weights.append( _search_weights.get( col_name, 1.0 ) )
 
         # run the search
-        hilites = [ "", "" ] if no_hilite else [ BEGIN_HILITE, END_HILITE ]
-        def highlight( n ):
-            return "highlight( searchable, {}, '{}', '{}' )".format(
-                n, hilites[0], hilites[1]
-            )
-        sql = "SELECT owner, bm25(searchable,{}) AS rank, {}, {}, {}, {}, {}, {}, rating FROM searchable" \
+        # NOTE: Generating highlights is expensive (especially for long snippets), so we first rank
+        # the matching rows without them, then only generate highlights for the rows we will return.
+        sql = "SELECT rowid, owner, bm25(searchable,{}) AS rank FROM searchable" \
             " WHERE searchable MATCH ?" \
             " ORDER BY rating DESC, rank".format(
-                ",".join( str(w) for w in weights ),
-                highlight(1), highlight(2), highlight(3), highlight(4), highlight(5), highlight(6)
+                ",".join( str(w) for w in weights )
             )
         match = "{{ {} }}: {}".format(
             " ".join( col_names or _SEARCHABLE_COL_NAMES ),
             fts_query_string
         )
-        curs = dbconn.conn.execute( sql, (match,) )
+        params = [ match ]
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend( [ -1 if limit is None else limit, offset or 0 ] )
+        rows = dbconn.conn.execute( sql, params ).fetchall()
+
+        # generate the highlights
+        hilites = _get_hilites( dbconn, match, [ row[0] for row in rows ],
+            [] if no_hilite else hilite_cols or _SEARCHABLE_COL_NAMES,
+            snippet_size, no_hilite
+        )
 
         # get the results
-        for row in curs:
+        for row in rows:
 
             # get the next result
-            owner_type, owner_id = row[0].split( ":" )
+            owner_type, owner_id = row[1].split( ":" )
             model = get_model_from_table_name( owner_type )
             obj = model.query.get( owner_id )
-            _logger.debug( "- {} ({:.3f})".format( obj, row[1] ) )
+            _logger.debug( "- {} ({:.3f})".format( obj, row[2] ) )
 
             # prepare the result for the front-end
             result = globals()[ "_get_{}_vals".format( owner_type ) ]( obj )
             result[ "_type" ] = owner_type
-            result[ "rank" ] = row[1]
+            result[ "rank" ] = row[2]
 
             # return highlighted versions of the content to the caller
             fields = _FIELD_MAPPINGS[ owner_type ]
-            assert _SEARCHABLE_COL_NAMES[:3] == [ "name", "name2", "description" ]
-            for col_no,col_name in enumerate(_SEARCHABLE_COL_NAMES[:3]):
+            row_hilites = hilites.get( row[0], {} )
+            for col_name in [ "name", "name2", "description" ]:
                 field = fields.get( col_name )
                 if not field:
                     continue
-                if row[2+col_no] and BEGIN_HILITE in row[2+col_no]:
+                if row_hilites.get( col_name ):
                     # NOTE: We have to return both the highlighted and non-highlighted versions, since the front-end
                     # will show the highlighted version in the search results, but the non-highlighted version elsewhere
                     # e.g. an article's title in the titlebar of its edit dialog.
-                    result[ field+"!" ] = row[ 2+col_no ]
-            if row[5] and BEGIN_HILITE in row[5]:
-                result[ "authors!" ] = row[5].split( "\n" )
-            if row[6] and BEGIN_HILITE in row[6]:
-                result[ "scenarios!" ] = [ s.split("\t") for s in row[6].split("\n") ]
-            if row[7] and BEGIN_HILITE in row[7]:
-                result[ "tags!" ] = row[7].split( "\n" )
+                    result[ field+"!" ] = row_hilites[ col_name ]
+            if row_hilites.get( "authors" ):
+                result[ "authors!" ] = row_hilites[ "authors" ].split( "\n" )
+            if row_hilites.get( "scenarios" ):
+                result[ "scenarios!" ] = [ s.split("\t") for s in row_hilites[ "scenarios" ].split("\n") ]
+            if row_hilites.get( "tags" ):
+                result[ "tags!" ] = row_hilites[ "tags" ].split( "\n" )
+            if owner_type == "article" and "snippet" in row_hilites:
+                # NOTE: We only return a window of the snippet around the matches (for list views). The front-end
+                # must get the full text via /article/<id> if it needs it (e.g. when the article is edited).
+                result[ "article_snippet!" ] = row_hilites[ "snippet" ]
+                result[ "article_snippet" ] = None
+                result[ "_partial_snippet" ] = True
 
             # create links to the eASLRB
             if owner_type == "article":
@@ -336,6 +368,54 @@ def _do_fts_search( fts_query_string, col_names, results=None ): #pylint: disabl
 
     return jsonify( results )
 
+def _get_int_param( key ):
+    """Get an integer search parameter."""
+    val = request.json.get( key ) if request.json else None
+    try:
+        return int( val ) if val is not None else None
+    except ( TypeError, ValueError ):
+        return abort( 400 )
+
+def _get_hilites( dbconn, match, rowids, col_names, snippet_size, no_hilite ):
+    """Generate highlighted versions of the content for the specified search index rows."""
+
+    # initialize
+    col_names = [ c for c in _SEARCHABLE_COL_NAMES if c in col_names ]
+    def col_index( col_name ):
+        return 1 + _SEARCHABLE_COL_NAMES.index( col_name )
+    exprs = [
+        ( c, "highlight( searchable, {}, '{}', '{}' )".format( col_index(c), BEGIN_HILITE, END_HILITE ) )
+        for c in col_names
+    ]
+    if snippet_size:
+        # NOTE: snippet() returns a window of up to 64 tokens around the best match in the column.
+        # If the column doesn't contain any matches, we get the start of the text.
+        exprs = [ e for e in exprs if e[0] != "description" ]
+        hilites = [ "", "" ] if no_hilite else [ BEGIN_HILITE, END_HILITE ]
+        exprs.append( ( "snippet", "snippet( searchable, {}, '{}', '{}', '...', {} )".format(
+            col_index( "description" ), hilites[0], hilites[1],
+            min( max( snippet_size, 1 ), 64 )
+        ) ) )
+    if not rowids or not exprs:
+        return {}
+
+    # generate the highlights
+    # NOTE: We only return values that actually contain a highlight (except for snippets).
+    results = {}
+    for batch in get_batches( rowids ):
+        sql = "SELECT rowid, {} FROM searchable" \
+            " WHERE searchable MATCH ? AND rowid IN ({})".format(
+                ", ".join( e[1] for e in exprs ),
+                ",".join( "?" * len(batch) )
+            )
+        for row in dbconn.conn.execute( sql, [ match ] + batch ):
+            results[ row[0] ] = {
+                e[0]: val
+                for e, val in zip( exprs, row[1:] )
+                if val and ( e[0] == "snippet" or BEGIN_HILITE in val )
+            }
+    return results
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 def _make_fts_query_string( query_string, search_aliases ): #pylint: disable=too-many-statements,too-many-locals
@@ -582,39 +662,17 @@ def init_search( session, logger, test_mode=False ):
         # FUDGE! We should be able to create a shared, in-memory database using this:
         #   file::memory:?mode=memory&cache=shared
         # but it doesn't seem to work (on Linux) and ends up creating a file with this name :-/
-        # We manually create a temp file, which has to have the same name each time, so that we don't
-        # keep creating a new database each time we start up. Sigh...
-        _search_index_path = os.path.join( tempfile.gettempdir(), "asl-articles.searchdb" )
-    if os.path.isfile( _search_index_path ):
-        os.unlink( _search_index_path )
-
-    logger.info( "Creating search index: %s", _search_index_path )
-    with SearchDbConn() as dbconn:
-
-        # NOTE: We would like to make "owner" the primary key, but FTS doesn't support primary keys
-        # (nor UNIQUE constraints), so we have to manage this manually :-(
-        # IMPORTANT: The column order is important here, since we use the column index to generate
-        # the bm25() clause when doing searches.
-        dbconn.conn.execute(
-            "CREATE VIRTUAL TABLE searchable USING fts5"
-            " ( owner, {}, rating, tokenize='porter unicode61' )".format(
-                ", ".join( _SEARCHABLE_COL_NAMES )
-            )
-        )
-
-        # load the searchable content
-        # NOTE: We insert content in reverse chronological order to get more recent
-        # content to appear before other equally-ranked content.
-        logger.debug( "Loading the search index..." )
-        logger.debug( "- Loading publishers." )
-        for publ in session.query( Publisher ).order_by( Publisher.time_created.desc() ):
-            add_or_update_publisher( dbconn, publ, session )
-        logger.debug( "- Loading publications." )
-        for pub in session.query( Publication ).order_by( Publication.time_created.desc() ):
-            add_or_update_publication( dbconn, pub, session )
-        logger.debug( "- Loading articles." )
-        for article in session.query( Article ).order_by( Article.time_created.desc() ):
-            add_or_update_article( dbconn, article, session )
+        # We manually create a temp file, with the same name each time (so that we don't keep creating a new one
+        # each time we start up), but different for each database (so servers don't clobber each other's). Sigh...
+        db_hash = hashlib.sha256( str( app.config.get( "SQLALCHEMY_DATABASE_URI" ) ).encode( "utf-8" ) ).hexdigest()
+        _search_index_path = os.path.join( tempfile.gettempdir(), "asl-articles-{}.searchdb".format( db_hash[:12] ) )
+    _release_search_index_lock()
+    if to_bool( app.config.get( "SEARCH_INDEX_SHARED" ) ):
+        instance_id = _init_shared_search_index( session, logger )
+    else:
+        instance_id = _build_search_index( session, logger, False )
+    # NOTE: The data may have changed since we last ran, so any versions we gave out before are now invalid.
+    invalidate_versions( instance_id )
 
     # configure the search engine
     global _search_aliases
@@ -669,6 +727,100 @@ def init_search( session, logger, test_mode=False ):
                 _load_author_aliases( cfg.get_section("Author aliases"), session, True )
             )
 
+def _build_search_index( session, logger, is_shared ):
+    """Build the search index."""
+
+    # NOTE: We build the new search index in a temp file, then move it into place, so that nobody
+    # ever sees a partially-built index.
+    logger.info( "Creating search index: %s", _search_index_path )
+    temp_path = "{}.tmp-{}".format( _search_index_path, os.getpid() )
+    if os.path.isfile( temp_path ):
+        os.unlink( temp_path )
+    with SearchDbConn( temp_path ) as dbconn:
+
+        # NOTE: We would like to make "owner" the primary key, but FTS doesn't support primary keys
+        # (nor UNIQUE constraints), so we have to manage this manually :-(
+        # IMPORTANT: The column order is important here, since we use the column index to generate
+        # the bm25() clause when doing searches.
+        dbconn.conn.execute(
+            "CREATE VIRTUAL TABLE searchable USING fts5"
+            " ( owner, {}, rating, tokenize='porter unicode61' )".format(
+                ", ".join( _SEARCHABLE_COL_NAMES )
+            )
+        )
+
+        # load the searchable content
+        # NOTE: We insert content in reverse chronological order to get more recent
+        # content to appear before other equally-ranked content.
+        logger.debug( "Loading the search index..." )
+        logger.debug( "- Loading publishers." )
+        for publ in session.query( Publisher ).order_by( Publisher.time_created.desc() ):
+            add_or_update_publisher( dbconn, publ, session )
+        logger.debug( "- Loading publications." )
+        for pub in session.query( Publication ).order_by( Publication.time_created.desc() ):
+            add_or_update_publication( dbconn, pub, session )
+        logger.debug( "- Loading articles." )
+        for article in session.query( Article ).order_by( Article.time_created.desc() ):
+            add_or_update_article( dbconn, article, session )
+
+        instance_id = save_instance_id( dbconn.conn ) # nb: every server process that shares the index will use this
+
+    # NOTE: If the index is being shared, we use WAL mode, so that searches don't get blocked
+    # while another process is updating the index.
+    if is_shared:
+        with SearchDbConn( temp_path ) as dbconn:
+            dbconn.conn.execute( "PRAGMA journal_mode = WAL" )
+
+    # install the new search index
+    # NOTE: We also remove any journal files left over from the old index, otherwise SQLite will think
+    # they belong to the new one.
+    for suffix in ( "-journal", "-wal", "-shm" ):
+        if os.path.isfile( _search_index_path + suffix ):
+            os.unlink( _search_index_path + suffix )
+    os.replace( temp_path, _search_index_path )
+
+    return instance_id
+
+def _init_shared_search_index( session, logger ):
+    """Initialize a search index that is shared with other server processes."""
+
+    # NOTE: If we are running multiple server processes, they can share the search index. Every process
+    # holds a shared lock on the index's lock file for as long as it is running, so when a process starts up,
+    # if it can get an exclusive lock, there is nobody else running, and it builds a new index (since the
+    # database may have changed since the index was last built). Otherwise, it uses the existing index.
+    # We only let one process start up at a time, so that two processes don't both try to build the index,
+    # or use the index while another process is still building it. Once everyone is running, each process
+    # updates the index when it changes something, and SQLite makes sure that only one of them is writing
+    # to it at a time. They also use the instance ID stored in the index, so that they all accept each other's
+    # versions and ETag's (but link-check jobs are still only known to the process that started them).
+    import fcntl #pylint: disable=import-outside-toplevel
+    global _search_index_lock
+    with open( _search_index_path + ".startup-lock", "w", encoding="utf-8" ) as startup_lock:
+        fcntl.flock( startup_lock, fcntl.LOCK_EX )
+        _search_index_lock = open( _search_index_path + ".lock", "w", encoding="utf-8" )
+        try:
+            fcntl.flock( _search_index_lock, fcntl.LOCK_EX | fcntl.LOCK_NB )
+            is_first = True
+        except BlockingIOError:
+            is_first = False
+        instance_id = None
+        if not is_first and os.path.isfile( _search_index_path ):
+            with SearchDbConn() as dbconn:
+                instance_id = load_instance_id( dbconn.conn )
+        if not instance_id:
+            instance_id = _build_search_index( session, logger, True )
+        else:
+            logger.info( "Using existing search index: %s", _search_index_path )
+        fcntl.flock( _search_index_lock, fcntl.LOCK_SH )
+    return instance_id
+
+def _release_search_index_lock():
+    """Release our lock on a shared search index."""
+    global _search_index_lock
+    if _search_index_lock:
+        _search_index_lock.close()
+        _search_index_lock = None
+
 def _load_search_aliases( aliases, aliases2 ):
     """Load the search aliases."""
 
@@ -758,6 +910,13 @@ def add_or_update_article( dbconn, article, session ):
         session
     )
 
+def add_articles( articles ):
+    """Add new articles to the search index."""
+    # NOTE: Since the articles are new, they won't already be in the search index.
+    with SearchDbConn() as dbconn:
+        for article in articles:
+            add_or_update_article( dbconn, article, None )
+
 def _do_add_or_update_searchable( dbconn, owner_type, owner, obj, session ):
     """Add or update a record in the search index."""
 
@@ -800,27 +959,23 @@ def _do_add_or_update_searchable( dbconn, owner_type, owner, obj, session ):
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-def delete_publishers( publs ):
-    """Remove publishers from the search index."""
-    with SearchDbConn() as dbconn:
-        for publ in publs:
-            _do_delete_searchable( dbconn, _make_publisher_key( publ ) )
+def delete_searchables( publishers=None, publications=None, articles=None ):
+    """Remove publishers, publications and articles from the search index."""
 
-def delete_publications( pubs ):
-    """Remove publications from the search index."""
-    with SearchDbConn() as dbconn:
-        for pub in pubs:
-            _do_delete_searchable( dbconn, _make_publication_key( pub ) )
+    # figure out which entries need to be removed
+    owners = [ _make_publisher_key( publ ) for publ in publishers or [] ]
+    owners.extend( _make_publication_key( pub ) for pub in publications or [] )
+    owners.extend( _make_article_key( article ) for article in articles or [] )
+    if not owners:
+        return
 
-def delete_articles( articles ):
-    """Remove articles from the search index."""
+    # remove the entries from the search index
+    # NOTE: FTS5 can't index the "owner" column, so each DELETE has to scan the whole table. We remove
+    # as many entries as we can with each statement, and do everything in a single transaction.
     with SearchDbConn() as dbconn:
-        for article in articles:
-            _do_delete_searchable( dbconn, _make_article_key( article ) )
-
-def _do_delete_searchable( dbconn, owner ):
-    """Remove an entry from the search index."""
-    dbconn.conn.execute( "DELETE FROM searchable WHERE owner = ?", (owner,) )
+        for batch in get_batches( owners ):
+            sql = "DELETE FROM searchable WHERE owner IN ({})".format( ",".join( "?" * len(batch) ) )
+            dbconn.conn.execute( sql, batch )
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
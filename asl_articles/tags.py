@@ -2,10 +2,9 @@
 
 from collections import defaultdict
 
-from flask import jsonify
-
 from asl_articles import app, db
 from asl_articles.models import Publication, Article
+from asl_articles.versions import make_conditional_response
 from asl_articles.utils import decode_tags
 
 # ---------------------------------------------------------------------
@@ -13,6 +12,10 @@ from asl_articles.utils import decode_tags
 @app.route( "/tags" )
 def get_tags():
     """Get all tags."""
+    return make_conditional_response( "tags", get_all_tags )
+
+def get_all_tags():
+    """Get all tags, and how often they are used."""
 
     # NOTE: This is pretty inefficient, since an article/publication's tags are munged into one big string
     # and stored in a single column, so we need to manually unpack everything, but we'll see how it goes...
@@ -31,4 +34,4 @@ def get_tags():
         key = lambda v: ( -v[1], v[0] ) # sort by # instances, then name
     )
 
-    return jsonify( tags )
+    return tags
@@ -7,8 +7,11 @@ import json
 import base64
 import re
 
+import pytest
+
+from asl_articles.models import ArticleAuthor, ArticleScenario
 from asl_articles.search import SEARCH_ALL_ARTICLES
-from asl_articles.tests.utils import init_tests, select_main_menu_option, select_sr_menu_option, \
+from asl_articles.tests.utils import init_tests, call_flask, select_main_menu_option, select_sr_menu_option, \
     do_search, get_search_results, find_search_result, get_search_result_names, check_search_result, \
     do_test_confirm_discard_changes, find_parent_by_class, \
     wait_for, wait_for_elem, wait_for_not_elem, find_child, find_children, \
@@ -539,6 +542,165 @@ def test_publisher_article_dates( webdriver, flask_app, dbconn ):
 
 # ---------------------------------------------------------------------
 
+def test_get_multiple( flask_app, dbconn ):
+    """Test getting multiple articles."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+
+    # get multiple articles, and compare them with what we get when we get each one individually
+    for deep in ( None, 1 ):
+        articles = call_flask( flask_app, "get_articles", ids="100,299,999,200", deep=deep )
+        assert list( articles.keys() ) == [ "100", "200", "299" ]
+        for article_id, vals in articles.items():
+            assert vals == call_flask( flask_app, "get_article", article_id=article_id, deep=deep )
+
+    # check that we can ask for nothing
+    assert call_flask( flask_app, "get_articles", ids="" ) == {}
+
+    # check that bad ID's are rejected
+    for endpoint in ( "get_articles", "get_publications", "get_publishers" ):
+        with pytest.raises( urllib.error.HTTPError ) as exc_info:
+            call_flask( flask_app, endpoint, ids="1,x" )
+        assert exc_info.value.code == 400
+
+# ---------------------------------------------------------------------
+
+def test_import_articles( flask_app, dbconn ):
+    """Test importing multiple articles."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+
+    # import some articles
+    resp = call_flask( flask_app, "import_articles", { "articles": [
+        { "article_title": "Imported article 1", "pub_id": 10, "article_tags": [ "foo", "<b>bar</b>" ],
+          "article_authors": [ "Joe Blow", "New author" ],
+          "article_scenarios": [ [ "ASL 1", "The Guards Counterattack" ], [ "NEW 1", "New scenario" ] ]
+        },
+        { "article_title": "Imported <script>x</script>article 2", "pub_id": 10,
+          "article_authors": [ 1001, "New author" ], "article_scenarios": [ 2001, [ "NEW 1", "New scenario" ] ]
+        },
+        { "article_title": "Imported article 3", "publ_id": 2, "article_date": "1999" },
+    ] } )
+    assert resp[ "status" ] == "OK"
+    assert sorted( resp[ "warnings" ] ) == [ "Some values had HTML cleaned up.", "Some values had HTML removed." ]
+    article_ids = resp[ "newArticleIds" ]
+    assert len( article_ids ) == 3
+
+    # check the imported articles
+    articles = call_flask( flask_app, "get_articles", ids=",".join( str(a) for a in article_ids ) )
+    articles = [ articles[ str(a) ] for a in article_ids ]
+    assert [ a["article_title"] for a in articles ] == [
+        "Imported article 1", "Imported article 2", "Imported article 3"
+    ]
+    assert articles[0][ "article_tags" ] == [ "foo", "bar" ]
+    assert articles[2][ "article_date" ] == "1999"
+
+    # check that existing authors and scenarios were re-used, and new ones were only created once
+    assert [ a["author_name"] for a in articles[0]["article_authors"] ] == [ "Joe Blow", "New author" ]
+    assert articles[0]["article_authors"][0]["author_id"] == 1000
+    assert articles[1]["article_authors"][0]["author_id"] == 1001
+    assert articles[0]["article_authors"][1] == articles[1]["article_authors"][1]
+    assert articles[0]["article_scenarios"][0]["scenario_id"] == 2000
+    assert articles[1]["article_scenarios"][0]["scenario_id"] == 2001
+    assert articles[0]["article_scenarios"][1] == articles[1]["article_scenarios"][1]
+    assert len( call_flask( flask_app, "get_authors" ) ) == 4
+    assert len( call_flask( flask_app, "get_scenarios" ) ) == 3
+
+    # check that the articles were given seq#'s, following on from the existing ones
+    # NOTE: The articles in the fixture don't have a seq#, so they will be sorted last.
+    resp = call_flask( flask_app, "import_articles", { "articles": [
+        { "article_title": "Imported article 4", "pub_id": 10 },
+    ] } )
+    pub = call_flask( flask_app, "get_publication", pub_id=10, include_articles=1 )
+    assert [ a["article_title"] for a in pub["articles"] ] == [
+        "Imported article 1", "Imported article 2", "Imported article 4", "ASLJ article 1", "ASLJ article 2"
+    ]
+
+    # check that the search index was updated
+    results = call_flask( flask_app, "search", { "query": "imported" } )
+    assert len( results ) == 4
+    results = call_flask( flask_app, "search", { "query": "\"new author\"" } )
+    assert sorted( r["article_id"] for r in results ) == sorted( article_ids[:2] )
+
+    # check that nothing is imported if any of the articles are invalid
+    with pytest.raises( urllib.error.HTTPError ) as exc_info:
+        call_flask( flask_app, "import_articles", { "articles": [
+            { "article_title": "Imported article 5" }, { "article_subtitle": "No title" }
+        ] } )
+    assert exc_info.value.code == 400
+    assert len( call_flask( flask_app, "search", { "query": "imported" } ) ) == 4
+
+    # check that bad authors, scenarios and articles are rejected
+    for data in [ { "article_authors": [ [ "Bad author" ] ] }, { "article_authors": "Not a list" },
+      { "article_scenarios": [ "Bad scenario" ] }, { "article_scenarios": [ [ "NS1", [ "Bad name" ] ] ] }, None ]:
+        data = { "articles": [ dict( data, article_title="Imported article 5" ) if data else "Bad article" ] }
+        with pytest.raises( urllib.error.HTTPError ) as exc_info:
+            call_flask( flask_app, "import_articles", data )
+        assert exc_info.value.code == 400
+    assert len( call_flask( flask_app, "search", { "query": "imported" } ) ) == 4
+
+# ---------------------------------------------------------------------
+
+def test_update_links( flask_app, dbconn ):
+    """Test updating an article's authors and scenarios."""
+
+    # initialize
+    session = init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+
+    def get_links( model, key_name ):
+        session.expire_all()
+        query = session.query( model ).filter( model.article_id == 100 ).order_by( model.seq_no )
+        return [ ( getattr( link, key_name ), link.seq_no, link ) for link in query ]
+
+    def update_article( authors, scenarios ):
+        call_flask( flask_app, "update_article", {
+            "article_id": 100, "article_title": "ASLJ article 1", "pub_id": 10, "article_tags": [],
+            "article_authors": authors, "article_scenarios": scenarios
+        } )
+        author_links = get_links( ArticleAuthor, "author_id" )
+        scenario_links = get_links( ArticleScenario, "scenario_id" )
+        return author_links, scenario_links
+
+    # get the article's current links
+    author_links = get_links( ArticleAuthor, "author_id" )
+    assert [ a[:2] for a in author_links ] == [ ( 1000, 1 ), ( 1001, 2 ) ]
+    author_link_ids = { a[0]: a[2].article_author_id for a in author_links }
+    scenario_links = get_links( ArticleScenario, "scenario_id" )
+    assert [ s[:2] for s in scenario_links ] == [ ( 2000, 1 ) ]
+    scenario_link_id = scenario_links[0][2].article_scenario_id
+
+    # re-order the authors, add an existing author (by name) and a new one, and add some scenarios
+    author_links, scenario_links = update_article(
+        [ 1001, "Alan Smithee", 1000, "New author" ],
+        [ 2000, 2001, [ "NEW 1", "New scenario" ] ]
+    )
+    assert [ a[:2] for a in author_links[:3] ] == [ ( 1001, 0 ), ( 1999, 1 ), ( 1000, 2 ) ]
+    assert author_links[3][1] == 3
+    # check that the existing links were kept
+    assert author_links[0][2].article_author_id == author_link_ids[ 1001 ]
+    assert author_links[2][2].article_author_id == author_link_ids[ 1000 ]
+    assert [ s[:2] for s in scenario_links[:2] ] == [ ( 2000, 0 ), ( 2001, 1 ) ]
+    assert scenario_links[0][2].article_scenario_id == scenario_link_id
+    new_author_id = author_links[3][0]
+    new_scenario_id = scenario_links[2][0]
+
+    # remove some authors and scenarios
+    author_links2, scenario_links2 = update_article( [ 1999, new_author_id ], [ new_scenario_id ] )
+    assert [ a[:2] for a in author_links2 ] == [ ( 1999, 0 ), ( new_author_id, 1 ) ]
+    assert author_links2[0][2].article_author_id == author_links[1][2].article_author_id
+    assert [ s[:2] for s in scenario_links2 ] == [ ( new_scenario_id, 0 ) ]
+    assert scenario_links2[0][2].article_scenario_id == scenario_links[2][2].article_scenario_id
+
+    # check that the search index was updated
+    results = call_flask( flask_app, "search", { "query": "smithee" } )
+    assert [ r["article_id"] for r in results ] == [ 100 ]
+    results = call_flask( flask_app, "search", { "query": "blow" } )
+    assert 100 not in [ r["article_id"] for r in results ]
+
+# ---------------------------------------------------------------------
+
 def test_unicode( webdriver, flask_app, dbconn ):
     """Test Unicode content."""
 
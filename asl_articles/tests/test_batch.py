@@ -0,0 +1,70 @@
+""" Test batched requests. """
+
+import urllib.request
+import urllib.error
+import json
+
+import pytest
+
+from asl_articles.tests.utils import init_tests, call_flask
+from asl_articles.tests import pytest_options
+
+# ---------------------------------------------------------------------
+
+def test_batch( flask_app, dbconn ):
+    """Test running multiple requests in a single batch."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+
+    # run a batch of requests
+    paths = [
+        "/article/100?deep=1", "/publication/10?include_articles=1", "/publisher/2",
+        "/authors", "/scenarios", "/tags", "/ping",
+        "/article/999", "/unknown", "/batch", "/publisher/delete/1",
+    ]
+    results = call_flask( flask_app, "run_batch", { "paths": paths } )
+    assert list( results.keys() ) == sorted( paths )
+
+    # check that we got the same results as running each request separately
+    for path in paths[:7]:
+        assert results[ path ][ "status" ] == 200
+        resp = urllib.request.urlopen( flask_app.url_for( "ping" ).replace( "/ping", path ) )
+        data = resp.read().decode( "utf-8" )
+        if resp.headers[ "Content-Type" ] == "application/json":
+            data = json.loads( data )
+        assert results[ path ][ "data" ] == data
+
+    # check the requests that failed
+    assert results[ "/article/999" ] == { "status": 404 }
+    assert results[ "/unknown" ] == { "status": 404 }
+    assert results[ "/batch" ] == { "status": 405 }
+
+    # check that only read-only requests can be batched
+    assert results[ "/publisher/delete/1" ] == { "status": 403 }
+    assert call_flask( flask_app, "get_publisher", publ_id=1 )[ "publ_id" ] == 1
+
+    # check that bad batches are rejected
+    for data in ( {}, { "paths": "/ping" }, { "paths": [ 1 ] }, [] ):
+        with pytest.raises( urllib.error.HTTPError ) as exc_info:
+            call_flask( flask_app, "run_batch", data )
+        assert exc_info.value.code == 400
+
+# ---------------------------------------------------------------------
+
+@pytest.mark.skipif( pytest_options.flask_url is not None, reason="Testing against a remote Flask server." )
+def test_batch_errors( flask_app, dbconn, monkeypatch ):
+    """Test a batch that contains a request that fails."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+
+    # run a batch with a request that fails
+    def get_tags():
+        raise RuntimeError( "Something went wrong." )
+    monkeypatch.setitem( flask_app.view_functions, "get_tags", get_tags )
+    results = call_flask( flask_app, "run_batch", { "paths": [ "/authors", "/tags", "/publisher/2" ] } )
+    assert results[ "/tags" ] == { "status": 500 }
+    assert results[ "/authors" ][ "status" ] == 200
+    assert results[ "/publisher/2" ][ "status" ] == 200
+    assert results[ "/publisher/2" ][ "data" ][ "publ_id" ] == 2
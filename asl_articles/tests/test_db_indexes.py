@@ -0,0 +1,64 @@
+""" Test the database indexes. """
+
+import os
+import tempfile
+
+import sqlalchemy
+import alembic.config
+import alembic.command
+
+# NOTE: These are queries that we run often (either directly, or via relationships and cascading deletes),
+# together with the index they should be using.
+_QUERIES = [
+    ( "SELECT max(article_seqno) FROM article WHERE pub_id = 1", "ix_article_pub_id_seqno" ),
+    ( "SELECT * FROM article WHERE pub_id IN (1,2,3) ORDER BY article_seqno", "ix_article_pub_id_seqno" ),
+    ( "DELETE FROM article WHERE pub_id = 1", "ix_article_pub_id_seqno" ),
+    ( "SELECT count(*) FROM article WHERE publ_id = 1", "ix_article_publ_id" ),
+    ( "SELECT max(pub_seqno) FROM publication WHERE publ_id = 1", "ix_publication_publ_id_seqno" ),
+    ( "SELECT * FROM publication WHERE publ_id = 1 ORDER BY pub_seqno", "ix_publication_publ_id_seqno" ),
+    ( "SELECT * FROM article_author WHERE article_id IN (1,2,3)", "ix_article_author_article_id" ),
+    ( "DELETE FROM article_author WHERE author_id = 1", "ix_article_author_author_id" ),
+    ( "SELECT * FROM article_scenario WHERE article_id IN (1,2,3)", "ix_article_scenario_article_id" ),
+    ( "DELETE FROM article_scenario WHERE scenario_id = 1", "ix_article_scenario_scenario_id" ),
+]
+
+# ---------------------------------------------------------------------
+
+def test_query_plans():
+    """Compare the query plans for common queries, before and after the indexes were added."""
+
+    # initialize
+    with tempfile.NamedTemporaryFile( delete=False ) as temp_file:
+        temp_fname = temp_file.name
+    dname = os.path.join( os.path.split(__file__)[0], "../../alembic/" )
+    cfg = alembic.config.Config( os.path.join( dname, "alembic.ini" ) )
+    cfg.set_main_option( "script_location", dname )
+    conn_string = "sqlite:///{}".format( temp_fname )
+    cfg.set_main_option( "sqlalchemy.url", conn_string )
+    engine = sqlalchemy.create_engine( conn_string )
+
+    def get_query_plans():
+        with engine.connect() as conn:
+            return [
+                " ; ".join( row[-1] for row in conn.execute( "EXPLAIN QUERY PLAN " + query ) )
+                for query, _ in _QUERIES
+            ]
+
+    try:
+
+        # get the query plans before the indexes were added
+        alembic.command.upgrade( cfg, "5b8a1e34c7d2" )
+        plans_before = get_query_plans()
+
+        # get the query plans after the indexes were added
+        alembic.command.upgrade( cfg, "head" )
+        plans_after = get_query_plans()
+
+    finally:
+        engine.dispose()
+        os.unlink( temp_fname )
+
+    # check the query plans
+    for ( query, index_name ), plan_before, plan_after in zip( _QUERIES, plans_before, plans_after ):
+        assert index_name not in plan_before, query
+        assert index_name in plan_after and "SCAN" not in plan_after, query
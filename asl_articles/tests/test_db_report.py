@@ -3,9 +3,17 @@
 import os
 import itertools
 import re
+import json
+import hashlib
+import time
+import threading
+import http.server
+import urllib.request
+import urllib.error
 
 import pytest
 
+import asl_articles.link_checker
 from asl_articles.search import SEARCH_ALL
 from asl_articles.tests.test_publishers import edit_publisher
 from asl_articles.tests.test_publications import edit_publication
@@ -13,7 +21,8 @@ from asl_articles.tests.test_articles import edit_article
 from asl_articles.tests.utils import init_tests, \
     select_main_menu_option, select_sr_menu_option, check_ask_dialog, \
     do_search, find_search_result, get_search_results, \
-    wait_for, wait_for_elem, find_child, find_children
+    wait_for, wait_for_elem, find_child, find_children, \
+    call_flask, set_image, restore_config, QueryCounter
 from asl_articles.tests import pytest_options
 
 # ---------------------------------------------------------------------
@@ -63,7 +72,7 @@ def test_db_report( webdriver, flask_app, dbconn ):
         "authors": 3, "scenarios": 2
     }
     assert dupe_images == [
-        [ "f0457ea742376e76ff276ce62c7a8540", "/images/article/100",
+        [ "ab6bbaec1b7debe056956a5e284bee934af99ab453447875f39a183d5992ec31", "/images/article/100",
           ( "ASLJ article 1", "/article/100" ),
           ( "ASLJ article 2", "/article/101" ),
         ]
@@ -105,6 +114,289 @@ def test_db_report( webdriver, flask_app, dbconn ):
 
 # ---------------------------------------------------------------------
 
+@pytest.mark.skipif( pytest_options.flask_url is not None, reason="Testing against a remote Flask server." )
+def test_row_counts( flask_app, dbconn ):
+    """Test getting the database row counts."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+
+    def get_row_counts():
+        with QueryCounter() as query_counter:
+            row_counts = call_flask( flask_app, "get_db_row_counts" )
+        return row_counts, query_counter.count
+
+    # get the row counts (they should be counted in a single query)
+    row_counts, nqueries = get_row_counts()
+    assert row_counts == {
+        "publisher": 2, "publication": 3, "article": 5, "author": 3, "scenario": 2,
+        "publisher_image": 0, "publication_image": 0, "article_image": 0
+    }
+    assert nqueries == 1
+
+    # get the row counts again (they should be cached)
+    assert get_row_counts() == ( row_counts, 0 )
+
+    # delete a publisher (its publications and articles should also be deleted)
+    call_flask( flask_app, "delete_publisher", publ_id=1 )
+    row_counts, nqueries = get_row_counts()
+    assert ( row_counts[ "publisher" ], row_counts[ "publication" ], row_counts[ "article" ] ) == ( 1, 1, 2 )
+    assert nqueries == 1
+
+    # check using approximate row counts for large tables
+    dbconn.execute( "ANALYZE" )
+    dbconn.execute( "INSERT INTO author ( author_name ) VALUES ( 'New author' )" )
+    flask_app.config[ "APPROX_ROW_COUNT_THRESHOLD" ] = 3
+    try:
+        row_counts2, _ = get_row_counts()
+    finally:
+        flask_app.config.pop( "APPROX_ROW_COUNT_THRESHOLD" )
+    # NOTE: The author count comes from the database statistics, so it doesn't include the new author.
+    assert row_counts2 == row_counts
+    row_counts2, _ = get_row_counts()
+    assert row_counts2 == dict( row_counts, author=4 )
+
+    # check that the cached row counts expire (since we can't see changes made by other processes)
+    dbconn.execute( "INSERT INTO author ( author_name ) VALUES ( 'Another author' )" )
+    assert get_row_counts() == ( row_counts2, 0 )
+    flask_app.config[ "ROW_COUNT_CACHE_TTL" ] = 0
+    try:
+        row_counts3, nqueries = get_row_counts()
+    finally:
+        flask_app.config.pop( "ROW_COUNT_CACHE_TTL" )
+    assert ( row_counts3, nqueries ) == ( dict( row_counts, author=5 ), 1 )
+
+# ---------------------------------------------------------------------
+
+def test_get_db_links( flask_app, dbconn ):
+    """Test getting the links in the database."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+
+    # get the links in the database
+    url = flask_app.url_for( "get_db_links" )
+    resp = urllib.request.urlopen( url )
+    assert resp.headers[ "Content-Type" ] == "application/x-ndjson"
+    links = [ json.loads( line ) for line in resp.read().decode( "utf-8" ).splitlines() ]
+    assert links == [
+        [ "publisher", 1, "Avalon Hill", "http://{FLASK}/ping" ],
+        [ "publisher", 2, "Multiman Publishing", "http://{FLASK}/unknown" ],
+        [ "publication", 10, "ASL Journal (1)", "/aslj-1.html" ],
+        [ "publication", 11, "ASL Journal (2)", "/aslj-2.html" ],
+        [ "article", 200, "MMP article", "/mmp.html" ],
+        [ "article", 299, "MMP publisher article", "/unknown" ],
+    ]
+
+# ---------------------------------------------------------------------
+
+def test_image_report( flask_app, dbconn ):
+    """Test the image report."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+
+    # add some images
+    image_size = len( set_image( flask_app, "publisher", 1, "1.gif" ) )
+    image_size2 = len( set_image( flask_app, "publication", 10, "2.gif" ) )
+    image_data3 = set_image( flask_app, "article", 100, "3.gif" )
+    image_hash3, image_size3 = hashlib.sha256( image_data3 ).hexdigest(), len( image_data3 )
+    set_image( flask_app, "article", 101, "3.gif" )
+
+    # generate the report
+    # NOTE: This should be one query per table (none of which load the images themselves).
+    with QueryCounter() as query_counter:
+        results = call_flask( flask_app, "get_db_images" )
+    assert query_counter.count == 3
+    results[ "article" ].sort() # nb: these are the same size, so their order is undefined
+    results[ "duplicates" ][ image_hash3 ].sort()
+    assert results == {
+        "publisher": [ [ image_size, 1, "Avalon Hill" ] ],
+        "publication": [ [ image_size2, 10, "ASL Journal (1)" ] ],
+        "article": [ [ image_size3, 100, "ASLJ article 1" ], [ image_size3, 101, "ASLJ article 2" ] ],
+        "duplicates": {
+            image_hash3: [ [ "article", 100, "ASLJ article 1" ], [ "article", 101, "ASLJ article 2" ] ]
+        }
+    }
+
+# ---------------------------------------------------------------------
+
+@pytest.mark.skipif( pytest_options.flask_url is not None, reason="Testing against a remote Flask server." )
+def test_link_checker( flask_app, dbconn ): #pylint: disable=too-many-statements,too-many-locals
+    """Test checking links in the background."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn )
+    requests, curr_requests, max_requests = [], [ 0 ], [ 0 ]
+    lock = threading.Lock()
+
+    class RequestHandler( http.server.BaseHTTPRequestHandler ):
+        """Handle requests to our stub web server."""
+        def do_HEAD( self ): #pylint: disable=invalid-name,missing-function-docstring
+            self._handle_request()
+        def do_GET( self ): #pylint: disable=invalid-name,missing-function-docstring
+            self._handle_request()
+        def _handle_request( self ):
+            """Handle a request."""
+            if self.path == "/timeout":
+                time.sleep( 2 )
+                return
+            if self.path == "/bad-status":
+                self.wfile.write( b"garbage\r\n\r\n" ) # nb: this is not a valid HTTP status line
+                return
+            # NOTE: We stop counting this request before we respond, since the client can send its next request
+            # as soon as it gets the response.
+            with lock:
+                requests.append( ( self.command, self.path ) )
+                curr_requests[0] += 1
+                max_requests[0] = max( max_requests[0], curr_requests[0] )
+            if self.path.startswith( "/slow" ):
+                time.sleep( 0.2 )
+            with lock:
+                curr_requests[0] -= 1
+            if self.path == "/missing":
+                self.send_response( 404 )
+            elif self.path == "/no-head" and self.command == "HEAD":
+                self.send_response( 405 )
+            else:
+                self.send_response( 200 )
+            self.end_headers()
+        def log_message( self, *args ): #pylint: disable=arguments-differ
+            pass
+
+    def check_links( urls ):
+        url = flask_app.url_for( "start_check_db_links" )
+        req = urllib.request.Request( url,
+            data = json.dumps( { "urls": urls } ).encode( "utf-8" ),
+            headers = { "Content-Type": "application/json" }
+        )
+        job_id = json.load( urllib.request.urlopen( req ) )[ "jobId" ]
+        results = {}
+        for _ in range( 0, 100 ):
+            status = call_flask( flask_app, "get_check_db_links_status", job_id=job_id, start=len(results) )
+            results.update( ( r["url"], ( r["ok"], r["status"] ) ) for r in status["results"] )
+            if status[ "finished" ]:
+                break
+            time.sleep( 0.1 )
+        assert status[ "finished" ] and status[ "done" ] == len( results )
+        return results
+
+    # start our stub web server
+    server = http.server.ThreadingHTTPServer( ( "localhost", 0 ), RequestHandler )
+    thread = threading.Thread( target=server.serve_forever, daemon=True )
+    thread.start()
+    base_url = "http://localhost:{}".format( server.server_address[1] )
+    config_keys = [ "LINK_CHECK_THREADS", "LINK_CHECK_MAX_PER_HOST", "LINK_CHECK_TIMEOUT" ]
+    prev_config = { key: flask_app.config.get( key ) for key in config_keys }
+    flask_app.config.update( { "LINK_CHECK_THREADS": 5, "LINK_CHECK_MAX_PER_HOST": 2, "LINK_CHECK_TIMEOUT": 1 } )
+
+    try:
+
+        # check some links
+        slow_urls = [ base_url + "/slow-{}".format( i ) for i in range(6) ]
+        results = check_links( [
+            base_url + "/ok", base_url + "/missing", base_url + "/no-head", base_url + "/timeout",
+            base_url + "/bad-status", "http://localhost:1/refused"
+        ] + slow_urls )
+        assert results == dict( {
+            base_url + "/ok": ( True, 200 ),
+            base_url + "/missing": ( False, 404 ),
+            base_url + "/no-head": ( True, 200 ),
+            base_url + "/timeout": ( False, None ),
+            base_url + "/bad-status": ( False, None ),
+            "http://localhost:1/refused": ( False, None ),
+        }, **{ url: ( True, 200 ) for url in slow_urls } )
+        # NOTE: Links that failed should have been tried again with a GET.
+        assert sorted( r for r in requests if r[0] == "GET" ) == [
+            ( "GET", "/missing" ), ( "GET", "/no-head" )
+        ]
+        # NOTE: We should never have had more than 2 requests to our server running at the same time
+        # (not counting the request that timed out, which our server will still be handling).
+        assert max_requests[0] == 2
+
+        # check the links again (the results should have been cached)
+        nrequests = len( requests )
+        results2 = check_links( [ base_url + "/ok", base_url + "/missing" ] )
+        assert results2 == { url: results[url] for url in results2 }
+        assert len( requests ) == nrequests
+
+        # start checking some links, then stop
+        url = flask_app.url_for( "start_check_db_links" )
+        req = urllib.request.Request( url,
+            data = json.dumps( { "urls": [ base_url + "/slow-{}".format( i ) for i in range(10, 30) ] } ) \
+                .encode( "utf-8" ),
+            headers = { "Content-Type": "application/json" }
+        )
+        job_id = json.load( urllib.request.urlopen( req ) )[ "jobId" ]
+        url = flask_app.url_for( "stop_check_db_links", job_id=job_id )
+        status = json.load( urllib.request.urlopen( urllib.request.Request( url, method="POST" ) ) )
+        assert status[ "finished" ]
+        time.sleep( 0.5 )
+        assert len( requests ) - nrequests < 20
+
+        # check that unknown jobs are rejected
+        with pytest.raises( urllib.error.HTTPError ) as exc_info:
+            call_flask( flask_app, "get_check_db_links_status", job_id="unknown" )
+        assert exc_info.value.code == 404
+
+    finally:
+        restore_config( flask_app, prev_config )
+        server.shutdown()
+        server.server_close()
+
+# ---------------------------------------------------------------------
+
+def test_link_checker_errors( flask_app, dbconn, monkeypatch ):
+    """Test errors when checking links in the background."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn )
+
+    def start_job( data ):
+        req = urllib.request.Request( flask_app.url_for( "start_check_db_links" ),
+            data = json.dumps( data ).encode( "utf-8" ),
+            headers = { "Content-Type": "application/json" }
+        )
+        return json.load( urllib.request.urlopen( req ) )[ "jobId" ]
+
+    def wait_for_job( job_id ):
+        for _ in range( 0, 100 ):
+            status = call_flask( flask_app, "get_check_db_links_status", job_id=job_id )
+            if status[ "finished" ]:
+                break
+            time.sleep( 0.1 )
+        assert status[ "finished" ] and status[ "done" ] == status[ "total" ]
+        return status
+
+    # check that invalid lists of URL's are rejected
+    bad_urls = [ "http://localhost:1", [ "http://localhost:1", 42 ], [ None ] ]
+    for data in [ {} ] + [ { "urls": urls } for urls in bad_urls ]:
+        with pytest.raises( urllib.error.HTTPError ) as exc_info:
+            start_job( data )
+        assert exc_info.value.code == 400
+
+    # start a job, then change the config (so that a new link checker gets created)
+    prev_config = { "LINK_CHECK_TIMEOUT": flask_app.config.get( "LINK_CHECK_TIMEOUT" ) }
+    try:
+        flask_app.config[ "LINK_CHECK_TIMEOUT" ] = 1
+        job_id = start_job( { "urls": [ "http://localhost:1/refused-{}".format( i ) for i in range(5) ] } )
+        flask_app.config[ "LINK_CHECK_TIMEOUT" ] = 2
+        # NOTE: We should still be able to get the job's status from the new link checker.
+        status = wait_for_job( job_id )
+        assert status[ "total" ] == 5
+        assert all( not r["ok"] for r in status["results"] )
+    finally:
+        restore_config( flask_app, prev_config )
+
+    # check that a job still finishes if checking a link fails unexpectedly
+    def check_link( url, timeout ):
+        raise RuntimeError( "Unexpected error: {} {}".format( url, timeout ) )
+    monkeypatch.setattr( asl_articles.link_checker, "check_link", check_link )
+    status = wait_for_job( start_job( { "urls": [ "http://localhost:1/unexpected-error" ] } ) )
+    assert [ ( r["ok"], r["status"] ) for r in status["results"] ] == [ ( False, None ) ]
+
+# ---------------------------------------------------------------------
+
 # NOTE: This test may not work if we are running against Docker containers, because:
 # - external URL's are created that point to the back-end's $/ping endpoint.
 # - the front-end container realizes that these URL's need to be checked by the backend,
@@ -187,7 +479,7 @@ def _get_db_report(): #pylint: disable=too-many-locals
     dupe_images = []
     for row in find_children( "#db-report .dupe-analysis .dupe-image" ):
         elem = find_child( ".caption .hash", row )
-        mo = re.search( r"^\(md5:(.+)\)$", elem.text )
+        mo = re.search( r"^\(sha256:(.+)\)$", elem.text )
         image_hash = mo.group(1)
         image_url = _fixup_url( find_child( "img", row ).get_attribute( "src" ) )
         parents = []
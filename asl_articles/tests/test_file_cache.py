@@ -0,0 +1,46 @@
+""" Test the file cache. """
+
+import os
+import time
+import tempfile
+
+from asl_articles.file_cache import FileCache
+
+# ---------------------------------------------------------------------
+
+def test_file_cache():
+    """Test caching files on disk."""
+
+    with tempfile.TemporaryDirectory() as dname:
+
+        # add some files to the cache
+        cache = FileCache( dname, 1000 )
+        for key in ( "a-1", "b-1", "b-2" ):
+            fname = cache.add( key, key.encode() * 100 )
+            assert open( fname, "rb" ).read() == key.encode() * 100
+            os.utime( fname, ( time.time()-100, time.time()-100 ) ) # nb: so that the file times are distinct
+            time.sleep( 0.01 )
+        with cache.open( "a-1" ) as fp:
+            assert fp.read() == b"a-1" * 100
+        assert cache.open( "unknown" ) is None
+        assert sorted( os.listdir( dname ) ) == [ "a-1", "b-1", "b-2" ]
+
+        # add another file (this should evict the least-recently used ones)
+        cache.add( "c-1", b"c" * 500 )
+        assert sorted( os.listdir( dname ) ) == [ "a-1", "c-1" ]
+
+        # check that a new cache object picks up the existing files
+        cache2 = FileCache( dname, 1000 )
+        cache2.add( "d-1", b"d" * 300 )
+        assert sorted( os.listdir( dname ) ) == [ "c-1", "d-1" ]
+
+        # remove files from the cache
+        cache2.add( "c-2", b"c" )
+        cache2.remove( "c-" )
+        assert os.listdir( dname ) == [ "d-1" ]
+
+        # check that an open file can still be read after it has been removed from the cache
+        with cache2.open( "d-1" ) as fp:
+            cache2.remove( "d-" )
+            assert os.listdir( dname ) == []
+            assert fp.read() == b"d" * 300
@@ -17,7 +17,7 @@ from asl_articles.tests.utils import init_tests, load_fixtures, select_main_menu
     do_test_confirm_discard_changes, find_parent_by_class, \
     wait_for, wait_for_elem, wait_for_not_elem, find_child, find_children, find_search_result, set_elem_text, \
     set_toast_marker, check_toast, send_upload_data, check_ask_dialog, check_error_msg, check_constraint_warnings, \
-    change_image, remove_image, get_publication_row
+    change_image, remove_image, get_publication_row, call_flask
 from asl_articles.tests.react_select import ReactSelect
 
 # ---------------------------------------------------------------------
@@ -408,6 +408,81 @@ def test_cascading_deletes( webdriver, flask_app, dbconn ):
 
 # ---------------------------------------------------------------------
 
+def test_get_multiple( flask_app, dbconn ):
+    """Test getting multiple publications."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+
+    # get multiple publications, and compare them with what we get when we get each one individually
+    for args in ( {}, { "include_articles": 1, "deep": 1 } ):
+        pubs = call_flask( flask_app, "get_publications", ids="10,20,99", **args )
+        assert list( pubs.keys() ) == [ "10", "20" ]
+        for pub_id, vals in pubs.items():
+            assert vals == call_flask( flask_app, "get_publication", pub_id=pub_id, **args )
+        assert pubs["10"]["nArticles"] == 2
+
+# ---------------------------------------------------------------------
+
+def test_reorder_articles( flask_app, dbconn ):
+    """Test changing the order of articles in a publication."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+
+    def get_article_order():
+        pub = call_flask( flask_app, "get_publication", pub_id=10, include_articles=1 )
+        return [ a["article_id"] for a in pub["articles"] ]
+
+    # add another article to the publication
+    resp = call_flask( flask_app, "create_article", {
+        "article_title": "New article", "pub_id": 10, "article_tags": []
+    } )
+    article_id = resp[ "record" ][ "article_id" ]
+    assert get_article_order() == [ article_id, 100, 101 ]
+    pub = call_flask( flask_app, "get_publication", pub_id=10 )
+
+    # re-order the articles
+    # NOTE: Articles that aren't in the publication are ignored.
+    resp = call_flask( flask_app, "reorder_publication", { "article_order": [ 101, 200, article_id, 100 ] }, pub_id=10 )
+    assert resp[ "status" ] == "OK"
+    assert get_article_order() == [ 101, article_id, 100 ]
+    assert call_flask( flask_app, "get_article", article_id=200 )[ "pub_id" ] == 20
+
+    # check that the publication itself wasn't changed
+    assert call_flask( flask_app, "get_publication", pub_id=10 ) == pub
+
+    # re-order the articles when updating the publication
+    call_flask( flask_app, "update_publication", {
+        "pub_id": 10, "pub_name": "ASL Journal", "pub_tags": [], "publ_id": 1, "article_order": [ 100, 101, article_id ]
+    } )
+    assert get_article_order() == [ 100, 101, article_id ]
+
+    # try to re-order the articles in an unknown publication
+    try:
+        call_flask( flask_app, "reorder_publication", { "article_order": [] }, pub_id=99 )
+        assert False, "Shouldn't get here!"
+    except urllib.error.HTTPError as ex:
+        assert ex.code == 404
+
+    # check that bad article orders are rejected
+    for data in [ {}, { "article_order": "100,101" }, { "article_order": [ 100, "101" ] } ]:
+        try:
+            call_flask( flask_app, "reorder_publication", data, pub_id=10 )
+            assert False, "Shouldn't get here!"
+        except urllib.error.HTTPError as ex:
+            assert ex.code == 400
+    try:
+        call_flask( flask_app, "update_publication", {
+            "pub_id": 10, "pub_name": "ASL Journal", "pub_tags": [], "publ_id": 1, "article_order": [ None ]
+        } )
+        assert False, "Shouldn't get here!"
+    except urllib.error.HTTPError as ex:
+        assert ex.code == 400
+    assert get_article_order() == [ 100, 101, article_id ]
+
+# ---------------------------------------------------------------------
+
 def test_unicode( webdriver, flask_app, dbconn ):
     """Test Unicode content."""
 
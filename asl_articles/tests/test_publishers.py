@@ -1,20 +1,31 @@
 """ Test publisher operations. """
 
 import os
+import io
+import shutil
+import tempfile
+import json
 import urllib.request
 import urllib.error
 import base64
+from collections import Counter
+
+import pytest
+from PIL import Image
 
 from selenium.common.exceptions import StaleElementReferenceException
 
+import asl_articles.images
+from asl_articles.models import PublisherImage, PublicationImage, ArticleImage, ImageBlob
 from asl_articles.search import SEARCH_ALL, SEARCH_ALL_PUBLISHERS
+from asl_articles.tests import pytest_options
 from asl_articles.tests.test_publications import create_publication, edit_publication
 from asl_articles.tests.utils import init_tests, load_fixtures, select_main_menu_option, select_sr_menu_option, \
     do_search, get_search_results, get_search_result_names, check_search_result, \
     do_test_confirm_discard_changes, \
     wait_for, wait_for_elem, wait_for_not_elem, find_child, find_children, find_search_result, set_elem_text, \
     set_toast_marker, check_toast, send_upload_data, change_image, remove_image, get_publisher_row, \
-    check_ask_dialog, check_error_msg
+    check_ask_dialog, check_error_msg, call_flask, set_image, restore_config, QueryCounter
 
 # ---------------------------------------------------------------------
 
@@ -316,6 +327,407 @@ def test_cascading_deletes( webdriver, flask_app, dbconn ):
 
 # ---------------------------------------------------------------------
 
+def test_get_multiple( flask_app, dbconn ):
+    """Test getting multiple publishers."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+
+    # get multiple publishers, and compare them with what we get when we get each one individually
+    for args in ( {}, { "include_pubs": 1, "include_articles": 1 } ):
+        publs = call_flask( flask_app, "get_publishers", ids="2,1,3", **args )
+        assert list( publs.keys() ) == [ "1", "2" ]
+        for publ_id, vals in publs.items():
+            assert vals == call_flask( flask_app, "get_publisher", publ_id=publ_id, **args )
+        assert ( publs["1"]["nPublications"], publs["1"]["nArticles"] ) == ( 2, 3 )
+        assert ( publs["2"]["nPublications"], publs["2"]["nArticles"] ) == ( 1, 2 )
+
+# ---------------------------------------------------------------------
+
+@pytest.mark.skipif( pytest_options.flask_url is not None, reason="Testing against a remote Flask server." )
+def test_upload_image( flask_app, dbconn ):
+    """Test uploading images directly."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+    dname = os.path.join( os.path.split(__file__)[0], "fixtures/images" )
+    version = call_flask( flask_app, "get_changes" )[ "version" ]
+
+    def upload_image( image_type, image_id, fname, multipart ):
+        with open( os.path.join( dname, fname ), "rb" ) as fp:
+            image_data = fp.read()
+        url = flask_app.url_for( "upload_image", image_type=image_type, image_id=image_id )
+        if multipart:
+            data = b"".join( [
+                b"--xyzzy\r\n",
+                'Content-Disposition: form-data; name="image"; filename="{}"\r\n'.format( fname ).encode(),
+                b"Content-Type: application/octet-stream\r\n\r\n",
+                image_data,
+                b"\r\n--xyzzy--\r\n"
+            ] )
+            req = urllib.request.Request( url, data=data,
+                headers = { "Content-Type": "multipart/form-data; boundary=xyzzy" }
+            )
+        else:
+            req = urllib.request.Request( url+"?filename="+fname, data=image_data,
+                headers = { "Content-Type": "application/octet-stream" }
+            )
+        try:
+            resp = json.load( urllib.request.urlopen( req ) )
+        except urllib.error.HTTPError as ex:
+            return ex.code
+        assert resp == { "status": "OK", "imageSize": len(image_data) }
+        # check that we can get the image back
+        url = flask_app.url_for( "get_image", image_type=image_type, image_id=image_id )
+        resp = urllib.request.urlopen( url )
+        assert resp.headers[ "Content-Type" ] == "image/" + os.path.splitext( fname )[1][1:]
+        assert resp.read() == image_data
+        return 200
+
+    # upload some images
+    for multipart in ( True, False ):
+        assert upload_image( "publisher", 1, "1.gif", multipart ) == 200
+        assert call_flask( flask_app, "get_publisher", publ_id=1 )[ "publ_image_id" ] == 1
+        assert upload_image( "publication", 10, "2.gif", multipart ) == 200
+        assert call_flask( flask_app, "get_publication", pub_id=10 )[ "pub_image_id" ] == 10
+        assert upload_image( "article", 100, "big.png", multipart ) == 200
+        assert call_flask( flask_app, "get_article", article_id=100 )[ "article_image_id" ] == 100
+
+    # check that the front-end is told about the changes
+    changes = call_flask( flask_app, "get_changes", since=version )
+    assert list( changes["publishers"]["updated"].keys() ) == [ "1" ]
+    assert list( changes["publications"]["updated"].keys() ) == [ "10" ]
+
+    # try uploading images for invalid records
+    assert upload_image( "publisher", 999, "1.gif", True ) == 404
+    assert upload_image( "unknown", 1, "1.gif", True ) == 404
+
+    # try uploading an image that's too big
+    prev_max_size = flask_app.config.get( "MAX_IMAGE_UPLOAD_SIZE" )
+    flask_app.config[ "MAX_IMAGE_UPLOAD_SIZE" ] = 2*1024
+    try:
+        assert upload_image( "publisher", 1, "1.gif", True ) == 200
+        assert upload_image( "publisher", 1, "big.png", True ) == 413
+        assert upload_image( "publisher", 1, "big.png", False ) == 413
+        # NOTE: This request is too big, so it should be rejected before the form is parsed.
+        data = b"--xyzzy\r\nContent-Disposition: form-data; name=\"padding\"\r\n\r\n" + 100*1024*b"x" \
+            + b"\r\n--xyzzy--\r\n"
+        req = urllib.request.Request(
+            flask_app.url_for( "upload_image", image_type="publisher", image_id=1 ), data=data,
+            headers = { "Content-Type": "multipart/form-data; boundary=xyzzy" }
+        )
+        with pytest.raises( urllib.error.HTTPError ) as exc_info:
+            urllib.request.urlopen( req )
+        assert exc_info.value.code == 413
+    finally:
+        if prev_max_size is None:
+            del flask_app.config[ "MAX_IMAGE_UPLOAD_SIZE" ]
+        else:
+            flask_app.config[ "MAX_IMAGE_UPLOAD_SIZE" ] = prev_max_size
+
+# ---------------------------------------------------------------------
+
+@pytest.mark.skipif( pytest_options.flask_url is not None, reason="Testing against a remote Flask server." )
+def test_shared_images( flask_app, dbconn ):
+    """Test storing images that are used by multiple records."""
+
+    # initialize
+    session = init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+
+    def check_blobs( expected ):
+        session.expire_all()
+        ref_counts = { blob.image_hash: blob.ref_count for blob in session.query( ImageBlob ) }
+        assert sorted( ref_counts.values() ) == sorted( expected )
+        # make sure the reference counts are correct
+        image_hashes = Counter()
+        for model in ( PublisherImage, PublicationImage, ArticleImage ):
+            image_hashes.update( img.image_hash for img in session.query( model ) )
+        assert image_hashes == ref_counts
+
+    # use the same image for several records
+    set_image( flask_app, "publisher", 1, "1.gif" )
+    set_image( flask_app, "publication", 10, "1.gif" )
+    set_image( flask_app, "publication", 11, "1.gif" )
+    set_image( flask_app, "article", 100, "1.gif" )
+    set_image( flask_app, "article", 101, "2.gif" )
+    check_blobs( [ 4, 1 ] )
+
+    # replace some images
+    set_image( flask_app, "publication", 11, "1.gif" )
+    check_blobs( [ 4, 1 ] )
+    set_image( flask_app, "article", 101, "3.gif" )
+    check_blobs( [ 4, 1 ] )
+    call_flask( flask_app, "update_article", {
+        "article_id": 100, "article_title": "ASLJ article 1", "pub_id": 10,
+        "article_tags": [], "article_authors": [], "article_scenarios": [],
+        "imageData": "{remove}"
+    } )
+    check_blobs( [ 3, 1 ] )
+
+    # delete some records
+    call_flask( flask_app, "delete_article", article_id=101 )
+    check_blobs( [ 3 ] )
+    call_flask( flask_app, "delete_publication", pub_id=11 )
+    check_blobs( [ 2 ] )
+    call_flask( flask_app, "delete_publisher", publ_id=1 )
+    check_blobs( [] )
+
+# ---------------------------------------------------------------------
+
+@pytest.mark.skipif( pytest_options.flask_url is not None, reason="Testing against a remote Flask server." )
+def test_shared_images_race( flask_app, dbconn, monkeypatch ):
+    """Test saving an image that someone else is saving at the same time."""
+
+    # initialize
+    session = init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+    set_image( flask_app, "publisher", 1, "1.gif" )
+
+    # pretend that someone else adds the image data after we've checked if it's already there
+    update_ref_count = asl_articles.images._update_ref_count #pylint: disable=protected-access
+    calls = []
+    def mock_update_ref_count( image_hash, delta ):
+        calls.append( delta )
+        return False if len(calls) == 1 else update_ref_count( image_hash, delta )
+    monkeypatch.setattr( asl_articles.images, "_update_ref_count", mock_update_ref_count )
+    set_image( flask_app, "publisher", 2, "1.gif" )
+    assert calls == [ +1, +1 ]
+
+    # check that we added another reference to the existing image data
+    assert [ blob.ref_count for blob in session.query( ImageBlob ) ] == [ 2 ]
+
+# ---------------------------------------------------------------------
+
+@pytest.mark.skipif( pytest_options.flask_url is not None, reason="Testing against a remote Flask server." )
+def test_create_with_image( flask_app, dbconn ):
+    """Test creating records that have an image."""
+
+    # initialize
+    session = init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+    with open( os.path.join( os.path.split(__file__)[0], "fixtures/images/1.gif" ), "rb" ) as fp:
+        image_data = fp.read()
+    image_vals = { "imageData": base64.b64encode( image_data ).decode( "ascii" ), "imageFilename": "1.gif" }
+
+    # create some new records, with an image
+    # NOTE: The new publication doesn't have a parent publisher.
+    resp = call_flask( flask_app, "create_publisher", dict( image_vals, publ_name="New publisher" ) )
+    publ_id = resp[ "record" ][ "publ_id" ]
+    resp = call_flask( flask_app, "create_publication", dict( image_vals, pub_name="New publication", pub_tags=[] ) )
+    pub_id = resp[ "record" ][ "pub_id" ]
+    resp = call_flask( flask_app, "create_article", dict( image_vals,
+        article_title="New article", article_tags=[], article_authors=[], article_scenarios=[]
+    ) )
+    article_id = resp[ "record" ][ "article_id" ]
+
+    # check that the images belong to the new records
+    for model, key_name, owner_id in [
+        ( PublisherImage, "publ_id", publ_id ),
+        ( PublicationImage, "pub_id", pub_id ),
+        ( ArticleImage, "article_id", article_id )
+    ]:
+        assert [ getattr( img, key_name ) for img in session.query( model ) ] == [ owner_id ]
+    for image_type, owner_id in [ ( "publisher", publ_id ), ( "publication", pub_id ), ( "article", article_id ) ]:
+        assert _get_image( flask_app, image_type, owner_id, {} )[2] == image_data
+    assert session.query( ImageBlob ).one().ref_count == 3
+
+# ---------------------------------------------------------------------
+
+@pytest.mark.skipif( pytest_options.flask_url is not None, reason="Testing against a remote Flask server." )
+def test_image_caching( flask_app, dbconn ):
+    """Test caching of images."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+
+    def get_image( version, headers ):
+        url = flask_app.url_for( "get_image", image_type="publisher", image_id=1 )
+        if version:
+            url += "?v=" + version
+        with QueryCounter() as query_counter:
+            try:
+                resp = urllib.request.urlopen( urllib.request.Request( url, headers=headers ) )
+                resp_data = resp.read()
+            except urllib.error.HTTPError as ex:
+                resp, resp_data = ex, ex.read()
+        return resp.code, resp.headers, resp_data, query_counter.count
+
+    # get an image
+    image_data = set_image( flask_app, "publisher", 1, "1.gif" )
+    version = call_flask( flask_app, "get_publisher", publ_id=1 )[ "publ_image_version" ]
+    status, headers, resp_data, nqueries = get_image( version, {} )
+    assert ( status, resp_data, nqueries ) == ( 200, image_data, 2 )
+    assert headers[ "Cache-Control" ] == "public, max-age=31536000, immutable"
+    etag, last_modified = headers[ "ETag" ], headers[ "Last-Modified" ]
+
+    # check that the image data isn't loaded if the client already has it
+    for req_headers in ( { "If-None-Match": etag }, { "If-Modified-Since": last_modified } ):
+        status, headers, resp_data, nqueries = get_image( version, req_headers )
+        assert ( status, resp_data, nqueries ) == ( 304, b"", 1 )
+        assert headers[ "ETag" ] == etag
+
+    # check that clients must check with us if the URL doesn't have the image's version
+    status, headers, _, _ = get_image( None, {} )
+    assert status == 200
+    assert headers[ "Cache-Control" ] == "no-cache"
+    assert get_image( "wrong-version", {} )[1][ "Cache-Control" ] == "no-cache"
+
+    # change the image
+    image_data = set_image( flask_app, "publisher", 1, "2.gif" )
+    assert call_flask( flask_app, "get_publisher", publ_id=1 )[ "publ_image_version" ] != version
+    status, headers, resp_data, _ = get_image( version, { "If-None-Match": etag } )
+    assert ( status, resp_data ) == ( 200, image_data )
+    assert headers[ "ETag" ] != etag
+
+# ---------------------------------------------------------------------
+
+@pytest.mark.skipif( pytest_options.flask_url is not None, reason="Testing against a remote Flask server." )
+def test_thumbnails( flask_app, dbconn ):
+    """Test generating thumbnails of images."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+    dname = os.path.join( os.path.split(__file__)[0], "fixtures/images" )
+    cache_dname = tempfile.mkdtemp()
+    prev_cache_dname = flask_app.config.get( "THUMBNAIL_CACHE_DIR" )
+    flask_app.config[ "THUMBNAIL_CACHE_DIR" ] = cache_dname
+
+    def get_thumbnail( image_type, image_id, width ):
+        url = flask_app.url_for( "get_image", image_type=image_type, image_id=image_id, w=width )
+        with QueryCounter() as query_counter:
+            resp = urllib.request.urlopen( url )
+            image_data = resp.read()
+        img = Image.open( io.BytesIO( image_data ) )
+        return resp.headers, img.format, img.size, query_counter.count
+
+    try:
+
+        # get a thumbnail of an image
+        set_image( flask_app, "publisher", 1, "big.png" )
+        set_image( flask_app, "article", 100, "big.png" )
+        headers, image_format, image_size, nqueries = get_thumbnail( "publisher", 1, 50 )
+        assert headers[ "Content-Type" ] == "image/png"
+        assert ( image_format, image_size, nqueries ) == ( "PNG", (64,64), 2 ) # nb: the width is rounded up
+        assert len( os.listdir( cache_dname ) ) == 1
+
+        # get the same thumbnail again (it should come from the cache)
+        headers2, image_format, image_size, nqueries = get_thumbnail( "article", 100, 64 )
+        assert ( image_format, image_size, nqueries ) == ( "PNG", (64,64), 1 )
+        assert headers2[ "ETag" ] == headers[ "ETag" ]
+        assert len( os.listdir( cache_dname ) ) == 1
+
+        # check that small images aren't made bigger
+        set_image( flask_app, "publication", 10, "1.gif" )
+        headers, image_format, image_size, _ = get_thumbnail( "publication", 10, 1000 )
+        assert ( image_format, image_size ) == ( "PNG", Image.open( os.path.join( dname, "1.gif" ) ).size )
+        assert len( os.listdir( cache_dname ) ) == 2
+
+        # check that thumbnails are removed when their image is no longer being used
+        set_image( flask_app, "publisher", 1, "2.gif" )
+        assert len( os.listdir( cache_dname ) ) == 2
+        set_image( flask_app, "article", 100, "2.gif" )
+        assert len( os.listdir( cache_dname ) ) == 1
+
+        # check that invalid widths are rejected
+        for width in ( "0", "-1", "xyz" ):
+            with pytest.raises( urllib.error.HTTPError ) as exc_info:
+                get_thumbnail( "publisher", 1, width )
+            assert exc_info.value.code == 400
+
+    finally:
+        flask_app.config[ "THUMBNAIL_CACHE_DIR" ] = prev_cache_dname
+        shutil.rmtree( cache_dname )
+
+@pytest.mark.skipif( pytest_options.flask_url is not None, reason="Testing against a remote Flask server." )
+def test_thumbnails_unreadable( flask_app, dbconn ):
+    """Test requesting a thumbnail of an image that can't be read."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+    cache_dname = tempfile.mkdtemp()
+    prev_config = { "THUMBNAIL_CACHE_DIR": flask_app.config.get( "THUMBNAIL_CACHE_DIR" ) }
+    flask_app.config[ "THUMBNAIL_CACHE_DIR" ] = cache_dname
+
+    try:
+
+        # request a thumbnail of an SVG (we should get the image itself)
+        image_data = set_image( flask_app, "publisher", 1, "image.svg" )
+        url = flask_app.url_for( "get_image", image_type="publisher", image_id=1, w=64 )
+        for _ in range( 0, 2 ):
+            resp = urllib.request.urlopen( url )
+            assert resp.headers[ "Content-Type" ].startswith( "image/svg+xml" )
+            assert resp.read() == image_data
+        assert os.listdir( cache_dname ) == []
+
+    finally:
+        restore_config( flask_app, prev_config )
+        shutil.rmtree( cache_dname )
+
+@pytest.mark.skipif( pytest_options.flask_url is not None, reason="Testing against a remote Flask server." )
+def test_image_file_cache_disabled( flask_app, dbconn ):
+    """Test serving images when the file cache is disabled."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+    assert not flask_app.config.get( "IMAGE_CACHE_DIR" )
+
+    # check that images are always loaded from the database
+    image_data = set_image( flask_app, "publisher", 1, "1.gif" )
+    for _ in range( 0, 2 ):
+        status, headers, resp_data, nqueries = _get_image( flask_app, "publisher", 1, {} )
+        assert ( status, resp_data, nqueries ) == ( 200, image_data, 2 )
+        assert headers[ "Content-Type" ] == "image/gif"
+    _check_range_requests( flask_app, image_data, 2 )
+
+@pytest.mark.skipif( pytest_options.flask_url is not None, reason="Testing against a remote Flask server." )
+def test_image_file_cache( flask_app, dbconn ):
+    """Test serving images from the file cache."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+    image_data = set_image( flask_app, "publisher", 1, "1.gif" )
+    cache_dname = tempfile.mkdtemp()
+    prev_cache_dname = flask_app.config.get( "IMAGE_CACHE_DIR" )
+    flask_app.config[ "IMAGE_CACHE_DIR" ] = cache_dname
+
+    try:
+
+        # get the image (it should be written to the cache)
+        status, headers, resp_data, nqueries = _get_image( flask_app, "publisher", 1, {} )
+        assert ( status, resp_data, nqueries ) == ( 200, image_data, 2 )
+        assert headers[ "Content-Type" ] == "image/gif"
+        assert "Last-Modified" in headers
+        assert os.listdir( cache_dname ) == [ headers[ "ETag" ].strip( '"' ) ]
+
+        # get the image again (it should come from the cache)
+        status, headers2, resp_data, nqueries = _get_image( flask_app, "publisher", 1, {} )
+        assert ( status, resp_data, nqueries ) == ( 200, image_data, 1 )
+        assert headers2[ "ETag" ] == headers[ "ETag" ]
+        assert headers2[ "Last-Modified" ] == headers[ "Last-Modified" ]
+        _check_range_requests( flask_app, image_data, 1 )
+
+        # check that we can handle the cached image being removed (e.g. by another process)
+        os.unlink( os.path.join( cache_dname, headers[ "ETag" ].strip( '"' ) ) )
+        status, _, resp_data, nqueries = _get_image( flask_app, "publisher", 1, {} )
+        assert ( status, resp_data, nqueries ) == ( 200, image_data, 2 )
+        assert len( os.listdir( cache_dname ) ) == 1
+
+        # check that the cached image is removed when it is no longer being used
+        set_image( flask_app, "article", 100, "1.gif" )
+        image_data = set_image( flask_app, "publisher", 1, "2.gif" )
+        assert len( os.listdir( cache_dname ) ) == 1
+        set_image( flask_app, "article", 100, "2.gif" )
+        assert os.listdir( cache_dname ) == []
+        status, _, resp_data, nqueries = _get_image( flask_app, "publisher", 1, {} )
+        assert ( status, resp_data, nqueries ) == ( 200, image_data, 2 )
+        assert len( os.listdir( cache_dname ) ) == 1
+        call_flask( flask_app, "delete_publisher", publ_id=1 )
+        assert os.listdir( cache_dname ) == []
+
+    finally:
+        flask_app.config[ "IMAGE_CACHE_DIR" ] = prev_cache_dname
+        shutil.rmtree( cache_dname )
+
+# ---------------------------------------------------------------------
+
 def test_unicode( webdriver, flask_app, dbconn ):
     """Test Unicode content."""
 
@@ -558,3 +970,22 @@ def _check_sr( sr, expected ):
         assert elem is None
 
     return True
+
+# ---------------------------------------------------------------------
+
+def _get_image( flask_app, image_type, image_id, headers ):
+    """Get an image (and count how many queries it took)."""
+    url = flask_app.url_for( "get_image", image_type=image_type, image_id=image_id )
+    with QueryCounter() as query_counter:
+        resp = urllib.request.urlopen( urllib.request.Request( url, headers=headers ) )
+        resp_data = resp.read()
+    return resp.code, resp.headers, resp_data, query_counter.count
+
+def _check_range_requests( flask_app, image_data, expected_nqueries ):
+    """Check getting part of publisher #1's image."""
+    status, headers, resp_data, nqueries = _get_image( flask_app, "publisher", 1, { "Range": "bytes=10-19" } )
+    assert ( status, resp_data, nqueries ) == ( 206, image_data[10:20], expected_nqueries )
+    assert headers[ "Content-Range" ] == "bytes 10-19/{}".format( len(image_data) )
+    # NOTE: If the image has changed, we should get all of it.
+    status, _, resp_data, _ = _get_image( flask_app, "publisher", 1, { "Range": "bytes=10-19", "If-Range": '"xyz"' } )
+    assert ( status, resp_data ) == ( 200, image_data )
@@ -1,14 +1,28 @@
 """ Test search operations. """
 
+import os
+import shutil
+import tempfile
+import hashlib
+import fcntl
+import urllib.error
+
+import pytest
+
 from asl_articles.search import _load_search_aliases, _make_fts_query_string, _find_aslrb_ruleids
-from asl_articles.search import SEARCH_ALL
+from asl_articles.search import SearchDbConn, SEARCH_ALL
+from asl_articles.models import Publisher, PublisherImage, Publication, PublicationImage, \
+    Article, ArticleImage, ArticleAuthor, ArticleScenario, ImageBlob
+from asl_articles.utils import MAX_SQL_PARAMS
 
 from asl_articles.tests.test_publishers import create_publisher, edit_publisher
 from asl_articles.tests.test_publications import create_publication, edit_publication
 from asl_articles.tests.test_articles import create_article, edit_article
 from asl_articles.tests.utils import init_tests, select_main_menu_option, select_sr_menu_option, \
     wait_for, wait_for_elem, find_child, find_children, check_ask_dialog, \
-    do_search, get_search_results, get_search_result_names, find_search_result
+    do_search, get_search_results, get_search_result_names, find_search_result, call_flask, \
+    restore_config, QueryCounter
+from asl_articles.tests import pytest_options
 
 # ---------------------------------------------------------------------
 
@@ -539,6 +553,192 @@ def test_author_aliases( webdriver, flask_app, dbconn ):
 
 # ---------------------------------------------------------------------
 
+def test_search_paging( flask_app, dbconn ):
+    """Test returning a page of search results."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="search.json" )
+
+    def do_search_request( **kwargs ):
+        kwargs[ "query" ] = "asl"
+        results = call_flask( flask_app, "search", kwargs )
+        return [ r.get("article_id") or r.get("pub_id") or r.get("publ_id") for r in results ]
+
+    # check that we can get a page of search results
+    results = do_search_request()
+    assert len(results) == 7
+    assert do_search_request( offset=2, limit=3 ) == results[2:5]
+    assert do_search_request( limit=3 ) == results[:3]
+    assert do_search_request( offset=5 ) == results[5:]
+    for kwargs in [ { "offset": "x" }, { "limit": "1,2" }, { "limit": [ 3 ] } ]:
+        with pytest.raises( urllib.error.HTTPError ) as exc_info:
+            do_search_request( **kwargs )
+        assert exc_info.value.code == 400
+
+    # check that only the requested columns are highlighted
+    query = { "query": "hs17" }
+    results = call_flask( flask_app, "search", query )
+    assert [ k for k in results[0] if k.endswith("!") ] == [ "article_subtitle!", "scenarios!" ]
+    query[ "hilite_cols" ] = [ "scenarios" ]
+    results = call_flask( flask_app, "search", query )
+    assert [ k for k in results[0] if k.endswith("!") ] == [ "scenarios!" ]
+    query[ "no_hilite" ] = 1
+    results = call_flask( flask_app, "search", query )
+    assert [ k for k in results[0] if k.endswith("!") ] == []
+
+    # check that bad lists of columns are rejected
+    for hilite_cols in [ "scenarios", [ "unknown" ], [ "scenarios", 1 ], { "scenarios": 1 } ]:
+        with pytest.raises( urllib.error.HTTPError ) as exc_info:
+            call_flask( flask_app, "search", { "query": "hs17", "hilite_cols": hilite_cols } )
+        assert exc_info.value.code == 400
+
+# ---------------------------------------------------------------------
+
+def test_snippet_windows( flask_app, dbconn ):
+    """Test returning snippet windows in search results."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="search.json" )
+
+    def do_search_request( **kwargs ):
+        kwargs[ "query" ] = "enemy"
+        results = call_flask( flask_app, "search", kwargs )
+        assert len(results) == 1
+        return results[0]
+
+    # check that we get the full snippet by default
+    result = do_search_request()
+    assert result[ "article_snippet" ].startswith( "Infantry often found itself battling the elements" )
+    assert "_partial_snippet" not in result
+
+    # check that we can get a window around the matches instead
+    result = do_search_request( snippet_size=8 )
+    assert result[ "article_snippet" ] is None
+    assert result[ "article_snippet!" ] == \
+        '...well as the <span class="hilite">enemy</span>. ASL has made provisions...'
+    assert result[ "_partial_snippet" ]
+    result = do_search_request( snippet_size=8, no_hilite=1 )
+    assert result[ "article_snippet!" ] == "...well as the enemy. ASL has made provisions..."
+    result = do_search_request( snippet_size="8" )
+    assert result[ "article_snippet!" ] == \
+        '...well as the <span class="hilite">enemy</span>. ASL has made provisions...'
+
+    # check that bad snippet sizes are rejected
+    with pytest.raises( urllib.error.HTTPError ) as exc_info:
+        do_search_request( snippet_size="big" )
+    assert exc_info.value.code == 400
+
+# ---------------------------------------------------------------------
+
+@pytest.mark.skipif( pytest_options.flask_url is not None, reason="Testing against a remote Flask server." )
+def test_bulk_delete( flask_app, dbconn ):
+    """Test removing a lot of entries from the search index."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+
+    def get_owners():
+        with SearchDbConn() as dbconn2:
+            return set( row[0] for row in dbconn2.conn.execute( "SELECT owner FROM searchable" ) )
+
+    # add a publisher with a lot of articles (more than we can delete in a single statement)
+    resp = call_flask( flask_app, "create_publisher", { "publ_name": "Doomed publisher" } )
+    publ_id = resp[ "record" ][ "publ_id" ]
+    resp = call_flask( flask_app, "create_publication", {
+        "pub_name": "Doomed publication", "publ_id": publ_id, "pub_tags": []
+    } )
+    pub_id = resp[ "record" ][ "pub_id" ]
+    resp = call_flask( flask_app, "import_articles", { "articles": [
+        { "article_title": "Doomed article {}".format(n), "pub_id": pub_id }
+        for n in range(0,MAX_SQL_PARAMS)
+    ] + [
+        { "article_title": "Doomed article {}".format(MAX_SQL_PARAMS+n), "publ_id": publ_id }
+        for n in range(0,MAX_SQL_PARAMS)
+    ] } )
+    article_ids = resp[ "newArticleIds" ]
+    owners = get_owners()
+    assert len( call_flask( flask_app, "search", { "query": "doomed" } ) ) == 2 + 2*MAX_SQL_PARAMS
+
+    # delete the publisher, and check that everything it owned was removed from the search index
+    call_flask( flask_app, "delete_publisher", publ_id=publ_id )
+    assert call_flask( flask_app, "search", { "query": "doomed" } ) == []
+    assert owners - get_owners() == set(
+        [ "publisher:{}".format( publ_id ), "publication:{}".format( pub_id ) ] +
+        [ "article:{}".format( article_id ) for article_id in article_ids ]
+    )
+    assert len( get_owners() ) == len( owners ) - 2 - 2*MAX_SQL_PARAMS
+
+# ---------------------------------------------------------------------
+
+@pytest.mark.skipif( pytest_options.flask_url is not None, reason="Testing against a remote Flask server." )
+def test_query_counts( flask_app, dbconn ):
+    """Check that loading publishers/publications doesn't issue queries for each record."""
+
+    # initialize
+    session = init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+
+    def count_queries():
+        query_counts = []
+        for endpoint, kwargs in [
+            ( "search_publisher", { "publ_id": 1 } ),
+            ( "search_publication", { "pub_id": 10 } ),
+            ( "get_publishers", {} ),
+            ( "get_publications", {} ),
+            ( "get_publisher", { "publ_id": 1 } ),
+            ( "get_publication", { "pub_id": 10 } ),
+        ]:
+            with QueryCounter() as query_counter:
+                call_flask( flask_app, endpoint, **kwargs )
+            query_counts.append( query_counter.count )
+        return query_counts
+
+    # get the initial query counts
+    query_counts = count_queries()
+    assert query_counts[-2:] == [ 1, 1 ] # nb: opening a publisher/publication should only need 1 query
+
+    # add a lot more publishers, publications and articles (with images, authors and scenarios)
+    session.bulk_insert_mappings( ImageBlob, [
+        { "image_hash": "test", "image_data": b"...", "image_size": 3, "ref_count": 40 }
+    ] )
+    session.bulk_insert_mappings( Publisher, [
+        { "publ_id": 100+n, "publ_name": "Publisher {}".format(n) }
+        for n in range(0,10)
+    ] )
+    session.bulk_insert_mappings( PublisherImage, [
+        { "publ_id": 100+n, "image_filename": "test.png", "image_hash": "test" }
+        for n in range(0,10)
+    ] )
+    session.bulk_insert_mappings( Publication, [
+        { "pub_id": 100+n, "pub_name": "Publication {}".format(n), "publ_id": 1 }
+        for n in range(0,10)
+    ] )
+    session.bulk_insert_mappings( PublicationImage, [
+        { "pub_id": 100+n, "image_filename": "test.png", "image_hash": "test" }
+        for n in range(0,10)
+    ] )
+    session.bulk_insert_mappings( Article, [
+        { "article_id": 1000+n, "article_title": "Article {}".format(n), "pub_id": 10 if n % 2 else 11 }
+        for n in range(0,20)
+    ] )
+    session.bulk_insert_mappings( ArticleImage, [
+        { "article_id": 1000+n, "image_filename": "test.png", "image_hash": "test" }
+        for n in range(0,20)
+    ] )
+    session.bulk_insert_mappings( ArticleAuthor, [
+        { "article_id": 1000+n, "author_id": 1000 + n%2, "seq_no": 1 }
+        for n in range(0,20)
+    ] )
+    session.bulk_insert_mappings( ArticleScenario, [
+        { "article_id": 1000+n, "scenario_id": 2000 + n%2, "seq_no": 1 }
+        for n in range(0,20)
+    ] )
+    session.commit()
+
+    # check that the query counts haven't changed
+    assert count_queries() == query_counts
+
+# ---------------------------------------------------------------------
+
 def test_make_fts_query_string():
     """Test generating FTS query strings."""
 
@@ -731,3 +931,68 @@ def _do_test_searches( queries, expected ):
     """Run searches and check the results."""
     for query in queries:
         _do_test_search( query, expected )
+
+# ---------------------------------------------------------------------
+
+@pytest.mark.skipif( pytest_options.flask_url is not None, reason="Testing against a remote Flask server." )
+def test_default_search_index( flask_app, dbconn ):
+    """Test the default location of the search index (it should be named after the database)."""
+    prev_config = { "SEARCH_INDEX_PATH": flask_app.config.pop( "SEARCH_INDEX_PATH", None ) }
+    db_hash = hashlib.sha256( flask_app.config[ "SQLALCHEMY_DATABASE_URI" ].encode( "utf-8" ) ).hexdigest()
+    search_index_path = os.path.join( tempfile.gettempdir(), "asl-articles-{}.searchdb".format( db_hash[:12] ) )
+    try:
+        init_tests( None, flask_app, dbconn, fixtures="search.json" )
+        assert os.path.isfile( search_index_path )
+    finally:
+        restore_config( flask_app, prev_config )
+        init_tests( None, flask_app, dbconn )
+        os.unlink( search_index_path )
+
+# ---------------------------------------------------------------------
+
+@pytest.mark.skipif( pytest_options.flask_url is not None, reason="Testing against a remote Flask server." )
+def test_shared_search_index( flask_app, dbconn ):
+    """Test sharing the search index between server processes."""
+
+    # initialize
+    prev_config = { key: flask_app.config.get( key ) for key in ( "SEARCH_INDEX_PATH", "SEARCH_INDEX_SHARED" ) }
+    dname = tempfile.mkdtemp()
+    search_index_path = os.path.join( dname, "search.db" )
+    flask_app.config[ "SEARCH_INDEX_PATH" ] = search_index_path
+    flask_app.config[ "SEARCH_INDEX_SHARED" ] = True
+
+    def get_owners():
+        with SearchDbConn() as dbconn2:
+            return set( row[0] for row in dbconn2.conn.execute( "SELECT owner FROM searchable" ) )
+
+    try:
+
+        # start the server (it should build a new search index)
+        init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+        with SearchDbConn() as dbconn2:
+            assert dbconn2.conn.execute( "PRAGMA journal_mode" ).fetchone()[0] == "wal"
+            dbconn2.conn.execute( "INSERT INTO searchable ( owner ) VALUES ( 'test:1' )" )
+        owners = get_owners()
+        assert "test:1" in owners
+        version = call_flask( flask_app, "get_changes" )[ "version" ]
+
+        # pretend another server process is running, and restart the server (it should use the existing index)
+        with open( search_index_path + ".lock", "w", encoding="utf-8" ) as lock_file:
+            fcntl.flock( lock_file, fcntl.LOCK_SH )
+            init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+            assert get_owners() == owners
+            # NOTE: The server should also be using the same instance ID as before, so that versions
+            # given out by the other server process are still valid.
+            changes = call_flask( flask_app, "get_changes", since=version )
+            assert changes[ "version" ] == version and "reset" not in changes
+
+        # restart the server again (nobody else is running, so it should build a new index)
+        init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+        assert get_owners() == owners - set( [ "test:1" ] )
+        assert call_flask( flask_app, "search", { "query": "publisher" } )
+        assert call_flask( flask_app, "get_changes", since=version )[ "reset" ]
+
+    finally:
+        restore_config( flask_app, prev_config )
+        init_tests( None, flask_app, dbconn )
+        shutil.rmtree( dname )
@@ -1,5 +1,10 @@
 """ Test the startup process. """
 
+import os
+import sys
+import subprocess
+import json
+
 import pytest
 
 import asl_articles.startup
@@ -38,3 +43,35 @@ def test_startup_messages( webdriver, flask_app, dbconn ):
     do_test( "info" )
     do_test( "warning" )
     do_test( "error" )
+
+# ---------------------------------------------------------------------
+
+def test_lazy_imports():
+    """Test that rarely-used modules aren't loaded at startup."""
+
+    # NOTE: We do this in a new process, since everything will already have been loaded into this one.
+    script = "\n".join( [
+        "import sys, json",
+        "import asl_articles",
+        "asl_articles._disable_db_startup = True",
+        "modules = [ 'lxml', 'PIL', 'asl_articles.db_report', 'asl_articles.docs' ]",
+        "loaded = [ [ m for m in modules if m in sys.modules ] ]",
+        "client = asl_articles.app.test_client()",
+        "assert client.get( '/ping' ).data == b'pong'",
+        "loaded.append( [ m for m in modules if m in sys.modules ] )",
+        "assert client.get( '/docs/unknown' ).status_code == 404",
+        "loaded.append( [ m for m in modules if m in sys.modules ] )",
+        "print( json.dumps( loaded ) )",
+    ] )
+    base_dir = os.path.join( os.path.split(__file__)[0], "../.." )
+    env = dict( os.environ, PYTHONPATH=os.path.abspath( base_dir ) )
+    proc = subprocess.run( [ sys.executable, "-c", script ],
+        env=env, stdout=subprocess.PIPE, check=True, universal_newlines=True
+    )
+
+    # check what was loaded
+    assert json.loads( proc.stdout ) == [
+        [], # nb: after startup
+        [], # nb: after /ping
+        [ "asl_articles.docs" ] # nb: after using one of the rarely-used routes
+    ]
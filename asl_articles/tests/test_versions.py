@@ -0,0 +1,193 @@
+""" Test tracking changes to the data. """
+
+import urllib.request
+import urllib.error
+
+import pytest
+
+from asl_articles.versions import DATA_TYPES
+from asl_articles.tests.utils import init_tests, call_flask, restore_config
+from asl_articles.tests import pytest_options
+
+# ---------------------------------------------------------------------
+
+def test_conditional_gets( flask_app, dbconn ):
+    """Test conditional GET's for the data the front-end caches."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+    etags = { dt: _get_data( flask_app, dt, None )[1] for dt in DATA_TYPES }
+
+    def check_etags( expected_changes ):
+        for data_type in DATA_TYPES:
+            status, etag = _get_data( flask_app, data_type, etags[data_type] )
+            if data_type in expected_changes:
+                assert status == 200
+                assert etag != etags[ data_type ]
+                etags[ data_type ] = etag
+            else:
+                assert status == 304
+                assert etag == etags[ data_type ]
+
+    # check that the client is told when it already has the latest data
+    check_etags( [] )
+
+    # create a publisher
+    call_flask( flask_app, "create_publisher", { "publ_name": "New publisher" } )
+    check_etags( [ "publishers" ] )
+
+    # create a publication
+    call_flask( flask_app, "create_publication", { "pub_name": "New publication", "pub_tags": [ "foo" ] } )
+    check_etags( [ "publications", "tags" ] )
+
+    # create an article
+    call_flask( flask_app, "create_article", {
+        "article_title": "New article", "article_authors": [ "New author" ], "article_tags": [ "bar" ]
+    } )
+    check_etags( [ "authors", "tags" ] )
+
+    # delete a publisher
+    call_flask( flask_app, "delete_publisher", publ_id=1 )
+    check_etags( [ "publishers", "publications", "tags" ] )
+
+    # delete a publisher that has no publications
+    resp = call_flask( flask_app, "create_publisher", { "publ_name": "Empty publisher" } )
+    check_etags( [ "publishers" ] )
+    call_flask( flask_app, "delete_publisher", publ_id=resp["record"]["publ_id"] )
+    check_etags( [ "publishers", "tags" ] )
+
+    # check that re-initializing the server invalidates everything
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+    check_etags( DATA_TYPES )
+
+# ---------------------------------------------------------------------
+
+def test_delta_sync( flask_app, dbconn ):
+    """Test getting the data that has changed since a client last checked."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+
+    def get_changes( since ):
+        changes = call_flask( flask_app, "get_changes", since=since )
+        return changes.pop( "version" ), changes
+
+    # check that a client that doesn't know what data it has is told to re-load everything
+    version, changes = get_changes( None )
+    assert changes == { "reset": True }
+    assert get_changes( "unknown.0" )[1] == { "reset": True }
+
+    # check that nothing has changed
+    version2, changes = get_changes( version )
+    assert version2 == version
+    assert changes == {}
+
+    # create a publisher
+    resp = call_flask( flask_app, "create_publisher", { "publ_name": "New publisher" } )
+    publ_id = resp[ "record" ][ "publ_id" ]
+    version, changes = get_changes( version )
+    assert changes == {
+        "publishers": {
+            "updated": { str(publ_id): call_flask( flask_app, "get_publishers" )[ str(publ_id) ] },
+            "deleted": []
+        }
+    }
+
+    # create an article (with a new author and scenario) in a new publication
+    resp = call_flask( flask_app, "create_publication", {
+        "pub_name": "New publication", "publ_id": publ_id, "pub_tags": [ "foo" ]
+    } )
+    pub_id = resp[ "record" ][ "pub_id" ]
+    resp = call_flask( flask_app, "create_article", {
+        "article_title": "New article", "pub_id": pub_id, "article_tags": [ "bar" ],
+        "article_authors": [ "New author" ], "article_scenarios": [ [ "NS1", "New scenario" ] ],
+    } )
+    version, changes = get_changes( version )
+    assert set( changes.keys() ) == { "publications", "authors", "scenarios", "tags" }
+    assert list( changes["publications"]["updated"].keys() ) == [ str(pub_id) ]
+    assert [ a["author_name"] for a in changes["authors"]["updated"].values() ] == [ "New author" ]
+    assert [ s["scenario_name"] for s in changes["scenarios"]["updated"].values() ] == [ "New scenario" ]
+    assert changes["tags"] == call_flask( flask_app, "get_tags" )
+
+    # check that the changes we get match the full data
+    version2, _ = get_changes( None )
+    for data_type in ( "publications", "authors", "scenarios" ):
+        data = call_flask( flask_app, "get_"+data_type )
+        for key, vals in changes[ data_type ]["updated"].items():
+            assert data[ key ] == vals
+
+    # update the publication, then delete its publisher
+    call_flask( flask_app, "update_publication", {
+        "pub_id": pub_id, "pub_name": "Updated publication", "publ_id": publ_id, "pub_tags": []
+    } )
+    call_flask( flask_app, "delete_publisher", publ_id=publ_id )
+    version3, changes = get_changes( version )
+    assert changes[ "publishers" ] == { "updated": {}, "deleted": [ publ_id ] }
+    assert changes[ "publications" ] == { "updated": {}, "deleted": [ pub_id ] }
+    assert "tags" in changes
+    assert "authors" not in changes and "scenarios" not in changes
+
+    # check that we can get the changes made since an intermediate version
+    assert get_changes( version2 ) == ( version3, changes )
+
+    # delete a publisher that has no publications
+    resp = call_flask( flask_app, "create_publisher", { "publ_name": "Empty publisher" } )
+    publ_id = resp[ "record" ][ "publ_id" ]
+    call_flask( flask_app, "delete_publisher", publ_id=publ_id )
+    version3, changes = get_changes( version3 )
+    assert changes[ "publishers" ] == { "updated": {}, "deleted": [ publ_id ] }
+    assert set( changes.keys() ) == { "publishers", "tags" }
+
+    # check that re-initializing the server forces clients to re-load everything
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+    assert get_changes( version3 )[1] == { "reset": True }
+
+# ---------------------------------------------------------------------
+
+@pytest.mark.skipif( pytest_options.flask_url is not None, reason="Testing against a remote Flask server." )
+def test_change_log_size( flask_app, dbconn ):
+    """Test removing old changes from the change log."""
+
+    # initialize
+    init_tests( None, flask_app, dbconn, fixtures="db-report.json" )
+    prev_config = { "CHANGE_LOG_SIZE": flask_app.config.get( "CHANGE_LOG_SIZE" ) }
+    flask_app.config[ "CHANGE_LOG_SIZE" ] = 3
+
+    def get_changes( since ):
+        changes = call_flask( flask_app, "get_changes", since=since )
+        return changes.pop( "version" ), changes
+
+    try:
+
+        # create some publishers
+        version, _ = get_changes( None )
+        for i in range( 0, 5 ):
+            version2, _ = get_changes( None )
+            resp = call_flask( flask_app, "create_publisher", { "publ_name": "Publisher {}".format( i ) } )
+        # NOTE: Old changes are removed before new ones are added, so we have the last 3 changes, plus the new one.
+        assert dbconn.execute( "SELECT count(*) FROM change_log" ).scalar() == 4
+
+        # check that clients that are too far behind are told to re-load everything
+        assert get_changes( version )[1] == { "reset": True }
+
+        # check that clients that are up-to-date can still get the changes
+        changes = get_changes( version2 )[1]
+        assert list( changes[ "publishers" ][ "updated" ].keys() ) == [ str( resp["record"]["publ_id"] ) ]
+
+    finally:
+        restore_config( flask_app, prev_config )
+
+# ---------------------------------------------------------------------
+
+def _get_data( flask_app, data_type, etag ):
+    """Get data from the Flask server."""
+    req = urllib.request.Request( flask_app.url_for( "get_"+data_type ),
+        headers = { "If-None-Match": etag } if etag else {}
+    )
+    try:
+        resp = urllib.request.urlopen( req )
+    except urllib.error.HTTPError as ex:
+        assert ex.code == 304
+        return ex.code, ex.headers[ "ETag" ]
+    assert resp.headers[ "Cache-Control" ] == "no-cache"
+    return resp.code, resp.headers[ "ETag" ]
@@ -10,6 +10,7 @@ import base64
 
 import sqlalchemy
 import sqlalchemy.orm
+import sqlalchemy.engine
 import sqlalchemy.sql.expression
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
@@ -90,8 +91,9 @@ def load_fixtures( session, fname ):
     # save the fixture data in the database
     table_names = [ "publisher", "publication", "article" ]
     table_names.extend( [ "author", "article_author" ] )
-    table_names.extend( [ "publisher_image", "publication_image", "article_image" ] )
+    table_names.extend( [ "publisher_image", "publication_image", "article_image", "image_blob" ] )
     table_names.extend( [ "scenario", "article_scenario" ] )
+    table_names.append( "change_log" )
     for table_name in table_names:
         model = asl_articles.models.get_model_from_table_name( table_name )
         session.query( model ).delete()
@@ -482,6 +484,55 @@ def get_article_row( dbconn, article_id, fields ):
 
 # ---------------------------------------------------------------------
 
+def call_flask( flask_app, endpoint, data=None, **kwargs ):
+    """Call a Flask endpoint, and return the decoded JSON response."""
+    url = flask_app.url_for( endpoint, **kwargs )
+    if data is None:
+        req = urllib.request.Request( url )
+    else:
+        req = urllib.request.Request( url,
+            data = json.dumps( data ).encode( "utf-8" ),
+            headers = { "Content-Type": "application/json" }
+        )
+    return json.load( urllib.request.urlopen( req ) )
+
+def set_image( flask_app, image_type, image_id, fname ):
+    """Upload one of the test images for a publisher, publication or article."""
+    with open( os.path.join( os.path.split(__file__)[0], "fixtures/images", fname ), "rb" ) as fp:
+        image_data = fp.read()
+    url = flask_app.url_for( "upload_image", image_type=image_type, image_id=image_id )
+    req = urllib.request.Request( url+"?filename="+fname, data=image_data )
+    assert json.load( urllib.request.urlopen( req ) )[ "status" ] == "OK"
+    return image_data
+
+def restore_config( flask_app, prev_config ):
+    """Restore Flask config settings that were changed by a test."""
+    for key, val in prev_config.items():
+        if val is None:
+            flask_app.config.pop( key, None ) # nb: the setting wasn't there before
+        else:
+            flask_app.config[ key ] = val
+
+# ---------------------------------------------------------------------
+
+class QueryCounter:
+    """Count the number of SQL queries issued (e.g. by our local Flask server)."""
+
+    def __init__( self ):
+        self.count = 0
+
+    def __enter__( self ):
+        sqlalchemy.event.listen( sqlalchemy.engine.Engine, "before_cursor_execute", self._on_query )
+        return self
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        sqlalchemy.event.remove( sqlalchemy.engine.Engine, "before_cursor_execute", self._on_query )
+
+    def _on_query( self, *args ): #pylint: disable=unused-argument
+        self.count += 1
+
+# ---------------------------------------------------------------------
+
 def call_with_retry( func, expected_exceptions, max_retries=10, delay=0.1 ):
     """Try to call a function, with retries if it fails."""
     for _ in range(0,max_retries):
@@ -7,9 +7,10 @@ import itertools
 import logging
 
 from flask import jsonify, abort
-import lxml.html.clean
+from werkzeug.utils import import_string, cached_property
 
 _html_whitelists = None
+_html_cleaners = {}
 _startup_logger = logging.getLogger( "startup" )
 
 _CONTROL_CHARS = list( ch for ch in itertools.chain( range(0,31+1), range(127,159+1) )
@@ -119,23 +120,7 @@ def clean_html( val, allow_tags=None, safe_attrs=None ): #pylint: disable=too-ma
         val = val[:mo.start()] + marker + val[mo.end():]
 
     # strip the HTML
-    args = {}
-    if allow_tags is None:
-        allow_tags = _html_whitelists.get( "tags" )
-    elif allow_tags == []:
-        allow_tags = [ "" ] # nb: this is how we remove everything :-/
-    if allow_tags:
-        args[ "allow_tags" ] = allow_tags
-        args[ "remove_unknown_tags" ] = None
-    if safe_attrs is None:
-        safe_attrs = _html_whitelists.get( "attrs" )
-        if safe_attrs:
-            safe_attrs.extend( lxml.html.defs.safe_attrs )
-    elif safe_attrs == []:
-        safe_attrs = [ "" ] # nb: this is how we remove everything :-/
-    if safe_attrs:
-        args[ "safe_attrs" ] = safe_attrs
-    cleaner = lxml.html.clean.Cleaner( **args )
+    cleaner = _get_html_cleaner( allow_tags, safe_attrs )
     buf = cleaner.clean_html( val )
 
     # restore the HTML entities
@@ -160,6 +145,42 @@ def clean_html( val, allow_tags=None, safe_attrs=None ): #pylint: disable=too-ma
             buf = buf2
     return buf.strip()
 
+def _get_html_cleaner( allow_tags, safe_attrs ):
+    """Get an HTML cleaner that uses the specified whitelists."""
+
+    # check if we've already created a cleaner for these whitelists
+    # NOTE: We can clean a lot of values in one go (e.g. when importing articles), so we re-use cleaners.
+    key = (
+        tuple( allow_tags ) if allow_tags is not None else None,
+        tuple( safe_attrs ) if safe_attrs is not None else None
+    )
+    if key in _html_cleaners:
+        return _html_cleaners[ key ]
+
+    # nope - create a new one
+    # NOTE: lxml is slow to load, and we don't need it until someone saves something.
+    import lxml.html.clean #pylint: disable=import-outside-toplevel
+    args = {}
+    if allow_tags is None:
+        allow_tags = _html_whitelists.get( "tags" )
+    elif allow_tags == []:
+        allow_tags = [ "" ] # nb: this is how we remove everything :-/
+    if allow_tags:
+        args[ "allow_tags" ] = allow_tags
+        args[ "remove_unknown_tags" ] = None
+    if safe_attrs is None:
+        safe_attrs = _html_whitelists.get( "attrs" )
+        if safe_attrs:
+            # NOTE: We need to make a copy of the whitelist here, not extend it in-place.
+            safe_attrs = safe_attrs + list( lxml.html.defs.safe_attrs )
+    elif safe_attrs == []:
+        safe_attrs = [ "" ] # nb: this is how we remove everything :-/
+    if safe_attrs:
+        args[ "safe_attrs" ] = safe_attrs
+    cleaner = lxml.html.clean.Cleaner( **args )
+    _html_cleaners[ key ] = cleaner
+    return cleaner
+
 def load_html_whitelists( app ):
     """Load the HTML whitelists."""
     global _html_whitelists
@@ -233,3 +254,43 @@ def to_bool( val ):
 def squash_spaces( val ):
     """Squash multiple spaces down into a single space."""
     return " ".join( val.split() )
+
+# ---------------------------------------------------------------------
+
+# NOTE: Older versions of SQLite limit the number of parameters in a single statement to 999.
+MAX_SQL_PARAMS = 500
+
+def parse_id_list( val ):
+    """Parse a comma-separated list of ID's."""
+    if not val:
+        return []
+    try:
+        ids = [ int(v) for v in val.split( "," ) if v.strip() ]
+    except ValueError:
+        abort( 400, "Invalid ID list: {}".format( val ) )
+    return ids
+
+def get_batches( vals, batch_size=MAX_SQL_PARAMS ):
+    """Split a list of values into batches (e.g. so that they can be used in an IN clause)."""
+    for pos in range( 0, len(vals), batch_size ):
+        yield vals[ pos : pos+batch_size ]
+
+# ---------------------------------------------------------------------
+
+class LazyView:
+    """A Flask view function that isn't loaded until it is first used."""
+
+    # NOTE: This lets us register routes for modules that are rarely used (e.g. the database report),
+    # without having to import them (and everything they import) when the server starts up.
+
+    def __init__( self, import_name ):
+        self.__module__, self.__name__ = import_name.rsplit( ".", 1 )
+        self.import_name = import_name
+
+    @cached_property
+    def view( self ):
+        """Load the view function."""
+        return import_string( self.import_name )
+
+    def __call__( self, *args, **kwargs ):
+        return self.view( *args, **kwargs ) #pylint: disable=not-callable
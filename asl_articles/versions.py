@@ -0,0 +1,134 @@
+""" Track changes to the data, so that clients can cache it. """
+
+import uuid
+import sqlite3
+import datetime
+
+from flask import request, jsonify, make_response
+from sqlalchemy.sql.expression import func
+
+from asl_articles import app, db
+from asl_articles.models import ChangeLog
+
+# NOTE: These are the types of data that the front-end loads in full and caches (see DataCache.js).
+DATA_TYPES = [ "publishers", "publications", "authors", "scenarios", "tags" ]
+
+_DEFAULT_CHANGE_LOG_SIZE = 10000
+
+_instance_id = uuid.uuid4().hex[:12]
+
+# ---------------------------------------------------------------------
+
+def log_changes( data_type, record_ids=None, deleted=False ):
+    """Record changes to the data."""
+    # NOTE: The change-log rows are saved when the caller commits, so they are written in the same transaction
+    # as the changes themselves. If no record ID's are given, the data is treated as having changed as a whole.
+    assert data_type in DATA_TYPES
+    if record_ids is None:
+        record_ids = [ None ]
+    elif not record_ids:
+        return # nb: nothing has changed
+    _prepare_change_log()
+    now = datetime.datetime.now()
+    for record_id in record_ids:
+        db.session.add(
+            ChangeLog( data_type=data_type, record_id=record_id, deleted=deleted, time_changed=now )
+        )
+
+def _prepare_change_log():
+    """Get the change log ready for new changes to be added."""
+
+    # NOTE: Clients use the latest change ID as the version of the data they have, so change ID's must become
+    # visible in the order they were allocated, otherwise a client could see version N before the transaction
+    # that has change ID N-1 commits, and would never get that change. SQLite only lets one transaction write
+    # at a time, but Postgres allocates sequence values outside of transactions, so we lock the table
+    # (until the caller commits), so that only one transaction at a time can be adding changes.
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute( "LOCK TABLE change_log IN EXCLUSIVE MODE" )
+
+    # remove old changes
+    # NOTE: We always keep the latest change, so that change ID's are never re-used. Clients whose version
+    # is older than the changes we still have will be told to re-load everything (see parse_version_string()).
+    max_changes = max( int( app.config.get( "CHANGE_LOG_SIZE", _DEFAULT_CHANGE_LOG_SIZE ) ), 1 )
+    version = get_version()
+    if version > max_changes:
+        ChangeLog.query.filter( ChangeLog.change_id <= version - max_changes ) \
+            .delete( synchronize_session=False )
+
+def invalidate_versions( instance_id ):
+    """Note that all data may have changed."""
+    # NOTE: We use this when the data has been changed from outside the normal create/update/delete handlers
+    # e.g. when the server starts up, or the test suite loads new fixtures. If we are running as multiple
+    # server processes, they must all use the same instance ID, otherwise the version strings and ETag's
+    # that one process gives out would be rejected by the others (see _init_shared_search_index()).
+    global _instance_id
+    _instance_id = instance_id
+
+def save_instance_id( conn ):
+    """Generate a new instance ID, and save it in an SQLite database (so that other server processes can use it)."""
+    instance_id = uuid.uuid4().hex[:12]
+    conn.execute( "CREATE TABLE server_instance ( instance_id )" )
+    conn.execute( "INSERT INTO server_instance ( instance_id ) VALUES ( ? )", ( instance_id, ) )
+    return instance_id
+
+def load_instance_id( conn ):
+    """Load the instance ID saved in an SQLite database."""
+    try:
+        return conn.execute( "SELECT instance_id FROM server_instance" ).fetchone()[0]
+    except sqlite3.OperationalError:
+        return None # nb: the database is empty, or was created by an older version of the program
+
+def get_version( data_type=None ):
+    """Get the current version of the data."""
+    query = db.session.query( func.max( ChangeLog.change_id ) )
+    if data_type:
+        query = query.filter( ChangeLog.data_type == data_type )
+    version = query.scalar()
+    if version is None:
+        # NOTE: If the changes for this data type have been removed from the change log, we don't know
+        # when it was last changed, but it can't have been after the oldest change we still have.
+        version = _get_oldest_version()
+    return version
+
+def _get_oldest_version():
+    """Get the oldest version of the data we know about."""
+    oldest_change_id = ChangeLog.query.with_entities( func.min( ChangeLog.change_id ) ).scalar()
+    return oldest_change_id - 1 if oldest_change_id else 0
+
+def make_version_string( version ):
+    """Convert a version number into something that can be given to a client."""
+    return "{}.{}".format( _instance_id, version )
+
+def parse_version_string( version ):
+    """Convert a version string provided by a client back into a version number."""
+    # NOTE: We return None if the version is from a previous instance of the server, or is older than
+    # the changes we still have in the change log, since we can't know what changes have been made since then.
+    if not version:
+        return None
+    instance_id, _, version = version.partition( "." )
+    if instance_id != _instance_id or not version.isdigit():
+        return None
+    version = int( version )
+    if version < _get_oldest_version():
+        return None
+    return version
+
+# ---------------------------------------------------------------------
+
+def make_conditional_response( data_type, get_data ):
+    """Return data to the caller, unless they already have the latest version of it."""
+
+    # NOTE: We get the version before generating the data, so if the data changes while we're doing this,
+    # the client will get the newer data with an older ETag, and so will just re-fetch it next time.
+    etag = "{}-{}-{}".format( _instance_id, data_type, get_version(data_type) )
+
+    # check if the client already has the latest version of the data
+    if request.if_none_match.contains( etag ):
+        resp = make_response( "", 304 )
+    else:
+        resp = jsonify( get_data() )
+
+    # NOTE: "no-cache" means that browsers can store the response, but must check with us before re-using it.
+    resp.set_etag( etag )
+    resp.headers[ "Cache-Control" ] = "no-cache"
+    return resp
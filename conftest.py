@@ -98,6 +98,10 @@ def flask_app( request ):
         # FUDGE! If we're going to create our own Flask server, we want to stop it from checking
         # the *configured* database connection string (since it will fail to start if there's a problem).
         asl_articles._disable_db_startup = True #pylint: disable=protected-access
+        # NOTE: The default search index is named after the database, but each test uses a new temp database,
+        # so we use the same search index for all of them (otherwise we would leave one behind for each test).
+        if not app.config.get( "SEARCH_INDEX_PATH" ):
+            app.config[ "SEARCH_INDEX_PATH" ] = os.path.join( tempfile.gettempdir(), "asl-articles-test.searchdb" )
         # yup - make it so
         thread = threading.Thread(
             target = lambda: app.run(
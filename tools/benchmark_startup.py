@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+""" Measure how long the backend server takes to start up.
+
+Each run starts a fresh Python process, and measures how long it takes to import the webapp,
+and then answer its first request (/ping). Use --profile to see which modules are the slowest to import.
+
+NOTE: The database startup checks (and building the search index) are disabled, since they depend
+on the database being used, not on how quickly the server itself can load.
+"""
+
+import sys
+import os
+import subprocess
+import statistics
+import argparse
+
+# NOTE: This is run in a separate process, so that nothing has already been imported.
+_BENCHMARK_SCRIPT = """
+import time
+start_time = time.perf_counter()
+import asl_articles
+import_time = time.perf_counter() - start_time
+asl_articles._disable_db_startup = True
+resp = asl_articles.app.test_client().get( "/ping" )
+assert resp.data == b"pong"
+print( import_time, time.perf_counter() - start_time )
+"""
+
+# ---------------------------------------------------------------------
+
+def main():
+    """Measure how long the backend server takes to start up."""
+
+    # parse the command line arguments
+    parser = argparse.ArgumentParser( description="Measure how long the backend server takes to start up." )
+    parser.add_argument( "--runs", type=int, default=10, help="Number of times to start the server." )
+    parser.add_argument( "--profile", type=int, default=0, metavar="N",
+        help="Show the N slowest modules to import."
+    )
+    args = parser.parse_args()
+
+    # start the server multiple times
+    import_times, ping_times = [], []
+    for _ in range( 0, args.runs ):
+        import_time, ping_time = _run( [ "-c", _BENCHMARK_SCRIPT ] ).split()
+        import_times.append( float( import_time ) )
+        ping_times.append( float( ping_time ) )
+    print( "Import time:     {}".format( _format_times( import_times ) ) )
+    print( "Time to /ping:   {}".format( _format_times( ping_times ) ) )
+
+    # show the slowest imports
+    if args.profile:
+        print()
+        print( "Slowest imports (cumulative time):" )
+        for module_name, cumulative_time in get_import_times()[ :args.profile ]:
+            print( "  {:7.1f}ms  {}".format( cumulative_time * 1000, module_name ) )
+
+def get_import_times():
+    """Get the time taken to import each module (slowest first)."""
+    output = _run( [ "-X", "importtime", "-c", "import asl_articles" ], stderr=True )
+    import_times = []
+    for line in output.splitlines():
+        if not line.startswith( "import time:" ):
+            continue
+        _, cumulative_time, module_name = line[ len("import time:"): ].split( "|" )
+        if not cumulative_time.strip().isdigit():
+            continue # nb: this is the header line
+        import_times.append( ( module_name.strip(), int( cumulative_time ) / 1000000 ) )
+    import_times.sort( key=lambda t: t[1], reverse=True )
+    return import_times
+
+def _run( args, stderr=False ):
+    """Run a Python script in a new process."""
+    base_dir = os.path.join( os.path.split(__file__)[0], ".." )
+    env = dict( os.environ, PYTHONPATH=os.path.abspath( base_dir ) )
+    proc = subprocess.run( [ sys.executable ] + args,
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, universal_newlines=True
+    )
+    return proc.stderr if stderr else proc.stdout
+
+def _format_times( times ):
+    """Format a list of times."""
+    return "median={:.1f}ms, min={:.1f}ms, max={:.1f}ms".format(
+        statistics.median( times ) * 1000, min( times ) * 1000, max( times ) * 1000
+    )
+
+# ---------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -500,11 +500,16 @@ export class App extends React.Component
         return this.makeFlaskUrl( "/docs/" + encodeURIComponent( url ) ) ;
     }
 
-    makeFlaskImageUrl( type, imageId ) {
+    makeFlaskImageUrl( type, imageId, imageVersion ) {
         // generate an image URL for the Flask backend server
         if ( ! imageId )
             return null ;
         let url = this.makeFlaskUrl( "/images/" + type + "/" + imageId ) ;
+        if ( imageVersion ) {
+            // NOTE: The backend gives us a version that changes whenever the image changes, so the browser
+            // can cache the image for as long as it likes.
+            return url + "?v=" + imageVersion ;
+        }
         const key = this._makeFlaskImageKey( type, imageId ) ;
         if ( ! this._flaskImageUrlVersions[ key ] ) {
             // NOTE: It would be nice to only add this if necessary (i.e. the user has changed
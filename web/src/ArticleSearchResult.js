@@ -7,6 +7,7 @@ import { PublisherSearchResult } from "./PublisherSearchResult.js" ;
 import { PublicationSearchResult } from "./PublicationSearchResult.js" ;
 import { PreviewableImage } from "./PreviewableImage.js" ;
 import { RatingStars } from "./RatingStars.js" ;
+import { SEARCH_RESULT_THUMBNAIL_WIDTH } from "./constants.js" ;
 import { gAppRef } from "./App.js" ;
 import { makeScenarioDisplayName, updateRecord, makeCommaList } from "./utils.js" ;
 
@@ -27,7 +28,7 @@ export class ArticleSearchResult extends React.Component
         ) ;
         const parent_pub = this.props.data._parent_pub ;
         const parent_publ = this.props.data._parent_publ ;
-        const image_url = gAppRef.makeFlaskImageUrl( "article", this.props.data.article_image_id ) ;
+        const image_url = gAppRef.makeFlaskImageUrl( "article", this.props.data.article_image_id, this.props.data.article_image_version ) ;
 
         // prepare the article's URL
         let article_url = this.props.data.article_url ;
@@ -135,7 +136,7 @@ export class ArticleSearchResult extends React.Component
                 { display_subtitle && <div className="subtitle" dangerouslySetInnerHTML={{ __html: display_subtitle }} /> }
             </div>
             <div className="content">
-                { image_url && <PreviewableImage url={image_url} noActivate={true} className="image" alt="Article." /> }
+                { image_url && <PreviewableImage url={image_url} thumbnailWidth={SEARCH_RESULT_THUMBNAIL_WIDTH} noActivate={true} className="image" alt="Article." /> }
                 <div className="snippet" dangerouslySetInnerHTML={{__html: display_snippet}} />
             </div>
             <div className="footer">
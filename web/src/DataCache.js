@@ -50,10 +50,43 @@ export class DataCache
     }
 
     refresh( keys, onOK ) {
-        // refresh the specified keys
-        for ( let key of keys )
-            delete this.data[ key ] ;
-        this.get( keys, onOK ) ;
+        // find out what's changed since we last checked
+        // NOTE: If we don't have a version yet, the backend will tell us to reset, and we re-load everything.
+        axios.get(
+            gAppRef.makeFlaskUrl( "/changes", this.version ? { since: this.version } : null )
+        ).then( resp => {
+            // update the cache
+            if ( resp.data.reset )
+                this.data = {} ;
+            else
+                this._applyChanges( resp.data ) ;
+            this.version = resp.data.version ;
+            // make sure we have the specified keys
+            this.get( keys, onOK ) ;
+        } ).catch( err => {
+            gAppRef.showErrorToast(
+                <div> Couldn't check for changes: <div className="monospace"> {err.toString()} </div> </div>
+            ) ;
+        } ) ;
+    }
+
+    _applyChanges( changes ) {
+        // apply the changes to the data we have cached
+        for ( let key in this.data ) {
+            if ( changes[ key ] === undefined )
+                continue ;
+            if ( key === "tags" ) {
+                // NOTE: The backend returns all the tags if any of them have changed.
+                this.data[ key ] = changes[ key ] ;
+                continue ;
+            }
+            let data = { ...this.data[ key ] } ;
+            for ( let id in changes[ key ].updated )
+                data[ id ] = changes[ key ].updated[ id ] ;
+            for ( let id of changes[ key ].deleted )
+                delete data[ id ] ;
+            this.data[ key ] = data ;
+        }
     }
 
 }
@@ -9,6 +9,8 @@ import { makeCollapsibleList, pluralString, isLink } from "./utils.js" ;
 
 const axios = require( "axios" ) ;
 
+const LINK_CHECK_POLL_INTERVAL = 500 ; // nb: milliseconds
+
 // --------------------------------------------------------------------
 
 export class DbReport extends React.Component
@@ -173,95 +175,181 @@ class DbLinks extends React.Component
         const inProgress = ! this.state.checkLinksInProgress ;
         this.setState( { checkLinksInProgress: inProgress } ) ;
         if ( inProgress )
-            this._checkNextLink() ;
+            this._startCheckLinks() ;
+        else
+            this._stopCheckLinks() ;
     }
 
-    _checkNextLink( force ) {
-
-        // check if this is the start of a new run
-        if ( this.state.currLinkToCheck === 0 && !force ) {
-            // yup - reset the UI
-            this.setState( { linkErrors: {} } ) ;
-            // NOTE: If the user is checking the links *again*, it could be because some links were flagged
-            // during the first run, they've fixed them up, and want to check everything again. In this case,
-            // we need to re-fetch the links from the database.
-            if ( ! this.state.isFirstLinkCheck ) {
-                this._getLinksToCheck(
-                    () => { this._checkNextLink( true ) ; },
-                    () => { this.setState( { checkLinksInProgress: false } ) ; }
-                ) ;
-                return ;
-            }
-        }
+    _startCheckLinks( force ) {
 
-        // check if this is the end of a run
-        if ( this.state.currLinkToCheck >= this.state.linksToCheck.length ) {
-            // yup - reset the UI
-            this.setState( {
-                checkLinksStatusMsg: "Checked " + pluralString( this.state.linksToCheck.length, "link" ) + ".",
-                currLinkToCheck: 0, // nb: to allow the user to check again
-                checkLinksInProgress: false,
-                isFirstLinkCheck: false,
-            } ) ;
+        // NOTE: If the user is checking the links *again*, it could be because some links were flagged
+        // during the first run, they've fixed them up, and want to check everything again. In this case,
+        // we need to re-fetch the links from the database.
+        if ( ! this.state.isFirstLinkCheck && !force ) {
+            this._getLinksToCheck(
+                () => { this._startCheckLinks( true ) ; },
+                () => { this.setState( { checkLinksInProgress: false } ) ; }
+            ) ;
             return ;
         }
 
-        // get the next link to check
-        const linkToCheck = this.state.linksToCheck[ this.state.currLinkToCheck ] ;
-        this.setState( { currLinkToCheck: this.state.currLinkToCheck + 1 } ) ;
+        // reset the UI
+        this.setState( { linkErrors: {}, currLinkToCheck: 0 } ) ;
 
-        let continueCheckLinks = () => {
-            // update the UI
-            this.setState( { checkLinksStatusMsg:
-                "Checked " + this.state.currLinkToCheck + " of " + pluralString( this.state.linksToCheck.length, "link" ) + "..."
+        // figure out which links need to be checked by the backend
+        // NOTE: Because of CORS, we have to proxy URL's that don't belong to us via the backend :-/
+        // We give it all of them at once, and it checks them in the background, while we check the links
+        // to local documents ourself.
+        let run = { linksByUrl: {}, localLinks: [], nChecked: 0, nLocalChecked: 0, nResults: 0 } ;
+        for ( let linkToCheck of this.state.linksToCheck ) {
+            let url = linkToCheck[3] ;
+            if ( url.substr( 0, 14 ) === "http://{FLASK}" )
+                url = gAppRef.makeFlaskUrl( url.substr( 14 ) ) ;
+            if ( isLink( url ) ) {
+                if ( run.linksByUrl[ url ] === undefined )
+                    run.linksByUrl[ url ] = [] ;
+                run.linksByUrl[ url ].push( linkToCheck ) ;
+            } else
+                run.localLinks.push( linkToCheck ) ;
+        }
+        this._linkCheckRun = run ;
+
+        // start checking the links
+        const urls = Object.keys( run.linksByUrl ) ;
+        run.isJobFinished = urls.length === 0 ;
+        if ( urls.length > 0 ) {
+            axios.post(
+                gAppRef.makeFlaskUrl( "/db-report/check-links" ), { urls: urls }
+            ).then( resp => {
+                run.jobId = resp.data.jobId ;
+                if ( run.isStopped )
+                    this._stopCheckLinks() ;
+                else
+                    this._pollLinkCheckJob( run ) ;
+            } ).catch( err => {
+                gAppRef.showErrorResponse( "Can't check the links", err ) ;
+                this._stopCheckLinks() ;
             } ) ;
-            // check the next link
-            if ( this.state.checkLinksInProgress )
-                this._checkNextLink() ;
         }
+        this._checkNextLocalLink( run ) ;
+    }
 
-        // check the next link
-        let url = linkToCheck[3] ;
-        if ( url.substr( 0, 14 ) === "http://{FLASK}" )
-            url = gAppRef.makeFlaskUrl( url.substr( 14 ) ) ;
-        // NOTE: Because of CORS, we have to proxy URL's that don't belong to us via the backend :-/
-        let req = isLink( url )
-            ? axios.post( gAppRef.makeFlaskUrl( "/db-report/check-link", {url:url} ) )
-            : axios.head( gAppRef.makeExternalDocUrl( url ) ) ;
-        req.then( resp => {
-            // the link worked - continue checking links
-            continueCheckLinks() ;
+    _stopCheckLinks() {
+        // stop checking links
+        const run = this._linkCheckRun ;
+        if ( run && ! run.isStopped ) {
+            run.isStopped = true ;
+            if ( run.jobId && ! run.isJobFinished )
+                axios.post( gAppRef.makeFlaskUrl( "/db-report/check-links/" + run.jobId + "/stop" ) ) ;
+        }
+        this.setState( {
+            currLinkToCheck: 0, // nb: the next run will start from the beginning
+            checkLinksInProgress: false,
+        } ) ;
+    }
+
+    _pollLinkCheckJob( run ) {
+        // get the latest results from the backend
+        axios.get(
+            gAppRef.makeFlaskUrl( "/db-report/check-links/" + run.jobId, {start:run.nResults} )
+        ).then( resp => {
+            if ( run.isStopped )
+                return ;
+            for ( let result of resp.data.results ) {
+                run.nResults += 1 ;
+                const errorMsg = result.status ? "HTTP " + result.status : null ;
+                for ( let linkToCheck of run.linksByUrl[ result.url ] || [] )
+                    this._onLinkChecked( run, linkToCheck, result.ok, errorMsg ) ;
+            }
+            if ( resp.data.finished ) {
+                run.isJobFinished = true ;
+                this._checkLinkCheckFinished( run ) ;
+            } else
+                setTimeout( () => { this._pollLinkCheckJob( run ) ; }, LINK_CHECK_POLL_INTERVAL ) ;
         } ).catch( err => {
-            // the link failed - record the error
+            gAppRef.showErrorResponse( "Can't get the link check results", err ) ;
+            this._stopCheckLinks() ;
+        } ) ;
+    }
+
+    _checkNextLocalLink( run ) {
+
+        // check if we've checked all the local links
+        if ( run.isStopped )
+            return ;
+        if ( run.nLocalChecked >= run.localLinks.length ) {
+            this._checkLinkCheckFinished( run ) ;
+            return ;
+        }
+
+        // check the next local link
+        const linkToCheck = run.localLinks[ run.nLocalChecked ] ;
+        axios.head(
+            gAppRef.makeExternalDocUrl( linkToCheck[3] )
+        ).then( resp => {
+            run.nLocalChecked += 1 ;
+            this._onLinkChecked( run, linkToCheck, true, null ) ;
+            this._checkNextLocalLink( run ) ;
+        } ).catch( err => {
+            run.nLocalChecked += 1 ;
+            const errorMsg = err.response ? "HTTP " + err.response.status : null ;
+            this._onLinkChecked( run, linkToCheck, false, errorMsg ) ;
+            this._checkNextLocalLink( run ) ;
+        } ) ;
+
+    }
+
+    _onLinkChecked( run, linkToCheck, isOK, errorMsg ) {
+        // check if the link failed
+        if ( run.isStopped )
+            return ;
+        if ( ! isOK ) {
+            // yup - record the error
             let newLinkErrors = this.state.linkErrors ;
             if ( newLinkErrors[ linkToCheck[0] ] === undefined )
                 newLinkErrors[ linkToCheck[0] ] = [] ;
-            const errorMsg = err.response ? "HTTP " + err.response.status : null ;
             newLinkErrors[ linkToCheck[0] ].push( [ linkToCheck, errorMsg ] ) ;
             this.setState( { linkErrors: newLinkErrors } ) ;
-            // continue checking links
-            continueCheckLinks() ;
+        }
+        // update the UI
+        run.nChecked += 1 ;
+        this.setState( {
+            currLinkToCheck: run.nChecked,
+            checkLinksStatusMsg: "Checked " + run.nChecked + " of " + pluralString( this.state.linksToCheck.length, "link" ) + "...",
         } ) ;
+    }
 
+    _checkLinkCheckFinished( run ) {
+        // check if this is the end of a run
+        if ( run.isStopped || run.nLocalChecked < run.localLinks.length || ! run.isJobFinished )
+            return ;
+        // yup - reset the UI
+        this.setState( {
+            checkLinksStatusMsg: "Checked " + pluralString( this.state.linksToCheck.length, "link" ) + ".",
+            currLinkToCheck: 0, // nb: to allow the user to check again
+            checkLinksInProgress: false,
+            isFirstLinkCheck: false,
+        } ) ;
     }
 
     _getLinksToCheck( onOK, onError ) {
         // get the links in the database
+        // NOTE: The links are returned as newline-delimited JSON, one [table,id,name,url] row per line.
         axios.get(
-            gAppRef.makeFlaskUrl( "/db-report/links" )
+            gAppRef.makeFlaskUrl( "/db-report/links" ),
+            { responseType: "text", transformResponse: data => data } // nb: stop axios from trying to parse it
         ).then( resp => {
-            const dbLinks = resp.data ;
-            // flatten the links to a list
+            let dbLinks = { publisher: [], publication: [], article: [] } ;
             let linksToCheck = [] ;
-            for ( let key of [ "publisher", "publication", "article" ] ) {
-                for ( let row of dbLinks[key] ) {
-                    linksToCheck.push( [
-                        key, row[0], row[1], row[2]
-                    ] ) ;
-                }
+            for ( let line of resp.data.split( "\n" ) ) {
+                if ( line === "" )
+                    continue ;
+                const linkToCheck = JSON.parse( line ) ;
+                dbLinks[ linkToCheck[0] ].push( linkToCheck ) ;
+                linksToCheck.push( linkToCheck ) ;
             }
             this.setState( {
-                dbLinks: resp.data,
+                dbLinks: dbLinks,
                 linksToCheck: linksToCheck,
                 currLinkToCheck: 0,
             } ) ;
@@ -320,7 +408,7 @@ class DbImages extends React.Component
                 const row = dbImages.duplicates[hash][ 0 ] ;
                 const imageUrl = gAppRef.makeFlaskImageUrl( row[0], row[1] ) ;
                 const caption = ( <span>
-                    Found a duplicate image <span className="hash">(md5:{hash})</span>
+                    Found a duplicate image <span className="hash">(sha256:{hash})</span>
                     </span>
                 ) ;
                 dupeImages.push( <div className="dupe-image" style={{display:"flex"}} key={hash} >
@@ -11,8 +11,13 @@ export class PreviewableImage extends React.Component
     // This class is a wrapper around the jQuery-based imageZoom plugin.
 
     render() {
+        // NOTE: If a thumbnail width is given, we show a smaller version of the image (generated by the backend),
+        // and the full-sized one is only loaded if the user wants to preview it.
+        let imageUrl = this.props.url ;
+        if ( this.props.thumbnailWidth )
+            imageUrl += ( imageUrl.indexOf( "?" ) >= 0 ? "&" : "?" ) + "w=" + this.props.thumbnailWidth ;
         return ( <a href={this.props.url} className="preview" target="_blank" rel="noopener noreferrer">
-            <img src={this.props.url} className={this.props.className} style={this.props.style} alt={this.props.altText} />
+            <img src={imageUrl} className={this.props.className} style={this.props.style} alt={this.props.altText} />
         </a> ) ;
     }
 
@@ -4,7 +4,7 @@ import { Menu, MenuList, MenuButton, MenuItem } from "@reach/menu-button" ;
 import "./PublicationSearchResult.css" ;
 import { PublicationSearchResult2 } from "./PublicationSearchResult2.js" ;
 import { PreviewableImage } from "./PreviewableImage.js" ;
-import { PUBLICATION_EXCESS_ARTICLE_THRESHOLD } from "./constants.js" ;
+import { PUBLICATION_EXCESS_ARTICLE_THRESHOLD, SEARCH_RESULT_THUMBNAIL_WIDTH } from "./constants.js" ;
 import { gAppRef } from "./App.js" ;
 import { makeCollapsibleList, pluralString, updateRecord } from "./utils.js" ;
 
@@ -107,7 +107,7 @@ export class PublicationSearchResult extends React.Component
                 }
             </div>
             <div className="content">
-                { image_url && <PreviewableImage url={image_url} noActivate={true} className="image" alt="Publication." /> }
+                { image_url && <PreviewableImage url={image_url} thumbnailWidth={SEARCH_RESULT_THUMBNAIL_WIDTH} noActivate={true} className="image" alt="Publication." /> }
                 <div className="description" dangerouslySetInnerHTML={{__html: display_description}} />
                 { makeCollapsibleList( "Articles", articles, PUBLICATION_EXCESS_ARTICLE_THRESHOLD, {float:"left",marginBottom:"0.25em"} ) }
             </div>
@@ -259,12 +259,12 @@ export class PublicationSearchResult extends React.Component
     _makeDisplayName( allowAlternateContent ) { return PublicationSearchResult.makeDisplayName( this.props.data, allowAlternateContent ) ; }
 
     static _makeImageUrl( vals ) {
-        let image_url = gAppRef.makeFlaskImageUrl( "publication", vals.pub_image_id ) ;
+        let image_url = gAppRef.makeFlaskImageUrl( "publication", vals.pub_image_id, vals.pub_image_version ) ;
         if ( ! image_url ) {
             // check if the parent publisher has an image
             const parent_publ = vals._parent_publ ;
             if ( parent_publ )
-                image_url = gAppRef.makeFlaskImageUrl( "publisher", parent_publ.publ_image_id ) ;
+                image_url = gAppRef.makeFlaskImageUrl( "publisher", parent_publ.publ_image_id, parent_publ.publ_image_version ) ;
         }
         return image_url ;
     }
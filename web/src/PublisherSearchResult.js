@@ -5,7 +5,7 @@ import { PublisherSearchResult2 } from "./PublisherSearchResult2.js"
 import "./PublisherSearchResult.css" ;
 import { PublicationSearchResult } from "./PublicationSearchResult.js"
 import { PreviewableImage } from "./PreviewableImage.js" ;
-import { PUBLISHER_EXCESS_PUBLICATION_THRESHOLD, PUBLISHER_EXCESS_ARTICLE_THRESHOLD } from "./constants.js" ;
+import { PUBLISHER_EXCESS_PUBLICATION_THRESHOLD, PUBLISHER_EXCESS_ARTICLE_THRESHOLD, SEARCH_RESULT_THUMBNAIL_WIDTH } from "./constants.js" ;
 import { gAppRef } from "./App.js" ;
 import { makeCollapsibleList, pluralString, updateRecord } from "./utils.js" ;
 
@@ -23,7 +23,7 @@ export class PublisherSearchResult extends React.Component
         const display_description = PreviewableImage.adjustHtmlForPreviewableImages(
             this.props.data[ "publ_description!" ] || this.props.data.publ_description
         ) ;
-        const image_url = gAppRef.makeFlaskImageUrl( "publisher", this.props.data.publ_image_id ) ;
+        const image_url = gAppRef.makeFlaskImageUrl( "publisher", this.props.data.publ_image_id, this.props.data.publ_image_version ) ;
 
         // prepare the publisher's URL
         let publ_url = this.props.data.publ_url ;
@@ -86,7 +86,7 @@ export class PublisherSearchResult extends React.Component
                 }
             </div>
             <div className="content">
-                { image_url && <PreviewableImage url={image_url} noActivate={true} className="image" alt="Publisher." /> }
+                { image_url && <PreviewableImage url={image_url} thumbnailWidth={SEARCH_RESULT_THUMBNAIL_WIDTH} noActivate={true} className="image" alt="Publisher." /> }
                 <div className="description" dangerouslySetInnerHTML={{__html: display_description}} />
                 { makeCollapsibleList( "Publications", pubs, PUBLISHER_EXCESS_PUBLICATION_THRESHOLD, {float:"left"} ) }
                 { makeCollapsibleList( "Articles", articles, PUBLISHER_EXCESS_ARTICLE_THRESHOLD, {clear:"both",float:"left"} ) }
@@ -1,6 +1,7 @@
 export const APP_NAME = "ASL Articles" ;
 
 export const MAX_IMAGE_UPLOAD_SIZE = ( 1 * 1024*1024 ) ;
+export const SEARCH_RESULT_THUMBNAIL_WIDTH = 192 ; // nb: images are shown at 6em, this allows for high-DPI screens
 
 export const PUBLISHER_EXCESS_PUBLICATION_THRESHOLD = 5 ;
 export const PUBLISHER_EXCESS_ARTICLE_THRESHOLD = 5 ;